@@ -0,0 +1,169 @@
+"""
+HTTP API for users and reminders.
+
+Run with: uvicorn app.api:app
+
+Handlers are async and use an AsyncSession, so waiting on the database never
+blocks the event loop. The business rules stay in app.services: each handler
+runs the existing sync service function on the async session's connection via
+AsyncSession.run_sync. Provider webhooks are buffered and written in batches
+by a background task (see app.webhooks).
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from urllib.parse import parse_qsl
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import services
+from app.config import TWILIO_AUTH_TOKEN, WEBHOOK_BASE_URL, WEBHOOK_FLUSH_INTERVAL, WEBHOOK_VALIDATE_SIGNATURE
+from app.database import get_async_db, init_db
+from app.models import Account, MessageTemplate, Reminder
+from app.schemas import (
+    UserCreate, UserOut, ReminderCreate, ReminderOut, OptOutRequest, BatchResult, RowError,
+    TemplateCreate, TemplateOut, AccountCreate, AccountOut, ReminderSeriesCreate, ReminderSeriesOut
+)
+from app.webhooks import CallbackBuffer, CallbackFlusher, parse_inbound, parse_status
+
+callback_buffer = CallbackBuffer()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_db()
+    # Honour dependency overrides so the flusher writes where the handlers do
+    flusher = CallbackFlusher(callback_buffer, app.dependency_overrides.get(get_async_db, get_async_db))
+    task = asyncio.create_task(flusher.run())
+    yield
+    flusher.stop()
+    await task
+
+app = FastAPI(title="Reminder Service", lifespan=lifespan)
+
+async def _require_user(db: AsyncSession, user_id: int):
+    # Through the user cache: reminder creation only needs to know the user exists
+    user = await db.run_sync(services.lookup_user_by_id, user_id)
+    if user is None:
+        raise HTTPException(status_code=404, detail=f"User {user_id} not found")
+    return user
+
+@app.post("/accounts", response_model=AccountOut, status_code=201)
+async def create_account(payload: AccountCreate, db: AsyncSession = Depends(get_async_db)):
+    try:
+        return await db.run_sync(services.create_account, payload.name, payload.weight)
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="Account name already exists")
+
+@app.post("/users", response_model=UserOut, status_code=201)
+async def create_user(payload: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    if payload.account_id is not None and await db.get(Account, payload.account_id) is None:
+        raise HTTPException(status_code=404, detail=f"Account {payload.account_id} not found")
+    try:
+        return await db.run_sync(services.create_user, payload.phone_number, payload.timezone,
+                                 payload.quiet_start, payload.quiet_end, payload.account_id)
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="Phone number already registered")
+
+@app.get("/users/{phone_number}", response_model=UserOut)
+async def get_user(phone_number: str, db: AsyncSession = Depends(get_async_db)):
+    user = await db.run_sync(services.lookup_user, phone_number)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user._asdict()
+
+@app.post("/opt-out", response_model=UserOut)
+async def set_opt_out(payload: OptOutRequest, db: AsyncSession = Depends(get_async_db)):
+    update = services.opt_out_user if payload.opt_out else services.opt_in_user
+    user = await db.run_sync(update, payload.phone_number)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
+
+@app.post("/reminders", response_model=ReminderOut, status_code=201)
+async def create_reminder(payload: ReminderCreate, db: AsyncSession = Depends(get_async_db)):
+    await _require_user(db, payload.user_id)
+    try:
+        return await db.run_sync(
+            services.create_reminder, payload.user_id, payload.message, payload.scheduled_time,
+            payload.template_id, payload.variables, payload.priority
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@app.post("/series", response_model=ReminderSeriesOut, status_code=201)
+async def create_series(payload: ReminderSeriesCreate, db: AsyncSession = Depends(get_async_db)):
+    await _require_user(db, payload.user_id)
+    try:
+        return await db.run_sync(
+            services.create_series, payload.user_id, payload.message, payload.rule, payload.start_time
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@app.delete("/series/{series_id}", response_model=ReminderSeriesOut)
+async def cancel_series(series_id: int, db: AsyncSession = Depends(get_async_db)):
+    series = await db.run_sync(services.cancel_series, series_id)
+    if series is None:
+        raise HTTPException(status_code=404, detail="Series not found")
+    return series
+
+@app.post("/templates", response_model=TemplateOut, status_code=201)
+async def create_template(payload: TemplateCreate, db: AsyncSession = Depends(get_async_db)):
+    try:
+        return await db.run_sync(services.create_template, payload.name, payload.body)
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="Template name already exists")
+
+@app.get("/templates/{template_id}", response_model=TemplateOut)
+async def get_template(template_id: int, db: AsyncSession = Depends(get_async_db)):
+    template = await db.get(MessageTemplate, template_id)
+    if template is None:
+        raise HTTPException(status_code=404, detail="Template not found")
+    return template
+
+@app.post("/reminders/batch", response_model=BatchResult)
+async def create_reminders(payload: list[ReminderCreate], db: AsyncSession = Depends(get_async_db)):
+    stats = await db.run_sync(
+        services.bulk_create_reminders, [item.model_dump() for item in payload]
+    )
+    return BatchResult(
+        inserted=stats.inserted, skipped=stats.skipped,
+        errors=[RowError(row=row, error=error) for row, error in stats.errors],
+    )
+
+async def _webhook_form(request: Request) -> dict:
+    form = dict(parse_qsl((await request.body()).decode(), keep_blank_values=True))
+    if WEBHOOK_VALIDATE_SIGNATURE:
+        from twilio.request_validator import RequestValidator
+        url = WEBHOOK_BASE_URL.rstrip("/") + request.url.path if WEBHOOK_BASE_URL else str(request.url)
+        signature = request.headers.get("X-Twilio-Signature", "")
+        if not RequestValidator(TWILIO_AUTH_TOKEN).validate(url, form, signature):
+            raise HTTPException(status_code=403, detail="Invalid webhook signature")
+    return form
+
+def _enqueue(event):
+    if not callback_buffer.offer(event):
+        raise HTTPException(status_code=503, detail="Callback buffer full",
+                            headers={"Retry-After": str(max(1, round(WEBHOOK_FLUSH_INTERVAL)))})
+
+@app.post("/webhooks/status", status_code=204)
+async def delivery_status_callback(request: Request):
+    event = parse_status(await _webhook_form(request))
+    if event is None:
+        raise HTTPException(status_code=422, detail="MessageSid and MessageStatus are required")
+    _enqueue(event)
+    return Response(status_code=204)
+
+@app.post("/webhooks/inbound")
+async def inbound_message_callback(request: Request):
+    event = parse_inbound(await _webhook_form(request))
+    if event is not None:
+        _enqueue(event)
+    # Empty TwiML: no auto-reply from us
+    return Response(content="<Response/>", media_type="text/xml")
+
+@app.get("/reminders/{reminder_id}", response_model=ReminderOut)
+async def get_reminder(reminder_id: int, db: AsyncSession = Depends(get_async_db)):
+    reminder = await db.get(Reminder, reminder_id)
+    if reminder is None:
+        raise HTTPException(status_code=404, detail="Reminder not found")
+    return reminder
@@ -0,0 +1,121 @@
+"""
+Move delivered reminders out of the hot reminders table.
+
+    python -m app.archive                       # into reminders_archive
+    python -m app.archive --jsonl-dir archive/  # to archive/reminders-YYYY-MM.jsonl.gz
+    python -m app.archive --retention-days 7 --batch-size 10000
+
+Sent reminders whose last update (the send) is older than the retention window
+are copied and then deleted in batches, one transaction per batch. The scan is
+paginated by id, so the reminders table only ever holds pending work plus the
+recent history. Delivery attempts stay in delivery_log.
+"""
+import argparse
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import delete, insert, literal, select
+from sqlalchemy.orm import Session
+from app.config import ARCHIVE_RETENTION_DAYS, ARCHIVE_BATCH_SIZE
+from app.database import SessionLocal, init_db
+from app.models import Reminder, ArchivedReminder
+
+# reminders columns copied to the archive; names match reminders_archive
+ARCHIVE_COLUMNS = (
+    Reminder.id, Reminder.user_id, Reminder.message, Reminder.template_id, Reminder.variables,
+    Reminder.scheduled_time, Reminder.priority, Reminder.provider_sid,
+    Reminder.series_id, Reminder.attempts, Reminder.updated_at.label("sent_at"),
+)
+
+def _archivable_ids(db: Session, before: datetime, after_id: int, limit: int):
+    return db.execute(
+        select(Reminder.id)
+        .where(Reminder.sent == True, Reminder.updated_at < before, Reminder.id > after_id)
+        .order_by(Reminder.id)
+        .limit(limit)
+    ).scalars().all()
+
+def archive_sent_reminders(db: Session, before: datetime = None, batch_size: int = ARCHIVE_BATCH_SIZE,
+                           export=None) -> int:
+    """
+    Archive sent reminders last updated before `before` (default: now minus
+    ARCHIVE_RETENTION_DAYS), `batch_size` per transaction. Rows go to
+    reminders_archive with one INSERT ... SELECT per batch, or, when `export`
+    is given, to export(rows) as a list of dicts. An exported batch is written
+    before its DELETE commits, so a crash between the two can duplicate rows
+    in the export but never lose them. Returns the number archived.
+    """
+    before = before or datetime.utcnow() - timedelta(days=ARCHIVE_RETENTION_DAYS)
+    archive = ArchivedReminder.__table__
+    names = [column.name for column in ARCHIVE_COLUMNS] + ["archived_at"]
+    archived = 0
+    last_id = 0
+    while True:
+        ids = _archivable_ids(db, before, last_id, batch_size)
+        if not ids:
+            break
+        try:
+            if export is None:
+                rows = select(*ARCHIVE_COLUMNS, literal(datetime.utcnow()).label("archived_at"))\
+                    .where(Reminder.id.in_(ids))
+                db.execute(insert(archive).from_select(names, rows))
+            else:
+                rows = select(*ARCHIVE_COLUMNS).where(Reminder.id.in_(ids))
+                export([dict(row) for row in db.execute(rows).mappings()])
+            db.execute(delete(Reminder.__table__).where(Reminder.id.in_(ids)))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            raise e
+        archived += len(ids)
+        last_id = ids[-1]
+    return archived
+
+class JsonlExporter:
+    """
+    export callable for archive_sent_reminders: appends rows to one gzipped
+    JSONL file per month of scheduled_time, e.g. reminders-2024-05.jsonl.gz.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, scheduled_time: datetime) -> str:
+        return os.path.join(self.directory, f"reminders-{scheduled_time:%Y-%m}.jsonl.gz")
+
+    def __call__(self, rows):
+        by_path = {}
+        for row in rows:
+            by_path.setdefault(self.path_for(row["scheduled_time"]), []).append(row)
+        for path, part in by_path.items():
+            # Appending to a gzip file adds a member; readers see one stream
+            with gzip.open(path, "at", encoding="utf-8") as f:
+                for row in part:
+                    f.write(json.dumps(row, default=_json_default) + "\n")
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive delivered reminders.")
+    parser.add_argument("--retention-days", type=float, default=ARCHIVE_RETENTION_DAYS)
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument("--jsonl-dir", help="export to monthly gzipped JSONL files instead of reminders_archive")
+    args = parser.parse_args(argv)
+
+    init_db()
+    db = SessionLocal()
+    try:
+        export = JsonlExporter(args.jsonl_dir) if args.jsonl_dir else None
+        before = datetime.utcnow() - timedelta(days=args.retention_days)
+        count = archive_sent_reminders(db, before, args.batch_size, export)
+    finally:
+        db.close()
+    print(f"Archived {count} reminders sent before {before:%Y-%m-%d %H:%M} UTC")
+
+if __name__ == "__main__":
+    main()
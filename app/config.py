@@ -3,8 +3,106 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
-TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
-TWILIO_PHONE_NUMBER = os.getenv("TWILIO_PHONE_NUMBER")
+TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID", "")
+TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN", "")
+TWILIO_PHONE_NUMBER = os.getenv("TWILIO_PHONE_NUMBER", "")
 APP_ENV = os.getenv("APP_ENV", "dev")
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./reminders.db")
+
+# Dispatcher daemon: upper bound on how long to sleep between sweeps so
+# reminders written by other processes are still picked up.
+DISPATCHER_MAX_SLEEP = float(os.getenv("DISPATCHER_MAX_SLEEP", "60"))
+# First pause after a failed pass (database down, exporter error); doubles on
+# each further failure, up to DISPATCHER_MAX_SLEEP.
+DISPATCHER_ERROR_BACKOFF = float(os.getenv("DISPATCHER_ERROR_BACKOFF", "1"))
+
+# Outbound SMS fan-out: parallel provider calls per sweep, and the provider's
+# messages-per-second cap (0 disables rate limiting).
+SMS_CONCURRENCY = int(os.getenv("SMS_CONCURRENCY", "10"))
+SMS_RATE_LIMIT = float(os.getenv("SMS_RATE_LIMIT", "0"))
+# Successful sends are marked in the database in chunks of this size.
+MARK_SENT_BATCH_SIZE = int(os.getenv("MARK_SENT_BATCH_SIZE", "500"))
+# Due reminders are read from the database in pages of this size.
+PENDING_CHUNK_SIZE = int(os.getenv("PENDING_CHUNK_SIZE", "1000"))
+# How long a worker may hold claimed reminders before others may reclaim them.
+REMINDER_LEASE_SECONDS = int(os.getenv("REMINDER_LEASE_SECONDS", "300"))
+
+# Connection pool (server databases such as Postgres)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# SQLite tuning
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+# Bulk import: rows validated and inserted per transaction.
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "5000"))
+
+# Dispatcher in-memory index: how far ahead to preload reminders, and how often
+# to pick up rows changed by other processes.
+UPCOMING_HORIZON_SECONDS = int(os.getenv("UPCOMING_HORIZON_SECONDS", "600"))
+UPCOMING_REFRESH_SECONDS = float(os.getenv("UPCOMING_REFRESH_SECONDS", "5"))
+
+# Delivery retries: exponential backoff with jitter between attempts, and the
+# number of attempts after which a reminder is dead-lettered.
+RETRY_BASE_SECONDS = float(os.getenv("RETRY_BASE_SECONDS", "30"))
+RETRY_MAX_SECONDS = float(os.getenv("RETRY_MAX_SECONDS", "3600"))
+MAX_DELIVERY_ATTEMPTS = int(os.getenv("MAX_DELIVERY_ATTEMPTS", "5"))
+
+# Twilio HTTP transport: keep-alive pool size, timeouts (seconds), retries on
+# connection errors, "threads" (sync client on a thread pool) or "async"
+# (aiohttp) send path, and an optional API base URL override (used to point
+# the client at app.fake_provider for load tests).
+TWILIO_HTTP_POOL_SIZE = int(os.getenv("TWILIO_HTTP_POOL_SIZE", str(SMS_CONCURRENCY)))
+TWILIO_CONNECT_TIMEOUT = float(os.getenv("TWILIO_CONNECT_TIMEOUT", "5"))
+TWILIO_READ_TIMEOUT = float(os.getenv("TWILIO_READ_TIMEOUT", "15"))
+TWILIO_MAX_RETRIES = int(os.getenv("TWILIO_MAX_RETRIES", "1"))
+SMS_TRANSPORT = os.getenv("SMS_TRANSPORT", "threads")
+TWILIO_API_BASE_URL = os.getenv("TWILIO_API_BASE_URL", "")
+
+# SMS provider (see app.providers): "twilio", "fake" (the Twilio client against
+# a local app.fake_provider at FAKE_PROVIDER_URL) or "mock" (no network).
+SMS_PROVIDER = os.getenv("SMS_PROVIDER", {"test": "mock", "local": "fake"}.get(APP_ENV, "twilio"))
+FAKE_PROVIDER_URL = os.getenv("FAKE_PROVIDER_URL", "http://127.0.0.1:8099")
+
+# Observability: file the scheduler rewrites with Prometheus-format metrics
+# after each tick ("" disables it), port the daemon serves GET /metrics on
+# (0 disables it), and an optional per-tick profiler ("cprofile" or
+# "pyinstrument") writing reports to TICK_PROFILE_DIR.
+METRICS_FILE = os.getenv("METRICS_FILE", "")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+TICK_PROFILER = os.getenv("TICK_PROFILER", "")
+TICK_PROFILE_DIR = os.getenv("TICK_PROFILE_DIR", "profiles")
+
+# Archival: sent reminders older than this many days move out of the hot
+# reminders table, this many rows per transaction.
+ARCHIVE_RETENTION_DAYS = int(os.getenv("ARCHIVE_RETENTION_DAYS", "30"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "5000"))
+
+# Merge reminders due for the same user in one sweep into one SMS, as long as
+# the merged text fits in COALESCE_MAX_SEGMENTS segments.
+COALESCE_MESSAGES = os.getenv("COALESCE_MESSAGES", "false").lower() in ("1", "true", "yes")
+COALESCE_MAX_SEGMENTS = int(os.getenv("COALESCE_MAX_SEGMENTS", "1"))
+
+# Phone numbers are matched in E.164 form. Numbers given without "+" or "00"
+# get this country calling code (e.g. "91"); empty means they are rejected.
+DEFAULT_COUNTRY_CODE = os.getenv("DEFAULT_COUNTRY_CODE", "")
+
+# User lookup cache: entries per process, seconds before an entry is re-read,
+# and an optional shared backend (redis://...) consulted behind the local one.
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+USER_CACHE_URL = os.getenv("USER_CACHE_URL", "")
+
+# Provider webhooks: callbacks held in memory at most (beyond that the API
+# answers 503), callbacks written per flush, seconds between flushes, and
+# X-Twilio-Signature checking. WEBHOOK_BASE_URL is the public URL the
+# provider calls, when it differs from what the API sees behind a proxy.
+WEBHOOK_BUFFER_SIZE = int(os.getenv("WEBHOOK_BUFFER_SIZE", "50000"))
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "1000"))
+WEBHOOK_FLUSH_INTERVAL = float(os.getenv("WEBHOOK_FLUSH_INTERVAL", "1"))
+WEBHOOK_VALIDATE_SIGNATURE = os.getenv(
+    "WEBHOOK_VALIDATE_SIGNATURE", "false" if APP_ENV in ("dev", "test") else "true"
+).lower() in ("1", "true", "yes")
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
@@ -1,14 +1,95 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
-from app.models import Base
+from app.config import (
+    DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+    SQLITE_BUSY_TIMEOUT_MS, SQLITE_MMAP_SIZE
+)
+from app.migrations import upgrade_schema
 
-DATABASE_URL = "sqlite:///./reminders.db"
+def _is_memory_sqlite(url) -> bool:
+    return url.database in (None, "", ":memory:") or "mode=memory" in str(url)
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+def _install_sqlite_pragmas(engine, in_memory: bool):
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if not in_memory:
+            # WAL lets readers (API, reports) proceed while the scheduler
+            # writes; NORMAL sync is durable across app crashes in WAL mode.
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.close()
+
+def _pool_options(overrides) -> dict:
+    options = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+    options.update(overrides)
+    return options
+
+def make_engine(url: str = DATABASE_URL, **kwargs):
+    """
+    Build an engine tuned for the backend in `url`.
+
+    SQLite gets WAL journaling, synchronous=NORMAL, a busy timeout and mmap so
+    the scheduler, API and bulk loaders can share one file without "database
+    is locked" errors. Server databases get a sized, pre-pinged, recycled
+    connection pool. Extra keyword arguments are passed to create_engine.
+    """
+    url_obj = make_url(url)
+    if url_obj.get_backend_name() == "sqlite":
+        connect_args = {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+        connect_args.update(kwargs.pop("connect_args", {}))
+        engine = create_engine(url, connect_args=connect_args, **kwargs)
+        _install_sqlite_pragmas(engine, _is_memory_sqlite(url_obj))
+        return engine
+    return create_engine(url, **_pool_options(kwargs))
+
+# Async drivers used by the HTTP API for each sync backend
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg"}
+
+def make_async_url(url: str) -> str:
+    url_obj = make_url(url)
+    backend = url_obj.get_backend_name()
+    if backend in ASYNC_DRIVERS and url_obj.get_driver_name() != ASYNC_DRIVERS[backend]:
+        url_obj = url_obj.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+    return url_obj.render_as_string(hide_password=False)
+
+def make_async_engine(url: str = DATABASE_URL, **kwargs):
+    """Async counterpart of make_engine, with the same pool and SQLite tuning."""
+    from sqlalchemy.ext.asyncio import create_async_engine
+    url = make_async_url(url)
+    url_obj = make_url(url)
+    if url_obj.get_backend_name() == "sqlite":
+        async_engine = create_async_engine(url, **kwargs)
+        _install_sqlite_pragmas(async_engine.sync_engine, _is_memory_sqlite(url_obj))
+        return async_engine
+    return create_async_engine(url, **_pool_options(kwargs))
+
+engine = make_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Built on first use so the scheduler and CLIs don't need the async driver.
+_async_session_factory = None
+
+def get_async_session_factory():
+    global _async_session_factory
+    if _async_session_factory is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+        _async_session_factory = async_sessionmaker(
+            make_async_engine(DATABASE_URL), autoflush=False, expire_on_commit=False
+        )
+    return _async_session_factory
+
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
 
 def get_db():
     db = SessionLocal()
@@ -17,7 +98,6 @@ def get_db():
     finally:
         db.close()
 
-
-
-# reoccuring remainders feature can be added.
-# 
\ No newline at end of file
+async def get_async_db():
+    async with get_async_session_factory()() as db:
+        yield db
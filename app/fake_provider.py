@@ -0,0 +1,103 @@
+"""
+Local stand-in for the Twilio Messages API, for load testing without the network.
+
+    python -m app.fake_provider --port 8099 --latency-ms 50
+
+then run the sender with TWILIO_API_BASE_URL=http://127.0.0.1:8099. Each
+POST to /2010-04-01/Accounts/<sid>/Messages.json sleeps for the configured
+latency and answers with a queued message and a fresh SID. A fraction of
+requests can be failed with a Twilio-style error body.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+    # Write each response in one segment; split header/body writes stall on
+    # Nagle plus delayed ACK and would add ~40ms to every request.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        form = parse_qs(self.rfile.read(length).decode())
+        if not self.path.endswith("/Messages.json"):
+            self._reply(404, {"code": 20404, "message": "Not Found", "status": 404})
+            return
+        if server.latency:
+            time.sleep(server.latency)
+        with server.lock:
+            server.requests += 1
+            server.peers.add(self.client_address)
+        if server.failure_rate and random.random() < server.failure_rate:
+            self._reply(400, {"code": 21211, "message": "Invalid 'To' Phone Number", "status": 400})
+            return
+        self._reply(201, {
+            "sid": "SM" + uuid.uuid4().hex,
+            "status": "queued",
+            "to": form.get("To", [""])[0],
+            "from": form.get("From", [""])[0],
+            "body": form.get("Body", [""])[0],
+        })
+
+class FakeProviderServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0, failure_rate: float = 0):
+        super().__init__((host, port), FakeProviderHandler)
+        self.latency = latency_ms / 1000
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self.peers = set()  # distinct client (host, port) pairs, i.e. TCP connections
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve on a background thread (for tests and benchmarks)."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a fake Twilio Messages API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--failure-rate", type=float, default=0)
+    args = parser.parse_args(argv)
+    server = FakeProviderServer(args.host, args.port, args.latency_ms, args.failure_rate)
+    print(f"Fake provider listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
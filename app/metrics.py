@@ -0,0 +1,199 @@
+"""
+In-process metrics for the dispatcher, rendered in the Prometheus text format.
+
+Counters, gauges and histograms are module-level objects updated from the hot
+path with a lock and a few arithmetic operations. The scheduler writes them to
+a file after every tick with --metrics-file or METRICS_FILE, for
+node_exporter's textfile collector. The daemon can also serve GET /metrics
+itself on --metrics-port.
+"""
+import bisect
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Seconds; covers sub-millisecond SQLite queries up to slow provider calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Seconds late; from "on time" to a missed hour
+LATENESS_BUCKETS = (0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+_registry = []
+
+def _label_key(labelnames, labels) -> tuple:
+    if set(labels) != set(labelnames):
+        raise ValueError(f"Expected labels {labelnames}, got {tuple(labels)}")
+    return tuple(str(labels[name]) for name in labelnames)
+
+def _format_labels(labelnames, key, extra=()) -> str:
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        _registry.append(self)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value) -> list:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, then sum and count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        state = self._values.get(_label_key(self.labelnames, labels))
+        return state[2] if state else 0
+
+    def _samples(self, key, state) -> list:
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.labelnames, key, [("le", _format_value(float(bound)))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def write_textfile(path: str):
+    """Atomically replace `path` with the current metrics"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".metrics-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(render())
+        os.replace(tmp_path, path)
+    except Exception as e:
+        os.unlink(tmp_path)
+        raise e
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_http_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve GET /metrics on a daemon thread; call shutdown() on the result to stop"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def reset():
+    """Clear every metric (for tests)"""
+    for metric in _registry:
+        metric.reset()
+
+REMINDERS_DUE = Counter("reminders_due_total", "Reminders claimed for sending")
+REMINDERS_SENT = Counter("reminders_sent_total", "Reminders accepted by the provider")
+REMINDERS_FAILED = Counter("reminders_failed_total", "Failed send attempts", ["permanent"])
+REMINDERS_DEFERRED = Counter("reminders_deferred_total", "Reminders pushed past the user's quiet hours")
+REMINDERS_DEAD = Counter("reminders_dead_lettered_total", "Reminders moved to status=dead")
+REMINDERS_OPTED_OUT = Gauge("reminders_skipped_opt_out", "Due reminders held back because the user opted out")
+DISPATCH_QUEUE_DEPTH = Gauge("dispatch_queue_depth", "Claimed reminders not yet sent or failed")
+UPCOMING_INDEX_SIZE = Gauge("upcoming_index_size", "Reminders in the daemon's look-ahead index")
+DB_QUERY_SECONDS = Histogram("db_query_seconds", "Time spent in dispatcher database calls", ["operation"])
+PROVIDER_CALL_SECONDS = Histogram("provider_call_seconds", "Time spent in one SMS provider call")
+DELIVERY_LATENESS_SECONDS = Histogram("delivery_lateness_seconds",
+                                      "Provider acceptance time minus scheduled_time, by priority lane",
+                                      ["lane"], buckets=LATENESS_BUCKETS)
+TICK_SECONDS = Histogram("scheduler_tick_seconds", "Duration of one check_and_send_reminders sweep")
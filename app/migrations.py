@@ -0,0 +1,99 @@
+"""
+Lightweight, idempotent schema upgrades for existing databases.
+
+Base.metadata.create_all only creates missing tables, so columns and indexes
+added to the models later would be missing from a reminders.db created by an
+older version. upgrade_schema adds them in place, plus the data backfills a
+new column needs before its index can be built.
+"""
+from sqlalchemy import bindparam, inspect, literal, select, text, update
+from app.models import Base, Reminder, User
+from app.phone import try_normalize_phone
+
+def _column_ddl(column, dialect) -> str:
+    preparer = dialect.identifier_preparer
+    ddl = f"{preparer.quote(column.name)} {column.type.compile(dialect=dialect)}"
+    default = column.default
+    if default is not None and default.is_scalar:
+        # Backfill existing rows with the model's scalar default
+        value = literal(default.arg, type_=column.type)
+        ddl += " DEFAULT " + str(value.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+    return ddl
+
+def _add_missing_columns(conn):
+    inspector = inspect(conn)
+    existing_tables = set(inspector.get_table_names())
+    preparer = conn.dialect.identifier_preparer
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {col["name"] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                conn.execute(text(
+                    f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {_column_ddl(column, conn.dialect)}"
+                ))
+
+def _create_missing_indexes(conn):
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(conn)
+
+def _backfill_phone_e164(conn):
+    """
+    Fill users.phone_e164 for rows created before it existed. Numbers that do
+    not normalize, or that collide with an earlier user once normalized, stay
+    NULL and are still found by exact phone_number match.
+    """
+    table = User.__table__
+    rows = conn.execute(select(table.c.id, table.c.phone_number).where(table.c.phone_e164 == None)).all()
+    if not rows:
+        return
+    taken = set(conn.execute(select(table.c.phone_e164).where(table.c.phone_e164 != None)).scalars())
+    updates = []
+    for user_id, phone_number in sorted(rows):
+        e164 = try_normalize_phone(phone_number)
+        if e164 is not None and e164 not in taken:
+            taken.add(e164)
+            updates.append({"b_id": user_id, "b_e164": e164})
+    if updates:
+        conn.execute(
+            update(table).where(table.c.id == bindparam("b_id")).values(phone_e164=bindparam("b_e164")),
+            updates,
+        )
+
+def _backfill_reminder_updated_at(conn):
+    """
+    Give reminders created before updated_at existed their scheduled time as
+    last update, so archiving and the dispatcher's change watermark see them.
+    The column's default is a callable, which ADD COLUMN cannot apply.
+    """
+    reminders = Reminder.__table__
+    conn.execute(
+        update(reminders)
+        .where(reminders.c.updated_at == None)
+        .values(updated_at=reminders.c.scheduled_time)
+    )
+
+def _backfill_reminder_accounts(conn):
+    """Copy users.account_id onto pending reminders created before reminders.account_id existed."""
+    reminders, users = Reminder.__table__, User.__table__
+    account = select(users.c.account_id).where(users.c.id == reminders.c.user_id).scalar_subquery()
+    conn.execute(
+        update(reminders)
+        .where(reminders.c.sent == False, reminders.c.account_id == None, account != None)
+        .values(account_id=account)
+    )
+
+def upgrade_schema(engine):
+    """Create missing tables, then add any columns and indexes the models gained since."""
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        _add_missing_columns(conn)
+        _backfill_phone_e164(conn)
+        _backfill_reminder_updated_at(conn)
+        _backfill_reminder_accounts(conn)
+        _create_missing_indexes(conn)
@@ -1,18 +1,52 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, ForeignKey, Index, JSON, Time
+from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
 
+# Dispatch lanes by Reminder.priority, least urgent first. Due reminders of a
+# higher lane are always claimed before any of a lower one.
+PRIORITY_LANES = ("bulk", "normal", "high")
+PRIORITY_NORMAL = 1
+
+class Account(Base):
+    """
+    The tenant owning a set of users. Within a lane, due reminders are shared
+    out between accounts in proportion to their weight.
+    """
+    __tablename__ = "accounts"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+    weight = Column(Float, nullable=False, default=1.0)
+
+    users = relationship("User", back_populates="account")
+
+    def __repr__(self):
+        return f"<Account(id={self.id}, name={self.name}, weight={self.weight})>"
+
 class User(Base):
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True, index=True)
     phone_number = Column(String, unique=True, nullable=False)
+    # phone_number in E.164 form (app.phone); lookups go through this column
+    phone_e164 = Column(String, nullable=True)
     timezone = Column(String, default="UTC")
     opt_out = Column(Boolean, default=False)
+    # Optional quiet window in the user's local time (see app.quiet_hours)
+    quiet_start = Column(Time, nullable=True)
+    quiet_end = Column(Time, nullable=True)
+    # Users without an account share one dispatch queue of weight 1
+    account_id = Column(Integer, ForeignKey("accounts.id"), nullable=True, index=True)
 
+    account = relationship("Account", back_populates="users")
     reminders = relationship("Reminder", back_populates="user")
+    series = relationship("ReminderSeries", back_populates="user")
+
+    __table_args__ = (
+        Index("ix_users_phone_e164", "phone_e164", unique=True),
+    )
 
     def __repr__(self):
         return f"<User(id={self.id}, phone={self.phone_number}, tz={self.timezone}, opt_out={self.opt_out})>"
@@ -22,11 +56,131 @@ class Reminder(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
-    message = Column(String, nullable=False)
+    # Rendered text, or "" when the text comes from template_id + variables
+    message = Column(String, nullable=False, default="")
+    template_id = Column(Integer, ForeignKey("message_templates.id"), nullable=True)
+    variables = Column(JSON(none_as_null=True), nullable=True)
     scheduled_time = Column(DateTime, nullable=False)
+    priority = Column(Integer, nullable=False, default=PRIORITY_NORMAL)  # index into PRIORITY_LANES
+    # The user's account when the reminder was created, copied here so each
+    # account's queue is one range of ix_reminders_lane
+    account_id = Column(Integer, nullable=True)
     sent = Column(Boolean, default=False)
+    provider_sid = Column(String, nullable=True)
+    # Set while a dispatcher worker holds the reminder; an expired lease makes
+    # it claimable again.
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    series_id = Column(Integer, ForeignKey("reminder_series.id"), nullable=True)
+    # Delivery attempts: failed sends are retried at next_attempt_at with
+    # backoff; permanent failures and exhausted retries move to status "dead".
+    status = Column(String, default="pending")  # pending | sent | dead
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+    # Bumped on every insert/update; the dispatcher's in-memory index refreshes
+    # incrementally from it.
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     user = relationship("User", back_populates="reminders")
+    series = relationship("ReminderSeries", back_populates="reminders")
+
+    __table_args__ = (
+        # Partial index covering only unsent rows, in due-scan order; the
+        # delivered history never enters it.
+        Index(
+            "ix_reminders_due", "scheduled_time", "id",
+            sqlite_where=(sent == False), postgresql_where=(sent == False),
+        ),
+        # One range per (account, lane) queue, in due order, for the fair claim
+        Index(
+            "ix_reminders_lane", "account_id", "priority", "scheduled_time", "id",
+            sqlite_where=(sent == False), postgresql_where=(sent == False),
+        ),
+    )
+
+    def __repr__(self):
+        return f"<Reminder(id={self.id}, user_id={self.user_id}, msg={self.message}, scheduled={self.scheduled_time}, sent={self.sent}, status={self.status})>"
+
+class MessageTemplate(Base):
+    """
+    Shared message text with {name} placeholders, filled from each reminder's
+    variables at send time (see app.templates). Templates are immutable; to
+    change the text, create a new one. encoding and segments describe the
+    body with every placeholder empty.
+    """
+    __tablename__ = "message_templates"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+    body = Column(String, nullable=False)
+    encoding = Column(String, nullable=False)  # GSM-7 | UCS-2
+    segments = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<MessageTemplate(id={self.id}, name={self.name}, encoding={self.encoding}, segments={self.segments})>"
+
+class ReminderSeries(Base):
+    """
+    A repeating reminder. Only its next occurrence exists as a Reminder row;
+    the next one is materialized when that row is sent.
+    """
+    __tablename__ = "reminder_series"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    message = Column(String, nullable=False)
+    rule = Column(String, nullable=False)              # RRULE subset, see app.recurrence
+    start_time = Column(DateTime, nullable=False)      # first occurrence, UTC
+    next_occurrence = Column(DateTime, nullable=True)  # currently materialized occurrence, UTC
+    occurrence_count = Column(Integer, default=0)      # occurrences materialized so far
+    active = Column(Boolean, default=True)
+
+    user = relationship("User", back_populates="series")
+    reminders = relationship("Reminder", back_populates="series")
+
+    def __repr__(self):
+        return f"<ReminderSeries(id={self.id}, user_id={self.user_id}, rule={self.rule}, next={self.next_occurrence}, active={self.active})>"
+
+class DeliveryLog(Base):
+    """
+    One row per delivery attempt, written in the same transaction that records
+    the outcome on the reminder (an outbox-style log). reminder_id is not a
+    foreign key so the log outlives reminders moved to the archive.
+    """
+    __tablename__ = "delivery_log"
+
+    id = Column(Integer, primary_key=True)
+    reminder_id = Column(Integer, nullable=False, index=True)
+    provider_sid = Column(String, nullable=True, index=True)
+    attempted_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    status = Column(String, nullable=False)  # sent | failed | dead
+    error = Column(String, nullable=True)
+    # Latest status the provider reported for provider_sid (status callbacks)
+    delivery_status = Column(String, nullable=True)  # queued | sent | delivered | undelivered | failed | ...
+    delivery_error_code = Column(String, nullable=True)
+    delivery_updated_at = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<DeliveryLog(reminder_id={self.reminder_id}, sid={self.provider_sid}, status={self.status}, at={self.attempted_at})>"
+
+class ArchivedReminder(Base):
+    """Delivered reminders moved out of the hot reminders table by app.archive."""
+    __tablename__ = "reminders_archive"
+
+    id = Column(Integer, primary_key=True)  # the original reminders.id
+    user_id = Column(Integer, index=True)
+    message = Column(String, nullable=False)
+    template_id = Column(Integer, nullable=True)
+    variables = Column(JSON(none_as_null=True), nullable=True)
+    scheduled_time = Column(DateTime, nullable=False)
+    priority = Column(Integer, nullable=False, default=PRIORITY_NORMAL)
+    provider_sid = Column(String, nullable=True)
+    series_id = Column(Integer, nullable=True)
+    attempts = Column(Integer, default=0)
+    sent_at = Column(DateTime, nullable=True)  # reminders.updated_at when archived
+    archived_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
 
     def __repr__(self):
-        return f"<Reminder(id={self.id}, user_id={self.user_id}, msg={self.message}, scheduled={self.scheduled_time}, sent={self.sent})>"
+        return f"<ArchivedReminder(id={self.id}, user_id={self.user_id}, scheduled={self.scheduled_time}, sid={self.provider_sid})>"
@@ -0,0 +1,32 @@
+"""
+Phone number normalization to E.164 ("+" then up to 15 digits).
+
+Lookups go through the normalized form, so "+91 63954-29850",
+"0091 6395429850" and "+916395429850" all find the same user.
+"""
+import re
+from app.config import DEFAULT_COUNTRY_CODE
+
+_SEPARATORS = re.compile(r"[\s\-.()/]")
+_E164 = re.compile(r"\+[1-9]\d{6,14}")
+
+def normalize_phone(raw: str, default_country_code: str = DEFAULT_COUNTRY_CODE) -> str:
+    """Return `raw` in E.164 form. Raises ValueError if it cannot be read as one."""
+    number = _SEPARATORS.sub("", raw or "")
+    if number.startswith("00"):
+        number = "+" + number[2:]
+    elif not number.startswith("+"):
+        if not default_country_code:
+            raise ValueError(f"Phone number must include a country code: {raw!r}")
+        # Drop a national trunk prefix ("0" in most countries)
+        number = "+" + default_country_code.lstrip("+") + number.removeprefix("0")
+    if not _E164.fullmatch(number):
+        raise ValueError(f"Not a valid E.164 phone number: {raw!r}")
+    return number
+
+def try_normalize_phone(raw: str):
+    """normalize_phone, or None for numbers that cannot be normalized."""
+    try:
+        return normalize_phone(raw)
+    except ValueError:
+        return None
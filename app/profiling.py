@@ -0,0 +1,45 @@
+"""
+Optional per-tick profiling, to find where a slow scheduler tick goes.
+
+TICK_PROFILER=cprofile writes a .prof file per tick, to be read with pstats or
+snakeviz. TICK_PROFILER=pyinstrument writes an .html report and needs
+`pip install pyinstrument`. Both write to TICK_PROFILE_DIR.
+"""
+import os
+from contextlib import contextmanager
+from datetime import datetime
+from app.config import TICK_PROFILER, TICK_PROFILE_DIR
+
+PROFILERS = ("cprofile", "pyinstrument")
+
+def _output_path(directory: str, suffix: str) -> str:
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"tick-{datetime.utcnow():%Y%m%dT%H%M%S%f}.{suffix}")
+
+@contextmanager
+def profile_tick(profiler: str = TICK_PROFILER, directory: str = TICK_PROFILE_DIR):
+    """Profile the enclosed block with `profiler` ("" disables it) and save the report"""
+    if not profiler:
+        yield None
+        return
+    if profiler == "cprofile":
+        import cProfile
+        prof = cProfile.Profile()
+        prof.enable()
+        try:
+            yield prof
+        finally:
+            prof.disable()
+            prof.dump_stats(_output_path(directory, "prof"))
+    elif profiler == "pyinstrument":
+        from pyinstrument import Profiler
+        prof = Profiler(async_mode="enabled")
+        prof.start()
+        try:
+            yield prof
+        finally:
+            prof.stop()
+            with open(_output_path(directory, "html"), "w") as f:
+                f.write(prof.output_html())
+    else:
+        raise ValueError(f"TICK_PROFILER must be one of {', '.join(PROFILERS)}")
@@ -0,0 +1,100 @@
+"""
+SMS provider clients, built on first use.
+
+    twilio  the real Twilio API over the pooled transports in app.transport
+    fake    the same client pointed at a local app.fake_provider server
+    mock    no network; every message is accepted with a fixed SID
+
+SMS_PROVIDER picks one (by default "mock" when APP_ENV is test, "fake" when
+it is local, "twilio" otherwise). Nothing is imported or constructed until
+the first send asks for a client, so commands and test runs that never send
+don't pay for the Twilio SDK, requests and aiohttp. Each provider gives a
+(client, async_client) pair; both expose messages.create and
+messages.create_async like twilio.rest.Client.
+"""
+import logging
+import threading
+from app.config import TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, SMS_PROVIDER, FAKE_PROVIDER_URL
+
+logger = logging.getLogger(__name__)
+
+PROVIDERS = {}
+
+def register(name: str):
+    """Register a factory returning (client, async_client) under `name`."""
+    def decorator(factory):
+        PROVIDERS[name] = factory
+        return factory
+    return decorator
+
+def _twilio_clients(base_url: str = None):
+    from twilio.rest import Client
+    from app.transport import PooledHttpClient, PooledAsyncHttpClient
+    http_options = {} if base_url is None else {"base_url": base_url}
+    # One pooled keep-alive session shared by every send, instead of a new
+    # TLS handshake per message.
+    client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, http_client=PooledHttpClient(**http_options))
+    async_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, http_client=PooledAsyncHttpClient(**http_options))
+    return client, async_client
+
+@register("twilio")
+def twilio_provider():
+    return _twilio_clients()
+
+@register("fake")
+def fake_provider():
+    return _twilio_clients(FAKE_PROVIDER_URL)
+
+class MockMessages:
+    def create(self, to, from_, body):
+        logger.debug("Mock Twilio: sending message to %s from %s with body: %s", to, from_, body)
+        return type("Message", (object,), {"sid": "SMxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx"})()
+
+    async def create_async(self, to, from_, body):
+        return self.create(to=to, from_=from_, body=body)
+
+class MockClient:
+    def __init__(self, account_sid=None, auth_token=None):
+        self.messages = MockMessages()
+
+@register("mock")
+def mock_provider():
+    client = MockClient(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+    return client, client
+
+_clients = None
+_lock = threading.Lock()
+
+def get_clients() -> tuple:
+    """The (client, async_client) of SMS_PROVIDER, built on first call."""
+    global _clients
+    if _clients is None:
+        with _lock:
+            if _clients is None:
+                if SMS_PROVIDER not in PROVIDERS:
+                    raise ValueError(f"Unknown SMS_PROVIDER {SMS_PROVIDER!r}; expected one of {', '.join(PROVIDERS)}")
+                _clients = PROVIDERS[SMS_PROVIDER]()
+    return _clients
+
+def set_clients(client, async_client) -> tuple:
+    """Replace the active clients (benchmarks, tests). Returns the previous pair, or None."""
+    global _clients
+    with _lock:
+        previous, _clients = _clients, (client, async_client)
+    return previous
+
+def reset():
+    """Drop the active clients; the next send builds them again."""
+    global _clients
+    with _lock:
+        _clients = None
+
+async def close_async():
+    """
+    Close the async client's HTTP session, if one was opened. Call it before
+    the event loop that sent the messages ends; the next send opens a new one.
+    """
+    clients = _clients
+    http_client = getattr(clients[1], "http_client", None) if clients else None
+    if http_client is not None and hasattr(http_client, "close"):
+        await http_client.close()
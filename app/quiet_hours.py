@@ -0,0 +1,31 @@
+"""
+Per-user quiet hours.
+
+A user's quiet window is a pair of wall-clock times in User.timezone. A window
+whose start is after its end wraps midnight (22:00-07:00). Reminders that come
+due inside the window are pushed to the window's end instead of being sent.
+"""
+from datetime import datetime, time, timedelta
+from typing import Optional
+from app.timezones import get_timezone, local_to_utc, utc_to_local
+
+def in_quiet_hours(local: time, start: time, end: time) -> bool:
+    if start == end:
+        return False
+    if start < end:
+        return start <= local < end
+    return local >= start or local < end
+
+def quiet_until(now_utc: datetime, tz_name: str, start: Optional[time], end: Optional[time]) -> Optional[datetime]:
+    """
+    If `now_utc` (naive UTC) falls in the quiet window, the naive UTC time it
+    ends; otherwise None.
+    """
+    if start is None or end is None:
+        return None
+    tz = get_timezone(tz_name)
+    local = utc_to_local(now_utc, tz)
+    if not in_quiet_hours(local.time(), start, end):
+        return None
+    end_date = local.date() if local.time() < end else local.date() + timedelta(days=1)
+    return local_to_utc(datetime.combine(end_date, end), tz)
@@ -0,0 +1,132 @@
+"""
+Recurrence rules for repeating reminders.
+
+Rules use a subset of iCalendar RRULE syntax:
+
+    FREQ=HOURLY|DAILY|WEEKLY|MONTHLY   (required)
+    INTERVAL=n                         (default 1)
+    BYDAY=MO,WE,FR                     (WEEKLY only; default: weekday of the start)
+    COUNT=n                            (total occurrences, including the first)
+    UNTIL=YYYYMMDDTHHMMSSZ             (last allowed occurrence, UTC)
+
+Daily, weekly and monthly rules repeat at the same wall-clock time in the
+user's timezone, so a 09:00 reminder stays at 09:00 across DST changes. A time
+skipped by a spring-forward shift moves forward by the gap; an ambiguous
+fall-back time uses its first occurrence. Hourly rules step in absolute time.
+"""
+import calendar
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+from app.timezones import get_timezone, local_to_utc, utc_to_local
+
+FREQUENCIES = ("HOURLY", "DAILY", "WEEKLY", "MONTHLY")
+WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+
+class Rule(NamedTuple):
+    freq: str
+    interval: int = 1
+    byday: tuple = ()
+    count: Optional[int] = None
+    until: Optional[datetime] = None
+
+def parse_rule(text: str) -> Rule:
+    """Parse an RRULE-style string. Raises ValueError on anything unsupported."""
+    parts = {}
+    for item in text.strip().removeprefix("RRULE:").split(";"):
+        if not item:
+            continue
+        key, sep, value = item.partition("=")
+        if not sep or not value:
+            raise ValueError(f"Malformed rule part: {item!r}")
+        parts[key.upper()] = value.upper()
+
+    freq = parts.pop("FREQ", None)
+    if freq not in FREQUENCIES:
+        raise ValueError(f"FREQ must be one of {', '.join(FREQUENCIES)}")
+    try:
+        interval = int(parts.pop("INTERVAL", "1"))
+        count = int(parts["COUNT"]) if "COUNT" in parts else None
+        until = datetime.strptime(parts["UNTIL"], "%Y%m%dT%H%M%SZ") if "UNTIL" in parts else None
+    except ValueError:
+        raise ValueError(f"Invalid INTERVAL, COUNT or UNTIL in {text!r}")
+    parts.pop("COUNT", None)
+    parts.pop("UNTIL", None)
+    if interval < 1 or (count is not None and count < 1):
+        raise ValueError("INTERVAL and COUNT must be positive")
+
+    byday = ()
+    if "BYDAY" in parts:
+        if freq != "WEEKLY":
+            raise ValueError("BYDAY is only supported with FREQ=WEEKLY")
+        days = parts.pop("BYDAY").split(",")
+        if any(day not in WEEKDAYS for day in days):
+            raise ValueError(f"BYDAY values must be among {','.join(WEEKDAYS)}")
+        byday = tuple(sorted({WEEKDAYS.index(day) for day in days}))
+    if parts:
+        raise ValueError(f"Unsupported rule parts: {', '.join(sorted(parts))}")
+    return Rule(freq, interval, byday, count, until)
+
+def validate_rule(text: str) -> str:
+    parse_rule(text)
+    return text
+
+def _add_months(local: datetime, months: int) -> Optional[datetime]:
+    month_index = local.month - 1 + months
+    year, month = local.year + month_index // 12, month_index % 12 + 1
+    if local.day > calendar.monthrange(year, month)[1]:
+        return None  # e.g. the 31st in a 30-day month: no occurrence
+    return local.replace(year=year, month=month)
+
+def _local_occurrences(rule: Rule, start_local: datetime, from_local: datetime):
+    """Wall-clock occurrences in order, starting near `from_local` (never before start)."""
+    if rule.freq == "DAILY":
+        step = timedelta(days=rule.interval)
+        k = max(0, (from_local.date() - start_local.date()).days // rule.interval - 1)
+        while True:
+            yield start_local + k * step
+            k += 1
+    elif rule.freq == "WEEKLY":
+        days = rule.byday or (start_local.weekday(),)
+        week0 = start_local - timedelta(days=start_local.weekday())
+        w = max(0, (from_local.date() - week0.date()).days // 7 // rule.interval - 1)
+        while True:
+            week = week0 + timedelta(weeks=w * rule.interval)
+            for day in days:
+                candidate = week + timedelta(days=day)
+                if candidate >= start_local:
+                    yield candidate
+            w += 1
+    elif rule.freq == "MONTHLY":
+        months = (from_local.year - start_local.year) * 12 + from_local.month - start_local.month
+        k = max(0, months // rule.interval - 1)
+        while True:
+            candidate = _add_months(start_local, k * rule.interval)
+            if candidate is not None:
+                yield candidate
+            k += 1
+
+def next_occurrence(rule: Rule, start_utc: datetime, after_utc: datetime, tz_name: str) -> Optional[datetime]:
+    """
+    First occurrence strictly after `after_utc` (naive UTC in, naive UTC out),
+    or None once the series has passed UNTIL. `start_utc` is the first
+    occurrence and anchors the wall-clock time in `tz_name`. COUNT is enforced
+    by the caller, which knows how many occurrences it has materialized.
+    """
+    if after_utc < start_utc:
+        candidate = start_utc
+    elif rule.freq == "HOURLY":
+        steps = int((after_utc - start_utc) // timedelta(hours=rule.interval)) + 1
+        candidate = start_utc + steps * timedelta(hours=rule.interval)
+    else:
+        tz = get_timezone(tz_name)
+        start_local = utc_to_local(start_utc, tz)
+        candidate = None
+        for local in _local_occurrences(rule, start_local, utc_to_local(after_utc, tz)):
+            utc = local_to_utc(local, tz)
+            if utc > after_utc:
+                candidate = utc
+                break
+
+    if rule.until is not None and candidate > rule.until:
+        return None
+    return candidate
@@ -1,33 +1,486 @@
+import argparse
 import asyncio
-from datetime import datetime
+import logging
+import os
+import signal
+import socket
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
 import pytz
-from app.database import SessionLocal
-from app.services import get_pending_reminders, mark_reminder_sent
-from app.twilio_client import send_message
+from app.config import (
+    DISPATCHER_MAX_SLEEP, DISPATCHER_ERROR_BACKOFF, SMS_CONCURRENCY, SMS_RATE_LIMIT, MARK_SENT_BATCH_SIZE, PENDING_CHUNK_SIZE,
+    REMINDER_LEASE_SECONDS, UPCOMING_HORIZON_SECONDS, UPCOMING_REFRESH_SECONDS, SMS_TRANSPORT, METRICS_FILE,
+    METRICS_PORT, COALESCE_MESSAGES, COALESCE_MAX_SEGMENTS
+)
+from app.database import SessionLocal, init_db
+from app.models import PRIORITY_LANES
+from app.services import (
+    Shard, claim_due_reminders, renew_leases, release_reminders, mark_reminders_sent, record_delivery_failures,
+    count_opted_out_due, defer_reminders, add_reminder_listener, remove_reminder_listener
+)
+from app import metrics, providers
+from app.profiling import profile_tick
+from app.quiet_hours import quiet_until
+from app.sms import coalesce
+from app.templates import render_batch
+from app.rate_limiter import TokenBucket
+from app.timezones import get_timezone
+from app.twilio_client import DeliveryError, deliver, deliver_async
+from app.upcoming import UpcomingIndex
+
+logger = logging.getLogger(__name__)
+
+# Lease owner recorded on claimed reminders; unique per scheduler process.
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+class SendResult(NamedTuple):
+    reminder_id: int
+    phone_number: str
+    sid: Optional[str]
+    error: Optional[str] = None
+    permanent: bool = False
+
+def _send(reminder_id: int, phone_number: str, message: str) -> SendResult:
+    try:
+        with metrics.PROVIDER_CALL_SECONDS.time():
+            return SendResult(reminder_id, phone_number, deliver(phone_number, message))
+    except DeliveryError as e:
+        logger.warning("Error sending reminder %s to %s: %s", reminder_id, phone_number, e)
+        return SendResult(reminder_id, phone_number, None, str(e), e.permanent)
+
+async def _send_async(reminder_id: int, phone_number: str, message: str) -> SendResult:
+    try:
+        with metrics.PROVIDER_CALL_SECONDS.time():
+            return SendResult(reminder_id, phone_number, await deliver_async(phone_number, message))
+    except DeliveryError as e:
+        logger.warning("Error sending reminder %s to %s: %s", reminder_id, phone_number, e)
+        return SendResult(reminder_id, phone_number, None, str(e), e.permanent)
 
 def convert_to_user_tz(utc_dt, tz_name):
-    return pytz.utc.localize(utc_dt).astimezone(pytz.timezone(tz_name))
+    return pytz.utc.localize(utc_dt).astimezone(get_timezone(tz_name))
+
+def plan_dispatch(rows, now: datetime, coalesce_messages: bool = COALESCE_MESSAGES,
+                  max_segments: int = COALESCE_MAX_SEGMENTS, messages=None):
+    """
+    Turn claimed DISPATCH_COLUMNS rows into provider calls. `messages` maps
+    reminder ids to rendered template text (render_batch); other rows send
+    their stored message. Returns (jobs, groups, deferrals):
+
+    - jobs: (reminder_id, phone_number, message) tuples to send.
+    - groups: job reminder_id -> every reminder id its message covers, for
+      jobs that merge several of one user's reminders (coalesce_messages).
+    - deferrals: (reminder_id, new_scheduled_time) for users currently in
+      their quiet hours, pushed to the end of the window.
+    """
+    jobs, groups, deferrals = [], {}, []
+    quiet = {}  # user_id -> end of the current quiet window, or None
+    by_user = {}
+    messages = messages or {}
 
-async def check_and_send_reminders():
-    db = SessionLocal()
+    def text(row):
+        return messages.get(row.id, row.message)
+
+    for row in rows:
+        if row.quiet_start is not None:
+            if row.user_id not in quiet:
+                quiet[row.user_id] = quiet_until(now, row.timezone, row.quiet_start, row.quiet_end)
+            if quiet[row.user_id] is not None:
+                deferrals.append((row.id, quiet[row.user_id]))
+                continue
+        if coalesce_messages:
+            by_user.setdefault(row.user_id, []).append(row)
+        else:
+            jobs.append((row.id, row.phone_number, text(row)))
+    for user_rows in by_user.values():
+        # Pages arrive in lane order; merged text follows scheduled order
+        user_rows.sort(key=lambda row: (row.scheduled_time, row.id))
+        for indexes, merged in coalesce([text(row) for row in user_rows], max_segments):
+            ids = [user_rows[i].id for i in indexes]
+            jobs.append((ids[0], user_rows[0].phone_number, merged))
+            if len(ids) > 1:
+                groups[ids[0]] = ids
+    return jobs, groups, deferrals
+
+async def send_reminders_concurrently(jobs, concurrency: int = SMS_CONCURRENCY,
+                                      rate_limit: float = SMS_RATE_LIMIT, on_result=None,
+                                      transport: str = SMS_TRANSPORT, bucket: TokenBucket = None):
+    """
+    Send (reminder_id, phone_number, message) jobs with at most `concurrency`
+    provider calls in flight and at most `rate_limit` calls started per second.
+    Jobs for the same phone number go out one after another, in job order, so
+    a user receives their reminders in scheduled order.
+    With transport="threads" the blocking provider call runs on a thread pool;
+    with "async" it is awaited on the loop over the aiohttp client. `on_result`,
+    if given, is called on the loop thread with each SendResult as it
+    completes. `bucket`, if given, is drawn from instead of a new TokenBucket
+    of `rate_limit`, so one limit holds across calls. Returns one SendResult
+    per job, in job order.
+    """
+    if not jobs:
+        return []
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    if bucket is None and rate_limit > 0:
+        bucket = TokenBucket(rate_limit)
+
+    async def send_one(executor, reminder_id, phone_number, message):
+        async with semaphore:
+            if bucket is not None:
+                await bucket.acquire()
+            if executor is None:
+                result = await _send_async(reminder_id, phone_number, message)
+            else:
+                result = await loop.run_in_executor(executor, _send, reminder_id, phone_number, message)
+            if on_result is not None:
+                on_result(result)
+            return result
+
+    chains = {}
+    for index, job in enumerate(jobs):
+        chains.setdefault(job[1], []).append((index, job))
+    results = [None] * len(jobs)
+
+    async def send_chain(executor, chain):
+        for index, job in chain:
+            results[index] = await send_one(executor, *job)
+
+    if transport == "async":
+        await asyncio.gather(*(send_chain(None, chain) for chain in chains.values()))
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            await asyncio.gather(*(send_chain(executor, chain) for chain in chains.values()))
+    return results
+
+async def check_and_send_reminders(session_factory=SessionLocal, concurrency: int = SMS_CONCURRENCY,
+                                   rate_limit: float = SMS_RATE_LIMIT,
+                                   batch_size: int = MARK_SENT_BATCH_SIZE,
+                                   chunk_size: int = PENDING_CHUNK_SIZE,
+                                   worker_id: str = WORKER_ID,
+                                   lease_seconds: int = REMINDER_LEASE_SECONDS,
+                                   reminder_ids=None, transport: str = SMS_TRANSPORT,
+                                   coalesce_messages: bool = COALESCE_MESSAGES,
+                                   max_segments: int = COALESCE_MAX_SEGMENTS, shard: Shard = None,
+                                   bucket: TokenBucket = None):
+    """
+    Claim and send due reminders, page by page, until none are left.
+
+    `reminder_ids` limits the sweep to specific reminders (the daemon passes
+    the ones its in-memory index says are due; they are claimed `chunk_size`
+    ids at a time), and `shard` to one user shard.
+    Failed sends are scheduled for a backed-off retry or dead-lettered, so they
+    are not claimed again in the same sweep. A page's leases are renewed while
+    it sends, and outcomes are only written to rows this worker still holds;
+    if the sweep fails, rows still without an outcome are released. Pages come in priority-lane order,
+    shared fairly between accounts (see claim_due_reminders). Reminders of
+    users in their quiet hours are rescheduled to the end of the window, and
+    with `coalesce_messages` a user's co-due reminders share one SMS (see
+    plan_dispatch). Every page draws from one token bucket, `bucket` if given
+    (the daemon keeps one for its lifetime), so a new page does not start with
+    a fresh burst. Returns one SendResult per sent or failed reminder.
+    """
+    if bucket is None and rate_limit > 0:
+        bucket = TokenBucket(rate_limit)
+    db = session_factory()
+    results = []
+    scheduled = {}  # reminder_id -> (scheduled_time, lane), for the lateness histogram
+    # Outcomes are flushed in chunks while the fan-out is still running, so
+    # a crash mid-batch re-sends at most one chunk. on_result runs on the
+    # loop thread, which is the only thread that touches the session.
+    delivered = []
+    failed = []
+    def flush_delivered():
+        with metrics.DB_QUERY_SECONDS.time(operation="mark_sent"):
+            mark_reminders_sent(db, delivered, worker_id)
+        delivered.clear()
+    def flush_failed():
+        with metrics.DB_QUERY_SECONDS.time(operation="record_failures"):
+            metrics.REMINDERS_DEAD.inc(record_delivery_failures(db, failed, worker_id=worker_id))
+        failed.clear()
+    async def keep_leases():
+        # A rate-limited page can take longer to send than its lease. Renew
+        # the rows not yet written back (unsent or outcome still buffered) a
+        # third of the way into each lease; pages claimed late in a sweep got
+        # theirs at the sweep's `now`.
+        leased_at = now
+        while True:
+            renew_at = leased_at + timedelta(seconds=lease_seconds / 3)
+            await asyncio.sleep(max((renew_at - datetime.utcnow()).total_seconds(), 0))
+            leased_at = datetime.utcnow()
+            try:
+                with metrics.DB_QUERY_SECONDS.time(operation="renew_leases"):
+                    held = list(scheduled) + [item[0] for item in delivered + failed]
+                    renew_leases(db, held, worker_id, lease_seconds, leased_at)
+            except Exception:
+                logger.exception("Could not renew leases; retrying")
+    groups = {}
+    def collect(result):
+        # A coalesced message settles every reminder it carried
+        for reminder_id in groups.pop(result.reminder_id, (result.reminder_id,)):
+            metrics.DISPATCH_QUEUE_DEPTH.dec()
+            scheduled_time, lane = scheduled.pop(reminder_id)
+            results.append(result._replace(reminder_id=reminder_id))
+            if result.sid:
+                metrics.REMINDERS_SENT.inc()
+                metrics.DELIVERY_LATENESS_SECONDS.observe((datetime.utcnow() - scheduled_time).total_seconds(),
+                                                          lane=lane)
+                delivered.append((reminder_id, result.sid))
+                if len(delivered) >= batch_size:
+                    flush_delivered()
+            else:
+                metrics.REMINDERS_FAILED.inc(permanent=result.permanent)
+                failed.append((reminder_id, result.error, result.permanent))
+                if len(failed) >= batch_size:
+                    flush_failed()
     try:
-        reminders = get_pending_reminders(db)
-        for reminder in reminders:
-            user = reminder.user
-            if user and not user.opt_out:
-                # Timezone aware check for scheduled_time
-                user_timezone = pytz.timezone(user.timezone)
-                # Convert naive UTC datetime to timezone-aware
-                scheduled_time_utc = pytz.utc.localize(reminder.scheduled_time)
-                scheduled_time_user_tz = scheduled_time_utc.astimezone(user_timezone)
-                now_user_tz = datetime.now(user_timezone)
-                if now_user_tz >= scheduled_time_user_tz:
-                    print(f"Sending reminder to {user.phone_number}: {reminder.message}")
-                    sid = send_message(user.phone_number, reminder.message)
-                    if sid:
-                        mark_reminder_sent(db, reminder.id)
+        with profile_tick(), metrics.TICK_SECONDS.time():
+            # scheduled_time is stored as naive UTC and "due" is the same instant
+            # in every timezone, so the due check is the SQL comparison against
+            # one UTC `now` per sweep; no per-row tz lookup or aware datetimes.
+            # Each page is leased to this worker before sending, so several
+            # scheduler processes can run side by side without double-sending.
+            now = datetime.utcnow()
+            if reminder_ids is None:
+                id_chunks = [None]
+            else:
+                # Bounded IN lists: SQLite caps the number of bound variables
+                reminder_ids = list(reminder_ids)
+                id_chunks = [reminder_ids[i:i + chunk_size] for i in range(0, len(reminder_ids), chunk_size)]
+            for chunk_ids in id_chunks:
+                while True:
+                    with metrics.DB_QUERY_SECONDS.time(operation="claim"):
+                        rows = claim_due_reminders(db, worker_id, chunk_size, lease_seconds, now, chunk_ids, shard)
+                    if not rows:
+                        break
+                    metrics.REMINDERS_DUE.inc(len(rows))
+                    metrics.DISPATCH_QUEUE_DEPTH.inc(len(rows))
+                    for row in rows:
+                        scheduled[row.id] = (row.scheduled_time, PRIORITY_LANES[row.priority])
+                    # Templated rows are rendered for the whole page at once
+                    messages = render_batch(db, rows)
+                    for row in rows:
+                        logger.debug("Sending reminder to %s: %s", row.phone_number, messages.get(row.id, row.message))
+                    jobs, page_groups, deferrals = plan_dispatch(rows, datetime.utcnow(), coalesce_messages,
+                                                                 max_segments, messages)
+                    if deferrals:
+                        with metrics.DB_QUERY_SECONDS.time(operation="defer"):
+                            defer_reminders(db, deferrals)
+                        metrics.REMINDERS_DEFERRED.inc(len(deferrals))
+                        metrics.DISPATCH_QUEUE_DEPTH.dec(len(deferrals))
+                        for reminder_id, _ in deferrals:
+                            del scheduled[reminder_id]
+                    groups.update(page_groups)
+                    renewer = asyncio.create_task(keep_leases())
+                    try:
+                        await send_reminders_concurrently(jobs, concurrency, rate_limit, on_result=collect,
+                                                          transport=transport, bucket=bucket)
+                    finally:
+                        renewer.cancel()
+            if delivered:
+                flush_delivered()
+            if failed:
+                flush_failed()
+        return results
     finally:
+        # Claimed rows that never got an outcome (the sweep failed or was
+        # cancelled) leave the queue, and go back to it now rather than when
+        # their lease runs out
+        if scheduled:
+            try:
+                release_reminders(db, list(scheduled), worker_id)
+            except Exception:
+                logger.exception("Could not release %d claimed reminders", len(scheduled))
+        metrics.DISPATCH_QUEUE_DEPTH.dec(len(scheduled))
         db.close()
 
+def update_backlog_gauges(session_factory=SessionLocal):
+    """
+    Refresh the gauges that need their own query. Only called when metrics are
+    exported, so ticks without an exporter pay nothing for them.
+    """
+    db = session_factory()
+    try:
+        with metrics.DB_QUERY_SECONDS.time(operation="count_opted_out"):
+            metrics.REMINDERS_OPTED_OUT.set(count_opted_out_due(db))
+    finally:
+        db.close()
+
+class Dispatcher:
+    """
+    Resident replacement for the `while true; python -m app.scheduler; sleep 60`
+    loop. Keeps an UpcomingIndex of reminders due within the look-ahead horizon
+    and sleeps until exactly the next one is due, until the next incremental
+    index refresh, or until create_reminder wakes it. A full
+    check_and_send_reminders sweep still runs every max_sleep seconds as a
+    fallback for anything the index missed. A pass that raises is logged and
+    retried after a backoff; only stop() ends run().
+    """
+
+    def __init__(self, session_factory=SessionLocal, max_sleep: float = DISPATCHER_MAX_SLEEP,
+                 refresh_interval: float = UPCOMING_REFRESH_SECONDS,
+                 horizon_seconds: int = UPCOMING_HORIZON_SECONDS, metrics_file: str = METRICS_FILE,
+                 metrics_port: int = METRICS_PORT, shard: Shard = None,
+                 error_backoff: float = DISPATCHER_ERROR_BACKOFF, rate_limit: float = SMS_RATE_LIMIT,
+                 concurrency: int = SMS_CONCURRENCY):
+        self.session_factory = session_factory
+        self.shard = shard
+        self.rate_limit = rate_limit
+        self.concurrency = concurrency
+        # Shared by every sweep, so back-to-back passes stay under the rate limit
+        self.bucket = TokenBucket(rate_limit) if rate_limit > 0 else None
+        self.metrics_file = metrics_file
+        self.metrics_port = metrics_port
+        self.max_sleep = max_sleep
+        self.refresh_interval = refresh_interval
+        self.error_backoff = error_backoff
+        self.index = UpcomingIndex(horizon_seconds, shard)
+        self._loop = None
+        self._wakeup = None
+        self._stopping = False
+        self._next_wake = None
+
+    def wake(self):
+        """Thread-safe: interrupt the current sleep and run a sweep now."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def stop(self):
+        """Thread-safe: finish the in-flight sweep, then exit run()."""
+        self._stopping = True
+        self.wake()
+
+    def _on_reminders_scheduled(self, scheduled_time):
+        if self._next_wake is None or scheduled_time < self._next_wake:
+            self.wake()
+
+    def _refresh_index(self):
+        db = self.session_factory()
+        try:
+            with metrics.DB_QUERY_SECONDS.time(operation="index_refresh"):
+                self.index.refresh(db)
+        finally:
+            db.close()
+        metrics.UPCOMING_INDEX_SIZE.set(len(self.index))
+
+    def _export_metrics(self, full_sweep: bool = False):
+        if full_sweep and (self.metrics_file or self.metrics_port):
+            update_backlog_gauges(self.session_factory)
+        if self.metrics_file:
+            metrics.write_textfile(self.metrics_file)
+
+    async def _sleep(self, seconds: float):
+        """Sleep up to `seconds`, returning early on wake() or stop()."""
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=max(seconds, 0))
+        except asyncio.TimeoutError:
+            pass
+
+    def _install_signal_handlers(self):
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self._loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                # Not supported on this platform or not in the main thread
+                pass
+
+    async def run(self, handle_signals: bool = True):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        if handle_signals:
+            self._install_signal_handlers()
+        add_reminder_listener(self._on_reminders_scheduled)
+        metrics_server = metrics.start_http_server(self.metrics_port) if self.metrics_port else None
+        next_sweep = datetime.min
+        backoff = 0.0
+        try:
+            while not self._stopping:
+                # Cleared before the work so reminders created meanwhile
+                # trigger an immediate follow-up pass instead of being missed.
+                self._wakeup.clear()
+                self._next_wake = None
+                try:
+                    if datetime.utcnow() >= next_sweep:
+                        await check_and_send_reminders(self.session_factory, self.concurrency, self.rate_limit,
+                                                       shard=self.shard, bucket=self.bucket)
+                        self._export_metrics(full_sweep=True)
+                        next_sweep = datetime.utcnow() + timedelta(seconds=self.max_sleep)
+                    self._refresh_index()
+                    # One claim page at a time; the rest stay in the index for
+                    # the next pass
+                    due = self.index.pop_due(datetime.utcnow(), PENDING_CHUNK_SIZE)
+                    if due:
+                        await check_and_send_reminders(self.session_factory, self.concurrency, self.rate_limit,
+                                                       reminder_ids=due, shard=self.shard, bucket=self.bucket)
+                        self._export_metrics()
+                except Exception:
+                    # A database outage or a failing exporter must not end the
+                    # daemon. Popped ids are not lost: the next full sweep
+                    # claims them.
+                    backoff = min(max(backoff * 2, self.error_backoff), self.max_sleep)
+                    logger.exception("Dispatcher pass failed; retrying in %.1fs", backoff)
+                    await self._sleep(backoff)
+                    continue
+                backoff = 0.0
+                if due:
+                    continue
+                now = datetime.utcnow()
+                wake_at = min(next_sweep, now + timedelta(seconds=self.refresh_interval))
+                next_due = self.index.next_due()
+                if next_due is not None:
+                    wake_at = min(wake_at, next_due)
+                self._next_wake = wake_at
+                await self._sleep((wake_at - now).total_seconds())
+        finally:
+            remove_reminder_listener(self._on_reminders_scheduled)
+            if metrics_server is not None:
+                metrics_server.shutdown()
+                metrics_server.server_close()
+            self._next_wake = None
+            await providers.close_async()
+            logger.info("Dispatcher stopped.")
+
+async def _sweep_once(session_factory=SessionLocal):
+    """One check_and_send_reminders sweep that closes the SMS client's HTTP session when done."""
+    try:
+        return await check_and_send_reminders(session_factory)
+    finally:
+        await providers.close_async()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Send due reminders.")
+    parser.add_argument("--daemon", action="store_true",
+                        help="keep running and dispatch reminders as they become due")
+    parser.add_argument("--max-sleep", type=float, default=DISPATCHER_MAX_SLEEP,
+                        help="longest pause between sweeps in daemon mode (seconds)")
+    parser.add_argument("--metrics-file", default=METRICS_FILE,
+                        help="rewrite this file with Prometheus-format metrics after each tick")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help="serve GET /metrics on this port in daemon mode")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="run this many daemon processes, each owning user_id %% shards")
+    parser.add_argument("--shards-file",
+                        help="re-read the shard count from this file and rebalance when it changes")
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    # Bring an older database up to the schema the sweep queries (idempotent)
+    init_db()
+    if args.shards:
+        from app.supervisor import Supervisor
+        Supervisor(args.shards, max_sleep=args.max_sleep, shards_file=args.shards_file,
+                   metrics_file=args.metrics_file, metrics_port=args.metrics_port,
+                   log_level=args.log_level.upper()).run()
+    elif args.daemon:
+        asyncio.run(Dispatcher(max_sleep=args.max_sleep, metrics_file=args.metrics_file,
+                                metrics_port=args.metrics_port).run())
+    else:
+        results = asyncio.run(_sweep_once())
+        logger.info("Sent %d of %d due reminders", sum(1 for r in results if r.sid), len(results))
+        if args.metrics_file:
+            update_backlog_gauges()
+            metrics.write_textfile(args.metrics_file)
+
 if __name__ == "__main__":
-    asyncio.run(check_and_send_reminders())
+    main()
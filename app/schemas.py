@@ -1,15 +1,163 @@
-from pydantic import BaseModel
-from datetime import datetime
+from typing import Optional
+from pydantic import BaseModel, ConfigDict, field_validator, model_validator
+from datetime import datetime, time
+from app.models import PRIORITY_LANES, PRIORITY_NORMAL
+from app.phone import normalize_phone
+from app.recurrence import validate_rule
+from app.templates import CompiledTemplate
+from app.timezones import validate_timezone
 
 class UserCreate(BaseModel):
     phone_number: str
     timezone: str = "UTC"
+    quiet_start: Optional[time] = None
+    quiet_end: Optional[time] = None
+    account_id: Optional[int] = None
+
+    @field_validator("phone_number")
+    @classmethod
+    def check_phone_number(cls, value: str) -> str:
+        normalize_phone(value)
+        return value
+
+    @field_validator("timezone")
+    @classmethod
+    def check_timezone(cls, value: str) -> str:
+        return validate_timezone(value)
+
+    @model_validator(mode="after")
+    def check_quiet_hours(self):
+        if (self.quiet_start is None) != (self.quiet_end is None):
+            raise ValueError("quiet_start and quiet_end must be given together")
+        return self
 
 class ReminderCreate(BaseModel):
     user_id: int
-    message: str
+    message: str = ""
     scheduled_time: datetime
+    # Either message, or a template and the values for its placeholders
+    template_id: Optional[int] = None
+    variables: Optional[dict[str, str]] = None
+    # Lane index into PRIORITY_LANES, or the lane's name
+    priority: int = PRIORITY_NORMAL
+
+    @field_validator("priority", mode="before")
+    @classmethod
+    def check_priority(cls, value):
+        if isinstance(value, str) and not value.isdigit():
+            if value not in PRIORITY_LANES:
+                raise ValueError(f"priority must be one of {', '.join(PRIORITY_LANES)}")
+            return PRIORITY_LANES.index(value)
+        # int() would raise TypeError on null, lists and dicts, which pydantic
+        # does not turn into a ValidationError
+        if isinstance(value, bool) or not isinstance(value, (int, str)):
+            raise ValueError("priority must be a lane index or name")
+        if not 0 <= int(value) < len(PRIORITY_LANES):
+            raise ValueError(f"priority must be between 0 and {len(PRIORITY_LANES) - 1}")
+        return value
+
+    @model_validator(mode="after")
+    def check_text(self):
+        if self.template_id is None and not self.message:
+            raise ValueError("message or template_id is required")
+        if self.template_id is not None and self.message:
+            raise ValueError("give either message or template_id, not both")
+        return self
+
+class AccountCreate(BaseModel):
+    name: str
+    weight: float = 1.0
+
+    @field_validator("weight")
+    @classmethod
+    def check_weight(cls, value: float) -> float:
+        if value <= 0:
+            raise ValueError("weight must be positive")
+        return value
+
+class TemplateCreate(BaseModel):
+    name: str
+    body: str
+
+    @field_validator("body")
+    @classmethod
+    def check_body(cls, value: str) -> str:
+        CompiledTemplate(value)
+        return value
+
+class ReminderSeriesCreate(BaseModel):
+    user_id: int
+    message: str
+    rule: str
+    start_time: datetime
+
+    @field_validator("rule")
+    @classmethod
+    def check_rule(cls, value: str) -> str:
+        return validate_rule(value)
 
 class OptOutRequest(BaseModel):
     phone_number: str
     opt_out: bool
+
+class UserOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    phone_number: str
+    timezone: str
+    opt_out: bool
+    quiet_start: Optional[time] = None
+    quiet_end: Optional[time] = None
+    account_id: Optional[int] = None
+
+class AccountOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    name: str
+    weight: float
+
+class ReminderOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    user_id: int
+    message: str
+    scheduled_time: datetime
+    sent: bool
+    provider_sid: Optional[str] = None
+    series_id: Optional[int] = None
+    template_id: Optional[int] = None
+    variables: Optional[dict[str, str]] = None
+    priority: int = PRIORITY_NORMAL
+
+class ReminderSeriesOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    user_id: int
+    message: str
+    rule: str
+    start_time: datetime
+    next_occurrence: Optional[datetime] = None
+    occurrence_count: int
+    active: bool
+
+class TemplateOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    name: str
+    body: str
+    encoding: str
+    segments: int
+
+class RowError(BaseModel):
+    row: int
+    error: str
+
+class BatchResult(BaseModel):
+    inserted: int
+    skipped: int
+    errors: list[RowError]
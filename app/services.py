@@ -1,10 +1,67 @@
-from datetime import datetime
-from sqlalchemy.orm import Session
-from app.models import User, Reminder
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import NamedTuple
+import pytz
+from sqlalchemy import Float, and_, bindparam, case, cast, func, insert, literal, or_, select, union_all, update
+from sqlalchemy.orm import Session, aliased
+from app.config import (
+    PENDING_CHUNK_SIZE, REMINDER_LEASE_SECONDS, BULK_BATCH_SIZE,
+    RETRY_BASE_SECONDS, RETRY_MAX_SECONDS, MAX_DELIVERY_ATTEMPTS
+)
+from app.models import (
+    User, Reminder, ReminderSeries, DeliveryLog, MessageTemplate, Account, PRIORITY_LANES, PRIORITY_NORMAL
+)
+from app.phone import normalize_phone, try_normalize_phone
+from app.recurrence import parse_rule, next_occurrence
+from app.templates import CompiledTemplate, template_cache
+from app.timezones import validate_timezone
+from app.user_cache import CachedUser, user_cache
 
-def create_user(db: Session, phone_number: str, timezone: str = "UTC"):
+logger = logging.getLogger(__name__)
+
+# Callbacks invoked with the earliest scheduled_time of newly created
+# reminders (used by the dispatcher daemon to wake up early when something is
+# scheduled before its next tick).
+_reminder_listeners = []
+
+def add_reminder_listener(callback):
+    _reminder_listeners.append(callback)
+
+def remove_reminder_listener(callback):
+    if callback in _reminder_listeners:
+        _reminder_listeners.remove(callback)
+
+def _notify_reminders_scheduled(scheduled_time: datetime):
+    for callback in list(_reminder_listeners):
+        try:
+            callback(scheduled_time)
+        except Exception:
+            logger.exception("Reminder listener failed")
+
+def create_account(db: Session, name: str, weight: float = 1.0):
+    """An account (tenant) owning users; `weight` is its share of each dispatch page."""
+    if weight <= 0:
+        raise ValueError("Account weight must be positive")
+    try:
+        account = Account(name=name, weight=weight)
+        db.add(account)
+        db.commit()
+        db.refresh(account)
+        return account
+    except Exception as e:
+        db.rollback()
+        raise e
+
+def create_user(db: Session, phone_number: str, timezone: str = "UTC", quiet_start=None, quiet_end=None,
+                account_id: int = None):
+    validate_timezone(timezone)
+    phone_e164 = normalize_phone(phone_number)
     try:
-        user = User(phone_number=phone_number, timezone=timezone)
+        user = User(phone_number=phone_number, phone_e164=phone_e164, timezone=timezone,
+                    quiet_start=quiet_start, quiet_end=quiet_end, account_id=account_id)
         db.add(user)
         db.commit()
         db.refresh(user)
@@ -13,43 +70,871 @@ def create_user(db: Session, phone_number: str, timezone: str = "UTC"):
         db.rollback()
         raise e
 
+def _phone_filter(phone_number: str):
+    # Formatting variants match through phone_e164; rows whose number never
+    # normalized (phone_e164 NULL) still match exactly.
+    phone_e164 = try_normalize_phone(phone_number)
+    if phone_e164 is None:
+        return User.phone_number == phone_number
+    return or_(User.phone_e164 == phone_e164, User.phone_number == phone_number)
+
 def get_user_by_phone(db: Session, phone_number: str):
-    return db.query(User).filter(User.phone_number == phone_number).first()
+    return db.query(User).filter(_phone_filter(phone_number)).first()
 
-def opt_out_user(db: Session, phone_number: str):
+def _cached(user: User) -> CachedUser:
+    return CachedUser(user.id, user.phone_number, user.timezone, user.opt_out,
+                      user.quiet_start, user.quiet_end, user.account_id)
+
+def lookup_user(db: Session, phone_number: str):
+    """
+    Read-through cached lookup by phone number (any formatting). Returns a
+    CachedUser (id, phone_number, timezone, opt_out, quiet hours, account_id)
+    or None.
+    """
+    phone_e164 = try_normalize_phone(phone_number) or phone_number
+    cached = user_cache.get_by_phone(phone_e164)
+    if cached is not None:
+        return cached
     user = get_user_by_phone(db, phone_number)
-    if user:
-        user.opt_out = True
+    if user is None:
+        return None
+    cached = _cached(user)
+    user_cache.put(cached, phone_e164)
+    return cached
+
+def lookup_user_by_id(db: Session, user_id: int):
+    """Read-through cached lookup by id; see lookup_user."""
+    cached = user_cache.get_by_id(user_id)
+    if cached is not None:
+        return cached
+    user = db.get(User, user_id)
+    if user is None:
+        return None
+    cached = _cached(user)
+    user_cache.put(cached, user.phone_e164)
+    return cached
+
+def _set_opt_out(db: Session, phone_number: str, opt_out: bool):
+    # One UPDATE ... RETURNING instead of lookup, commit and refresh;
+    # populate_existing refreshes a user already loaded in this session
+    stmt = update(User)\
+        .where(_phone_filter(phone_number))\
+        .values(opt_out=opt_out)\
+        .returning(User)\
+        .execution_options(synchronize_session=False, populate_existing=True)
+    try:
+        user = db.execute(stmt).scalars().first()
+        cached = _cached(user) if user is not None else None
+        phone_e164 = user.phone_e164 if user is not None else None
         db.commit()
-        db.refresh(user)
+    except Exception as e:
+        db.rollback()
+        raise e
+    if cached is not None:
+        # Write through: the dispatcher and API read the new flag from the cache
+        user_cache.put(cached, phone_e164)
     return user
 
-def opt_in_user(db: Session, phone_number: str):
+def opt_out_user(db: Session, phone_number: str):
+    return _set_opt_out(db, phone_number, True)
+
+def set_opt_out_many(db: Session, changes) -> int:
+    """
+    Apply many opt-out flips, {phone_number: opt_out}, with one UPDATE ...
+    RETURNING: a CASE on the number picks each user's new value. Numbers are
+    matched like get_user_by_phone; when two spellings of one number are
+    given, the later one wins. Returns the number of users updated.
+    """
+    by_number = {}
+    for phone_number, opt_out in changes.items():
+        by_number[try_normalize_phone(phone_number) or phone_number] = opt_out
+    if not by_number:
+        return 0
+    stopped = [number for number, opt_out in by_number.items() if opt_out]
+    stmt = update(User)\
+        .where(or_(User.phone_e164.in_(by_number), User.phone_number.in_(by_number)))\
+        .values(opt_out=case((or_(User.phone_e164.in_(stopped), User.phone_number.in_(stopped)), True),
+                             else_=False))\
+        .returning(User.id, User.phone_e164, User.phone_number)\
+        .execution_options(synchronize_session=False)
+    try:
+        rows = db.execute(stmt).all()
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise e
+    for user_id, phone_e164, phone_number in rows:
+        user_cache.invalidate(user_id, phone_e164 or phone_number)
+    return len(rows)
+
+def set_quiet_hours(db: Session, phone_number: str, start, end):
+    """Set (or with None, clear) the user's quiet window, as local datetime.time values."""
+    if (start is None) != (end is None):
+        raise ValueError("Quiet hours need both a start and an end")
     user = get_user_by_phone(db, phone_number)
     if user:
-        user.opt_out = False
+        user.quiet_start = start
+        user.quiet_end = end
         db.commit()
         db.refresh(user)
+        user_cache.invalidate(user.id, user.phone_e164 or user.phone_number)
     return user
 
-def create_reminder(db: Session, user_id: int, message: str, scheduled_time: datetime):
-    reminder = Reminder(user_id=user_id, message=message, scheduled_time=scheduled_time)
+def opt_in_user(db: Session, phone_number: str):
+    return _set_opt_out(db, phone_number, False)
+
+def create_template(db: Session, name: str, body: str):
+    """Store a message template with its precomputed encoding and segment count."""
+    compiled = CompiledTemplate(body)
+    template = MessageTemplate(name=name, body=body, encoding=compiled.encoding, segments=compiled.segments)
+    db.add(template)
+    db.commit()
+    db.refresh(template)
+    return template
+
+def _check_variables(template, variables):
+    if template is None:
+        raise ValueError("Unknown template")
+    missing = template.missing(variables)
+    if missing:
+        raise ValueError(f"Missing template variables: {', '.join(missing)}")
+
+def _account_of(user_id):
+    """The user's account id, looked up by the INSERT itself."""
+    return select(User.account_id).where(User.id == user_id).scalar_subquery()
+
+def create_reminder(db: Session, user_id: int, message: str, scheduled_time: datetime,
+                    template_id: int = None, variables: dict = None, priority: int = PRIORITY_NORMAL):
+    """
+    Schedule a reminder with its own `message`, or with `template_id` and the
+    `variables` for every placeholder in that template. `priority` is its lane,
+    an index into PRIORITY_LANES.
+    """
+    if template_id is not None:
+        _check_variables(template_cache.get(db, template_id), variables)
+    reminder = Reminder(user_id=user_id, message=message or "", template_id=template_id, variables=variables,
+                        scheduled_time=_to_naive_utc(scheduled_time), priority=priority,
+                        account_id=_account_of(user_id))
     db.add(reminder)
     db.commit()
     db.refresh(reminder)
+    _notify_reminders_scheduled(reminder.scheduled_time)
     return reminder
 
+class ImportStats(NamedTuple):
+    inserted: int
+    skipped: int
+    errors: list  # (row_number, message) for rows that failed validation
+    elapsed: float
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.inserted / self.elapsed if self.elapsed > 0 else 0.0
+
+def _batches(rows, size: int):
+    iterator = iter(rows)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def _validation_message(error) -> str:
+    return "; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in error.errors())
+
+def _to_naive_utc(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        return value.astimezone(pytz.utc).replace(tzinfo=None)
+    return value
+
+def _insert_chunk(db: Session, table, rows):
+    try:
+        db.execute(insert(table), rows)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise e
+
+def bulk_create_users(db: Session, rows, batch_size: int = BULK_BATCH_SIZE) -> ImportStats:
+    """
+    Insert users from an iterable of dicts (phone_number, timezone) in chunks
+    of `batch_size`, one executemany INSERT and one commit per chunk. Rows are
+    validated with UserCreate; phone numbers that already exist (compared in
+    E.164 form), in the database or earlier in the input, are skipped. A row
+    given as an exception (input the reader could not parse) is reported as
+    that row's error.
+    """
+    # pydantic is only needed by imports, not by the scheduler's import path
+    from pydantic import ValidationError
+    from app.schemas import UserCreate
+    start = time.perf_counter()
+    inserted = skipped = 0
+    errors = []
+    seen = set()
+    row_number = 0
+    for batch in _batches(rows, batch_size):
+        valid = []
+        for raw in batch:
+            row_number += 1
+            if isinstance(raw, Exception):
+                errors.append((row_number, str(raw)))
+                continue
+            try:
+                user = UserCreate.model_validate(raw)
+            except ValidationError as e:
+                errors.append((row_number, _validation_message(e)))
+                continue
+            phone_e164 = normalize_phone(user.phone_number)
+            if phone_e164 in seen:
+                skipped += 1
+                continue
+            seen.add(phone_e164)
+            valid.append({"phone_number": user.phone_number, "phone_e164": phone_e164, "timezone": user.timezone,
+                          "quiet_start": user.quiet_start, "quiet_end": user.quiet_end,
+                          "account_id": user.account_id})
+        if not valid:
+            continue
+        existing = set(db.execute(
+            select(User.phone_e164).where(User.phone_e164.in_([r["phone_e164"] for r in valid]))
+        ).scalars())
+        new_rows = [r for r in valid if r["phone_e164"] not in existing]
+        skipped += len(valid) - len(new_rows)
+        if new_rows:
+            _insert_chunk(db, User.__table__, new_rows)
+            inserted += len(new_rows)
+    return ImportStats(inserted, skipped, errors, time.perf_counter() - start)
+
+def bulk_create_reminders(db: Session, rows, batch_size: int = BULK_BATCH_SIZE) -> ImportStats:
+    """
+    Insert reminders from an iterable of dicts in chunks of `batch_size`, one
+    executemany INSERT and one commit per chunk. Each row names its user by
+    `user_id` or by `phone_number`; phone numbers are resolved in E.164 form
+    through the user cache, then one SELECT per chunk for the rest. Rows are
+    validated with ReminderCreate, must name an existing user (checked with
+    one SELECT per chunk), and rows using a template must supply all of its
+    variables; timezone-aware scheduled times are stored as naive UTC. As in
+    bulk_create_users, a row given as an exception is reported as an error.
+    """
+    from pydantic import ValidationError
+    from app.schemas import ReminderCreate
+    start = time.perf_counter()
+    inserted = 0
+    errors = []
+    phone_to_id = {}
+    row_number = 0
+    for batch in _batches(rows, batch_size):
+        numbered = []
+        for raw in batch:
+            row_number += 1
+            if isinstance(raw, Exception):
+                errors.append((row_number, str(raw)))
+                continue
+            numbered.append((row_number, raw))
+        unknown = set()
+        for _, raw in numbered:
+            if not raw.get("user_id") and raw.get("phone_number"):
+                phone_e164 = try_normalize_phone(raw["phone_number"])
+                if phone_e164 is not None and phone_e164 not in phone_to_id:
+                    cached = user_cache.get_by_phone(phone_e164)
+                    if cached is not None:
+                        phone_to_id[phone_e164] = cached.id
+                    else:
+                        unknown.add(phone_e164)
+        if unknown:
+            for user in db.execute(
+                select(User.id, User.phone_number, User.timezone, User.opt_out, User.quiet_start,
+                       User.quiet_end, User.account_id, User.phone_e164)
+                .where(User.phone_e164.in_(unknown))
+            ).all():
+                phone_to_id[user.phone_e164] = user.id
+                user_cache.put(_cached(user), user.phone_e164)
+        validated = []
+        for number, raw in numbered:
+            if not raw.get("user_id") and raw.get("phone_number"):
+                user_id = phone_to_id.get(try_normalize_phone(raw["phone_number"]))
+                if user_id is None:
+                    errors.append((number, f"phone_number: unknown user {raw['phone_number']}"))
+                    continue
+                raw = {**raw, "user_id": user_id}
+            try:
+                reminder = ReminderCreate.model_validate(raw)
+            except ValidationError as e:
+                errors.append((number, _validation_message(e)))
+                continue
+            validated.append((number, reminder))
+        accounts = {}
+        if validated:
+            accounts = dict(db.execute(
+                select(User.id, User.account_id).where(User.id.in_({r.user_id for _, r in validated}))
+            ).all())
+        known = []
+        for number, reminder in validated:
+            if reminder.user_id not in accounts:
+                errors.append((number, f"user_id: unknown user {reminder.user_id}"))
+                continue
+            known.append((number, reminder))
+        validated = known
+        templates = template_cache.get_many(
+            db, {reminder.template_id for _, reminder in validated if reminder.template_id is not None}
+        )
+        valid = []
+        for number, reminder in validated:
+            if reminder.template_id is not None:
+                try:
+                    _check_variables(templates.get(reminder.template_id), reminder.variables)
+                except ValueError as e:
+                    errors.append((number, f"template_id: {e}"))
+                    continue
+            valid.append({
+                "user_id": reminder.user_id,
+                "message": reminder.message,
+                "template_id": reminder.template_id,
+                "variables": reminder.variables,
+                "scheduled_time": _to_naive_utc(reminder.scheduled_time),
+                "priority": reminder.priority,
+            })
+        if valid:
+            for row in valid:
+                row["account_id"] = accounts[row["user_id"]]
+            _insert_chunk(db, Reminder.__table__, valid)
+            inserted += len(valid)
+            _notify_reminders_scheduled(min(r["scheduled_time"] for r in valid))
+    return ImportStats(inserted, 0, sorted(errors), time.perf_counter() - start)
+
+def _due_filter(now: datetime):
+    return and_(
+        Reminder.sent == False, Reminder.scheduled_time <= now, User.opt_out == False,
+        Reminder.status != "dead",
+        or_(Reminder.next_attempt_at == None, Reminder.next_attempt_at <= now),
+    )
+
 def get_pending_reminders(db: Session):
     now = datetime.utcnow()
     return db.query(Reminder)\
         .join(User)\
-        .filter(Reminder.sent == False, Reminder.scheduled_time <= now, User.opt_out == False)\
+        .filter(_due_filter(now))\
         .all()
 
-def mark_reminder_sent(db: Session, reminder_id: int):
+# Everything the dispatcher needs for one send, fetched in the due query itself
+# so it never touches the Reminder.user relationship.
+DISPATCH_COLUMNS = (
+    Reminder.id, Reminder.user_id, Reminder.message, Reminder.template_id, Reminder.variables,
+    Reminder.scheduled_time, Reminder.priority, Reminder.account_id, func.coalesce(Account.weight, 1.0).label("weight"),
+    User.phone_number, User.timezone, User.opt_out, User.quiet_start, User.quiet_end,
+)
+
+def _iter_due(db: Session, entities, chunk_size: int, now: datetime):
+    last = None
+    while True:
+        query = db.query(*entities).select_from(Reminder).join(User)\
+            .outerjoin(Account, Account.id == Reminder.account_id)\
+            .filter(_due_filter(now))
+        if last is not None:
+            last_time, last_id = last
+            query = query.filter(or_(
+                Reminder.scheduled_time > last_time,
+                and_(Reminder.scheduled_time == last_time, Reminder.id > last_id),
+            ))
+        chunk = query.order_by(Reminder.scheduled_time, Reminder.id).limit(chunk_size).all()
+        if not chunk:
+            return
+        # Read the cursor before yielding: the caller may commit, which
+        # expires loaded ORM objects.
+        last = (chunk[-1].scheduled_time, chunk[-1].id)
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+
+def iter_pending_reminders(db: Session, chunk_size: int = PENDING_CHUNK_SIZE, now: datetime = None):
+    """
+    Yield due reminders in lists of at most `chunk_size`, ordered by
+    (scheduled_time, id) and paginated by keyset rather than OFFSET, so each
+    page is an index range scan on ix_reminders_due. `now` is fixed when the
+    scan starts; reminders becoming due afterwards belong to the next sweep.
+    """
+    return _iter_due(db, (Reminder,), chunk_size, now or datetime.utcnow())
+
+def iter_due_dispatch(db: Session, chunk_size: int = PENDING_CHUNK_SIZE, now: datetime = None):
+    """
+    Same scan as iter_pending_reminders, but yields lightweight rows of
+    DISPATCH_COLUMNS (id, user_id, message, template_id, variables,
+    scheduled_time, priority, account_id, weight, phone_number, timezone,
+    opt_out, quiet_start, quiet_end) from a single joined SELECT per page.
+    """
+    return _iter_due(db, DISPATCH_COLUMNS, chunk_size, now or datetime.utcnow())
+
+def count_opted_out_due(db: Session, now: datetime = None) -> int:
+    """Due, unsent reminders held back because their user opted out"""
+    now = now or datetime.utcnow()
+    return db.query(func.count(Reminder.id))\
+        .join(User)\
+        .filter(Reminder.sent == False, Reminder.scheduled_time <= now, User.opt_out == True,
+                Reminder.status != "dead")\
+        .scalar()
+
+class Shard(NamedTuple):
+    """The slice of users a sharded scheduler worker owns: user_id % count == index."""
+    index: int
+    count: int
+
+def _in_shard(shard):
+    return (Reminder.user_id % shard.count) == shard.index
+
+def _lease_free(now: datetime):
+    return or_(Reminder.lease_expires_at == None, Reminder.lease_expires_at <= now)
+
+def _queue_head(now: datetime, lane: int, account_id, limit: int, criteria):
+    """
+    Ids of the first `limit` claimable reminders of one (account, lane) queue,
+    read in order from ix_reminders_lane. No queue can contribute more than
+    that to one page.
+    """
+    return select(Reminder.id)\
+        .join(User)\
+        .where(Reminder.account_id == account_id, Reminder.priority == lane,
+               _due_filter(now), _lease_free(now), *criteria)\
+        .order_by(Reminder.scheduled_time, Reminder.id)\
+        .limit(limit)
+
+def _fair_ranked(now: datetime, limit: int, criteria):
+    """
+    The heads of every (account, lane) queue, each with its virtual finish
+    position: its place in its queue divided by the account's weight. Taking
+    them by ascending finish within a lane serves accounts in proportion to
+    their weight (weighted fair queuing); users without an account share one
+    queue of weight 1. Ranking only the heads keeps each claim at
+    O(accounts x lanes x limit), however large the due backlog is.
+    """
+    picked = aliased(Reminder, name="picked")
+    heads = []
+    for lane in range(len(PRIORITY_LANES)):
+        # One correlated head per account, like a LATERAL join
+        heads.append(
+            select(picked.id, picked.priority, picked.account_id, picked.scheduled_time, Account.weight)
+            .select_from(Account)
+            .join(picked, picked.id.in_(_queue_head(now, lane, Account.id, limit, criteria).correlate(Account)))
+        )
+        heads.append(
+            select(picked.id, picked.priority, picked.account_id, picked.scheduled_time,
+                   literal(1.0, Float).label("weight"))
+            .where(picked.id.in_(_queue_head(now, lane, None, limit, criteria)))
+        )
+    heads = union_all(*heads).subquery()
+    position = func.row_number().over(partition_by=(heads.c.priority, heads.c.account_id),
+                                      order_by=(heads.c.scheduled_time, heads.c.id))
+    return select(heads.c.id, heads.c.priority, heads.c.scheduled_time,
+                  (cast(position, Float) / heads.c.weight).label("finish")).subquery()
+
+def fair_order(rows) -> list:
+    """
+    `rows` (DISPATCH_COLUMNS) in the order claim_due_reminders takes them:
+    higher lanes first, then by weighted finish position per account, then
+    (scheduled_time, id).
+    """
+    rows = sorted(rows, key=lambda row: (row.scheduled_time, row.id))
+    positions = {}
+    keyed = []
+    for row in rows:
+        queue = (row.priority, row.account_id)
+        positions[queue] = positions.get(queue, 0) + 1
+        keyed.append(((-row.priority, positions[queue] / row.weight, row.scheduled_time, row.id), row))
+    keyed.sort(key=lambda item: item[0])
+    return [row for _, row in keyed]
+
+def claim_due_reminders(db: Session, worker_id: str, limit: int = PENDING_CHUNK_SIZE,
+                        lease_seconds: int = REMINDER_LEASE_SECONDS, now: datetime = None,
+                        reminder_ids=None, shard: Shard = None):
+    """
+    Atomically lease up to `limit` due, unleased reminders to `worker_id` and
+    return them as DISPATCH_COLUMNS rows in dispatch order (see fair_order).
+    `reminder_ids` restricts the claim to specific reminders (still only the
+    ones that are due and free); `shard` to the reminders of one user shard.
+
+    Pages are filled lane by lane: no bulk reminder is claimed while a normal
+    or high one is due. Within a lane, accounts share the page by weight, so
+    one account's backlog can't starve the others (see _fair_ranked).
+
+    The claim is one UPDATE ... WHERE id IN (due subquery) RETURNING id. On
+    Postgres the subquery takes FOR UPDATE SKIP LOCKED, so concurrent workers
+    skip each other's rows instead of blocking; on SQLite the UPDATE runs under
+    the database write lock. Leases left behind by a crashed worker expire
+    after `lease_seconds` and are claimed again by the same statement.
+    """
+    now = now or datetime.utcnow()
+    criteria = []
+    if reminder_ids is not None:
+        criteria.append(Reminder.id.in_(reminder_ids))
+    if shard is not None:
+        criteria.append(_in_shard(shard))
+    ranked = _fair_ranked(now, limit, criteria)
+    candidates = select(Reminder.id)\
+        .join(ranked, ranked.c.id == Reminder.id)\
+        .order_by(ranked.c.priority.desc(), ranked.c.finish, Reminder.scheduled_time, Reminder.id)\
+        .limit(limit)
+    if db.get_bind().dialect.name == "postgresql":
+        candidates = candidates.with_for_update(skip_locked=True, of=Reminder)
+    stmt = update(Reminder)\
+        .where(Reminder.id.in_(candidates.scalar_subquery()), _lease_free(now))\
+        .values(lease_owner=worker_id, lease_expires_at=now + timedelta(seconds=lease_seconds))\
+        .returning(Reminder.id)\
+        .execution_options(synchronize_session=False)
+    try:
+        claimed = db.execute(stmt).scalars().all()
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise e
+    if not claimed:
+        return []
+    return fair_order(db.query(*DISPATCH_COLUMNS)
+                      .select_from(Reminder)
+                      .join(User)
+                      .outerjoin(Account, Account.id == Reminder.account_id)
+                      .filter(Reminder.id.in_(claimed))
+                      .all())
+
+def get_upcoming_changes(db: Session, changed_since: datetime, window_start: datetime, window_end: datetime,
+                         shard: Shard = None):
+    """
+    Rows the dispatcher's in-memory index needs to catch up: reminders updated
+    at or after `changed_since` (any state or time, so sends and reschedules
+    by other workers are seen) and unsent reminders entering the window
+    (`window_start`, `window_end`]. With `changed_since` None, every unsent
+    reminder up to `window_end` is returned. Only reminders that could still
+    be claimed are loaded this way (not dead, user opted in); the changed rows
+    come in any state. `shard` limits every query to one user shard. Returns
+    rows of (id, scheduled_time, lease_expires_at, next_attempt_at, sent,
+    status, updated_at).
+    """
+    columns = (Reminder.id, Reminder.scheduled_time, Reminder.lease_expires_at,
+               Reminder.next_attempt_at, Reminder.sent, Reminder.status, Reminder.updated_at)
+    def query(*criteria):
+        if shard is not None:
+            criteria += (_in_shard(shard),)
+        return db.query(*columns).filter(*criteria).all()
+    def pending(*criteria):
+        return query(Reminder.user_id.in_(select(User.id).where(User.opt_out == False)),
+                     Reminder.sent == False, Reminder.status != "dead", *criteria)
+    if changed_since is None:
+        return pending(Reminder.scheduled_time <= window_end)
+    changed = query(Reminder.updated_at >= changed_since)
+    entering = pending(Reminder.scheduled_time > window_start,
+                       Reminder.scheduled_time <= window_end)
+    return changed + entering
+
+def release_reminders(db: Session, reminder_ids, worker_id: str = None) -> int:
+    """Drop the lease on unsent reminders so the next sweep can claim them again."""
+    if not reminder_ids:
+        return 0
+    stmt = update(Reminder)\
+        .where(Reminder.id.in_(reminder_ids), Reminder.sent == False)\
+        .values(lease_owner=None, lease_expires_at=None)\
+        .execution_options(synchronize_session=False)
+    if worker_id is not None:
+        stmt = stmt.where(Reminder.lease_owner == worker_id)
+    try:
+        released = db.execute(stmt).rowcount
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise e
+    return released
+
+def renew_leases(db: Session, reminder_ids, worker_id: str,
+                 lease_seconds: int = REMINDER_LEASE_SECONDS, now: datetime = None) -> int:
+    """
+    Push back the lease on unsent reminders `worker_id` still holds, for a
+    page that is taking longer to send than its lease. Returns rows renewed.
+    """
+    if not reminder_ids:
+        return 0
+    now = now or datetime.utcnow()
+    stmt = update(Reminder)\
+        .where(Reminder.id.in_(reminder_ids), Reminder.sent == False, Reminder.lease_owner == worker_id)\
+        .values(lease_expires_at=now + timedelta(seconds=lease_seconds))\
+        .execution_options(synchronize_session=False)
+    try:
+        renewed = db.execute(stmt).rowcount
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise e
+    return renewed
+
+def create_series(db: Session, user_id: int, message: str, rule: str, start_time: datetime):
+    """
+    Create a repeating reminder. `rule` is interpreted in the user's timezone
+    (see app.recurrence); only the first occurrence, at `start_time`, is
+    written to the reminders table now.
+    """
+    parsed = parse_rule(rule)
+    start_time = _to_naive_utc(start_time)
+    if parsed.until is not None and start_time > parsed.until:
+        raise ValueError("start_time is after the rule's UNTIL")
+    try:
+        series = ReminderSeries(
+            user_id=user_id, message=message, rule=rule, start_time=start_time,
+            next_occurrence=start_time, occurrence_count=1, active=True,
+        )
+        db.add(series)
+        db.flush()
+        db.add(Reminder(user_id=user_id, message=message, scheduled_time=start_time, series_id=series.id,
+                        account_id=_account_of(user_id)))
+        db.commit()
+        db.refresh(series)
+    except Exception as e:
+        db.rollback()
+        raise e
+    _notify_reminders_scheduled(start_time)
+    return series
+
+def cancel_series(db: Session, series_id: int):
+    """Stop a series and drop its pending occurrence."""
+    series = db.get(ReminderSeries, series_id)
+    if series:
+        series.active = False
+        series.next_occurrence = None
+        db.query(Reminder)\
+            .filter(Reminder.series_id == series_id, Reminder.sent == False)\
+            .delete(synchronize_session=False)
+        db.commit()
+        db.refresh(series)
+    return series
+
+def _roll_forward_series(db: Session, reminder_ids, now: datetime):
+    """
+    Materialize the next occurrence of every active series whose current
+    occurrence is among `reminder_ids`. Runs inside the caller's transaction.
+    Occurrences missed while nothing was sending are skipped rather than sent
+    in a burst. Returns the inserted reminder rows as dicts.
+    """
+    done = {}
+    for series_id, reminder_id in db.execute(
+        select(Reminder.series_id, Reminder.id)
+        .where(Reminder.id.in_(reminder_ids), Reminder.series_id != None)
+    ).all():
+        done.setdefault(series_id, set()).add(reminder_id)
+    if not done:
+        return []
+    # A series' current occurrence is its newest reminder row. It is matched
+    # by id, not scheduled_time, which quiet hours may have moved.
+    latest = dict(db.execute(
+        select(Reminder.series_id, func.max(Reminder.id))
+        .where(Reminder.series_id.in_(done))
+        .group_by(Reminder.series_id)
+    ).all())
+    new_rows = []
+    series_rows = db.query(ReminderSeries, User.timezone, User.account_id)\
+        .join(User)\
+        .filter(ReminderSeries.id.in_(done), ReminderSeries.active == True)\
+        .all()
+    for series, timezone, account_id in series_rows:
+        # Only the current occurrence advances the series, so marking the
+        # same reminder twice cannot materialize two successors.
+        if latest.get(series.id) not in done[series.id]:
+            continue
+        rule = parse_rule(series.rule)
+        upcoming = None
+        if rule.count is None or series.occurrence_count < rule.count:
+            upcoming = next_occurrence(rule, series.start_time, max(series.next_occurrence, now), timezone)
+        if upcoming is None:
+            series.active = False
+            series.next_occurrence = None
+            continue
+        series.next_occurrence = upcoming
+        series.occurrence_count += 1
+        new_rows.append({
+            "user_id": series.user_id, "message": series.message,
+            "scheduled_time": upcoming, "series_id": series.id, "account_id": account_id,
+        })
+    if new_rows:
+        db.execute(insert(Reminder.__table__), new_rows)
+    return new_rows
+
+def _log_deliveries(db: Session, rows):
+    """Append delivery_log rows (dicts) inside the caller's transaction."""
+    if rows:
+        db.execute(insert(DeliveryLog.__table__), rows)
+
+def mark_reminder_sent(db: Session, reminder_id: int, provider_sid: str = None):
     reminder = db.query(Reminder).filter(Reminder.id == reminder_id).first()
     if reminder:
+        now = datetime.utcnow()
         reminder.sent = True
+        reminder.status = "sent"
+        if provider_sid:
+            reminder.provider_sid = provider_sid
+        _log_deliveries(db, [{"reminder_id": reminder_id, "provider_sid": provider_sid,
+                              "attempted_at": now, "status": "sent"}])
+        new_rows = _roll_forward_series(db, [reminder_id], now)
         db.commit()
         db.refresh(reminder)
+        if new_rows:
+            _notify_reminders_scheduled(min(r["scheduled_time"] for r in new_rows))
     return reminder
+
+def mark_reminders_sent(db: Session, reminders, worker_id: str = None) -> int:
+    """
+    Mark many reminders as sent in a single transaction.
+
+    `reminders` is an iterable of reminder ids or (reminder_id, provider_sid)
+    pairs, flipped with one UPDATE ... WHERE id IN (...) RETURNING id; a CASE
+    on the id writes each pair's SID. With `worker_id`, only rows that worker
+    still holds the lease on are flipped, so a worker whose lease ran out
+    cannot overwrite the outcome of the worker that took over. A delivery_log
+    row and the next occurrence of a recurring reminder are written, in the
+    same transaction, for the rows that UPDATE returned only. Returns the
+    number of rows updated.
+    """
+    sids = {}
+    for item in reminders:
+        if isinstance(item, (tuple, list)):
+            sids[item[0]] = item[1]
+        else:
+            sids[item] = None
+    if not sids:
+        return 0
+    table = Reminder.__table__
+    now = datetime.utcnow()
+    values = {"sent": True, "status": "sent", "lease_owner": None, "lease_expires_at": None}
+    with_sid = {reminder_id: sid for reminder_id, sid in sids.items() if sid is not None}
+    if with_sid:
+        values["provider_sid"] = case(with_sid, value=table.c.id, else_=table.c.provider_sid)
+    stmt = update(table)\
+        .where(table.c.id.in_(sids))\
+        .values(**values)\
+        .returning(table.c.id)
+    if worker_id is not None:
+        stmt = stmt.where(table.c.lease_owner == worker_id)
+    try:
+        updated = set(db.execute(stmt).scalars())
+        done = [reminder_id for reminder_id in sids if reminder_id in updated]
+        _log_deliveries(db, [{"reminder_id": reminder_id, "provider_sid": sids[reminder_id], "attempted_at": now,
+                              "status": "sent"} for reminder_id in done])
+        new_rows = _roll_forward_series(db, done, now) if done else []
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise e
+    if new_rows:
+        _notify_reminders_scheduled(min(r["scheduled_time"] for r in new_rows))
+    return len(updated)
+
+def defer_reminders(db: Session, deferrals) -> int:
+    """
+    Move reminders to later scheduled times in one executemany UPDATE.
+    `deferrals` is an iterable of (reminder_id, new_scheduled_time); leases
+    are dropped so whichever worker is free picks them up when due.
+    """
+    rows = [{"b_id": reminder_id, "b_time": scheduled_time} for reminder_id, scheduled_time in deferrals]
+    if not rows:
+        return 0
+    table = Reminder.__table__
+    stmt = update(table)\
+        .where(table.c.id == bindparam("b_id"))\
+        .values(scheduled_time=bindparam("b_time"), lease_owner=None, lease_expires_at=None)
+    try:
+        updated = db.execute(stmt, rows).rowcount
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise e
+    _notify_reminders_scheduled(min(row["b_time"] for row in rows))
+    return updated
+
+# Provider statuses that end a message's lifecycle. Callbacks can arrive out
+# of order, and a late interim status ("sent") must not overwrite these.
+FINAL_DELIVERY_STATUSES = ("delivered", "undelivered", "failed", "read", "canceled")
+
+def record_delivery_statuses(db: Session, statuses) -> int:
+    """
+    Store provider delivery statuses on delivery_log, keyed by provider SID.
+    `statuses` is an iterable of (provider_sid, status, error_code,
+    updated_at) with one entry per SID. Written with one executemany UPDATE
+    for final statuses and one for interim ones, which only touches rows
+    without a final status yet. Returns the number of rows updated.
+    """
+    final, interim = [], []
+    for sid, status, error_code, updated_at in statuses:
+        row = {"b_sid": sid, "b_status": status, "b_code": error_code, "b_at": updated_at}
+        (final if status in FINAL_DELIVERY_STATUSES else interim).append(row)
+    table = DeliveryLog.__table__
+    stmt = update(table)\
+        .where(table.c.provider_sid == bindparam("b_sid"))\
+        .values(delivery_status=bindparam("b_status"), delivery_error_code=bindparam("b_code"),
+                delivery_updated_at=bindparam("b_at"))
+    updated = 0
+    try:
+        if final:
+            updated += db.execute(stmt, final).rowcount
+        if interim:
+            # Spelled out: an expanding NOT IN can't be used with executemany
+            not_final = or_(table.c.delivery_status == None,
+                            and_(*(table.c.delivery_status != status for status in FINAL_DELIVERY_STATUSES)))
+            updated += db.execute(stmt.where(not_final), interim).rowcount
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise e
+    return updated
+
+def retry_delay(attempts: int) -> timedelta:
+    """Exponential backoff after `attempts` failures, with jitter in the upper half."""
+    delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    return timedelta(seconds=delay / 2 + random.uniform(0, delay / 2))
+
+def record_delivery_failures(db: Session, failures, now: datetime = None,
+                             max_attempts: int = MAX_DELIVERY_ATTEMPTS, worker_id: str = None) -> int:
+    """
+    Record failed sends in one transaction. `failures` is an iterable of
+    (reminder_id, error_message, permanent) tuples. Each reminder's attempt
+    count goes up and its lease is dropped; it is retried at a jittered,
+    exponentially growing next_attempt_at, or moved to status "dead" when the
+    error is permanent or max_attempts is reached. Every attempt is appended
+    to delivery_log as "failed" or "dead". A dead recurring reminder still
+    advances its series. With `worker_id`, reminders whose lease has passed to
+    another worker are left alone. Returns the number of dead-lettered
+    reminders.
+    """
+    failures = {reminder_id: (error, permanent) for reminder_id, error, permanent in failures}
+    if not failures:
+        return 0
+    now = now or datetime.utcnow()
+    query = select(Reminder.id, Reminder.attempts).where(Reminder.id.in_(failures), Reminder.sent == False)
+    if worker_id is not None:
+        query = query.where(Reminder.lease_owner == worker_id)
+    attempts = dict(db.execute(query).all())
+    rows, dead, log_rows = [], [], []
+    for reminder_id, previous in attempts.items():
+        error, permanent = failures[reminder_id]
+        count = (previous or 0) + 1
+        is_dead = permanent or count >= max_attempts
+        if is_dead:
+            dead.append(reminder_id)
+        log_rows.append({"reminder_id": reminder_id, "provider_sid": None, "attempted_at": now,
+                         "status": "dead" if is_dead else "failed", "error": (error or "")[:500]})
+        rows.append({
+            "b_id": reminder_id,
+            "b_attempts": count,
+            "b_status": "dead" if is_dead else "pending",
+            "b_next": None if is_dead else now + retry_delay(count),
+            "b_error": (error or "")[:500],
+        })
+    table = Reminder.__table__
+    stmt = update(table)\
+        .where(table.c.id == bindparam("b_id"))\
+        .values(attempts=bindparam("b_attempts"), status=bindparam("b_status"),
+                next_attempt_at=bindparam("b_next"), last_error=bindparam("b_error"),
+                lease_owner=None, lease_expires_at=None)
+    try:
+        if rows:
+            db.execute(stmt, rows)
+        _log_deliveries(db, log_rows)
+        new_rows = _roll_forward_series(db, dead, now) if dead else []
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise e
+    if new_rows:
+        _notify_reminders_scheduled(min(r["scheduled_time"] for r in new_rows))
+    return len(dead)
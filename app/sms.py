@@ -0,0 +1,59 @@
+"""
+SMS encoding and segment arithmetic.
+
+A message that fits the GSM 03.38 alphabet is sent as GSM-7: 160 characters in
+one segment, 153 per segment once it is split (the rest carries the
+concatenation header). Extension characters such as "{" or "€" take two
+septets. Anything else forces UCS-2 for the whole message: 70 UTF-16 code units
+in one segment, 67 per segment when split. Every segment is billed.
+"""
+
+GSM7_BASIC = frozenset(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+GSM7_EXTENSION = frozenset("\f^{}\\[~]|€")
+
+GSM7_SINGLE, GSM7_MULTI = 160, 153
+UCS2_SINGLE, UCS2_MULTI = 70, 67
+
+def is_gsm7(text: str) -> bool:
+    return all(ch in GSM7_BASIC or ch in GSM7_EXTENSION for ch in text)
+
+def encoded_length(text: str) -> tuple:
+    """(encoding, length in septets or UTF-16 code units)"""
+    if is_gsm7(text):
+        return "GSM-7", sum(2 if ch in GSM7_EXTENSION else 1 for ch in text)
+    return "UCS-2", len(text.encode("utf-16-le")) // 2
+
+def segments_for_length(encoding: str, length: int) -> int:
+    """Segments for a message of `length` septets (GSM-7) or code units (UCS-2)."""
+    single, multi = (GSM7_SINGLE, GSM7_MULTI) if encoding == "GSM-7" else (UCS2_SINGLE, UCS2_MULTI)
+    if length <= single:
+        return 1
+    return -(-length // multi)
+
+def segment_count(text: str) -> int:
+    return segments_for_length(*encoded_length(text))
+
+def coalesce(messages, max_segments: int = 1, separator: str = "\n") -> list:
+    """
+    Greedily join consecutive messages with `separator` while the result stays
+    within `max_segments` segments. Returns a list of (indexes, text) pairs
+    covering every input message in order. A message that is already longer
+    than the limit goes out on its own.
+    """
+    groups = []
+    indexes, text = [], None
+    for i, message in enumerate(messages):
+        if text is not None:
+            candidate = text + separator + message
+            if segment_count(candidate) <= max_segments:
+                indexes.append(i)
+                text = candidate
+                continue
+            groups.append((indexes, text))
+        indexes, text = [i], message
+    if text is not None:
+        groups.append((indexes, text))
+    return groups
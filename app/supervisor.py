@@ -0,0 +1,191 @@
+"""
+Sharded scheduling: one dispatcher process per user shard.
+
+    python -m app.scheduler --shards 4
+    python -m app.scheduler --shards 4 --shards-file /etc/reminders/shards
+
+Worker i of K runs a Dispatcher that only claims reminders with
+user_id % K == i, on its own engine and connection pool. Every reminder of
+a user is owned by one worker, which sends them in scheduled order. The
+Supervisor starts the workers, restarts any that die (with backoff), and
+stops them all on SIGINT/SIGTERM.
+
+Writing a new K to --shards-file rebalances. The supervisor stops every
+worker, each finishing its in-flight sweep, and then starts K new ones, so two
+workers never own the same user with different K. Leases still guard against
+double sends if a worker is killed mid-batch.
+
+SMS_RATE_LIMIT and SMS_CONCURRENCY are totals for the whole scheduler: each
+of the K workers gets 1/K of them, so sharding does not multiply the send
+rate the provider sees.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from app.config import (
+    DATABASE_URL, DISPATCHER_MAX_SLEEP, METRICS_FILE, METRICS_PORT, SMS_RATE_LIMIT, SMS_CONCURRENCY
+)
+
+logger = logging.getLogger(__name__)
+
+RESTART_BACKOFF_SECONDS = 1
+RESTART_BACKOFF_MAX_SECONDS = 60
+STOP_TIMEOUT_SECONDS = 30
+
+def _shard_metrics_file(path: str, index: int) -> str:
+    if not path:
+        return ""
+    root, ext = os.path.splitext(path)
+    return f"{root}-shard{index}{ext}"
+
+def _shard_limits(rate_limit: float, concurrency: int, count: int) -> tuple:
+    """One worker's share of the total (rate_limit, concurrency); 0 stays unlimited."""
+    return rate_limit / count, max(1, concurrency // count)
+
+def run_worker(index: int, count: int, database_url: str = DATABASE_URL,
+               max_sleep: float = DISPATCHER_MAX_SLEEP, metrics_file: str = METRICS_FILE,
+               metrics_port: int = METRICS_PORT, log_level: str = "INFO",
+               rate_limit: float = SMS_RATE_LIMIT, concurrency: int = SMS_CONCURRENCY):
+    """
+    Process entry point: run a Dispatcher for shard `index` of `count`.
+    `rate_limit` and `concurrency` are this worker's own limits, not totals.
+    """
+    from sqlalchemy.orm import sessionmaker
+    from app.database import make_engine
+    from app.scheduler import Dispatcher
+    from app.services import Shard
+    logging.basicConfig(level=log_level, format=f"%(asctime)s %(levelname)s shard{index}/{count} %(name)s: %(message)s")
+    engine = make_engine(database_url)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    dispatcher = Dispatcher(session_factory, max_sleep=max_sleep,
+                            metrics_file=_shard_metrics_file(metrics_file, index),
+                            metrics_port=metrics_port + index if metrics_port else 0,
+                            shard=Shard(index, count), rate_limit=rate_limit, concurrency=concurrency)
+    try:
+        asyncio.run(dispatcher.run())
+    finally:
+        engine.dispose()
+
+class Supervisor:
+    def __init__(self, shards: int, database_url: str = DATABASE_URL, max_sleep: float = DISPATCHER_MAX_SLEEP,
+                 shards_file: str = None, metrics_file: str = METRICS_FILE, metrics_port: int = METRICS_PORT,
+                 log_level: str = "INFO", poll_interval: float = 1.0,
+                 rate_limit: float = SMS_RATE_LIMIT, concurrency: int = SMS_CONCURRENCY):
+        if shards < 1:
+            raise ValueError("shards must be at least 1")
+        self.shards = shards
+        self.database_url = database_url
+        self.max_sleep = max_sleep
+        self.shards_file = shards_file
+        self.metrics_file = metrics_file
+        self.metrics_port = metrics_port
+        self.log_level = log_level
+        self.poll_interval = poll_interval
+        self.rate_limit = rate_limit
+        self.concurrency = concurrency
+        # spawn: workers start from a clean interpreter, never inheriting the
+        # parent's database connections
+        self._context = multiprocessing.get_context("spawn")
+        self._workers = {}   # shard index -> Process
+        self._restarts = {}  # shard index -> (consecutive restarts, not before)
+        self._stopping = False
+
+    def _start_worker(self, index: int):
+        rate_limit, concurrency = _shard_limits(self.rate_limit, self.concurrency, self.shards)
+        process = self._context.Process(
+            target=run_worker, name=f"scheduler-shard{index}",
+            args=(index, self.shards, self.database_url, self.max_sleep, self.metrics_file,
+                  self.metrics_port, self.log_level, rate_limit, concurrency),
+        )
+        process.start()
+        self._workers[index] = process
+        logger.info("Started shard %d/%d (pid %s)", index, self.shards, process.pid)
+
+    def start(self):
+        for index in range(self.shards):
+            self._start_worker(index)
+
+    def stop_workers(self, timeout: float = STOP_TIMEOUT_SECONDS):
+        """SIGTERM every worker (they finish their sweep), then wait; kill stragglers."""
+        for process in self._workers.values():
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + timeout
+        for process in self._workers.values():
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning("Shard worker %s did not stop in time; killing it", process.pid)
+                process.kill()
+                process.join()
+        self._workers.clear()
+        self._restarts.clear()
+
+    def resize(self, shards: int):
+        """Rebalance to `shards` workers: stop every worker, then start the new set."""
+        if shards < 1 or shards == self.shards:
+            return
+        logger.info("Rebalancing from %d to %d shards", self.shards, shards)
+        self.stop_workers()
+        self.shards = shards
+        self.start()
+
+    def check_workers(self):
+        """Restart workers that exited, backing off when one keeps crashing."""
+        now = time.monotonic()
+        for index, process in list(self._workers.items()):
+            if process.is_alive():
+                continue
+            restarts, not_before = self._restarts.get(index, (0, 0))
+            if now < not_before:
+                continue
+            logger.warning("Shard %d exited with code %s; restarting", index, process.exitcode)
+            delay = min(RESTART_BACKOFF_MAX_SECONDS, RESTART_BACKOFF_SECONDS * 2 ** restarts)
+            self._restarts[index] = (restarts + 1, now + delay)
+            self._start_worker(index)
+
+    def _read_shards_file(self):
+        try:
+            with open(self.shards_file) as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def stop(self, *args):
+        self._stopping = True
+
+    def upgrade_schema(self):
+        """
+        Bring the workers' database up to date, once, before any of them
+        starts; K workers upgrading side by side would race on ALTER TABLE.
+        """
+        from app.database import make_engine
+        from app.migrations import upgrade_schema
+        engine = make_engine(self.database_url)
+        try:
+            upgrade_schema(engine)
+        finally:
+            engine.dispose()
+
+    def run(self):
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, self.stop)
+        self.upgrade_schema()
+        self.start()
+        try:
+            while not self._stopping:
+                time.sleep(self.poll_interval)
+                if self.shards_file:
+                    shards = self._read_shards_file()
+                    if shards is not None:
+                        self.resize(shards)
+                self.check_workers()
+        finally:
+            self.stop_workers()
+            logger.info("Supervisor stopped.")
+
+    @property
+    def workers(self) -> dict:
+        return dict(self._workers)
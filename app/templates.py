@@ -0,0 +1,123 @@
+"""
+Message templates: shared text with {name} placeholders.
+
+A campaign stores its text once in message_templates; each reminder keeps a
+template_id and a small dict of variables instead of a full copy of the body.
+Bodies are compiled once per process into literal parts and field names and
+cached by id. Templates are immutable, so cached entries never go stale. The
+dispatcher renders each claimed page with render_batch, which loads any
+templates it has not seen yet with one SELECT.
+
+Placeholders are identifiers in braces, "Hi {name}"; "{{" and "}}" are
+literal braces. Missing variables render as "". The encoding and the length of
+the literal text are computed at compile time, so counting the segments of a
+rendered message only needs to measure the variable values.
+"""
+import re
+import threading
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from app.models import MessageTemplate
+from app.sms import encoded_length, is_gsm7, segments_for_length
+
+_TOKEN = re.compile(r"\{\{|\}\}|\{([A-Za-z_][A-Za-z0-9_]*)\}|[{}]")
+
+def _value(variables, field: str) -> str:
+    value = variables.get(field)
+    return "" if value is None else str(value)
+
+class CompiledTemplate:
+    def __init__(self, body: str, template_id: int = None):
+        self.id = template_id
+        self.body = body
+        literals, fields = [], []
+        literal = []
+        position = 0
+        for match in _TOKEN.finditer(body):
+            literal.append(body[position:match.start()])
+            position = match.end()
+            token = match.group(0)
+            if token in ("{{", "}}"):
+                literal.append(token[0])
+            elif match.group(1):
+                literals.append("".join(literal))
+                fields.append(match.group(1))
+                literal = []
+            else:
+                raise ValueError(f"Unmatched '{token}' at position {match.start()}; use '{token * 2}' for a literal brace")
+        literal.append(body[position:])
+        literals.append("".join(literal))
+        # literals[i] comes before fields[i]; literals[-1] ends the message
+        self.literals = tuple(literals)
+        self.fields = tuple(fields)
+        self.encoding, self.static_length = encoded_length("".join(literals))
+        self.segments = segments_for_length(self.encoding, self.static_length)
+
+    def render(self, variables) -> str:
+        variables = variables or {}
+        parts = [self.literals[0]]
+        for field, literal in zip(self.fields, self.literals[1:]):
+            parts.append(_value(variables, field))
+            parts.append(literal)
+        return "".join(parts)
+
+    def missing(self, variables) -> list:
+        """Placeholder names `variables` has no value for."""
+        variables = variables or {}
+        return [field for field in dict.fromkeys(self.fields) if field not in variables]
+
+    def measure(self, variables) -> tuple:
+        """(encoding, segments) of the rendered message, without rendering it."""
+        values = [_value(variables or {}, field) for field in self.fields]
+        if self.encoding == "GSM-7" and all(is_gsm7(value) for value in values):
+            length = self.static_length + sum(encoded_length(value)[1] for value in values)
+            return "GSM-7", segments_for_length("GSM-7", length)
+        # One non-GSM character switches the whole message to UCS-2
+        encoding, length = encoded_length(self.render(variables))
+        return encoding, segments_for_length(encoding, length)
+
+class TemplateCache:
+    """Compiled templates by id, loaded on first use."""
+
+    def __init__(self):
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, db: Session, template_ids) -> dict:
+        wanted = set(template_ids)
+        with self._lock:
+            found = {tid: self._templates[tid] for tid in wanted if tid in self._templates}
+        missing = wanted - found.keys()
+        if missing:
+            rows = db.execute(select(MessageTemplate.id, MessageTemplate.body)
+                              .where(MessageTemplate.id.in_(missing))).all()
+            loaded = {row.id: CompiledTemplate(row.body, row.id) for row in rows}
+            with self._lock:
+                self._templates.update(loaded)
+            found.update(loaded)
+        return found
+
+    def get(self, db: Session, template_id: int):
+        return self.get_many(db, [template_id]).get(template_id)
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
+
+template_cache = TemplateCache()
+
+def render_batch(db: Session, rows, cache: TemplateCache = template_cache) -> dict:
+    """
+    Text for every row (with id, message, template_id and variables) that uses
+    a template, as {reminder id: text}. Rows without a template keep their
+    stored message and are not included.
+    """
+    templated = [row for row in rows if row.template_id is not None]
+    if not templated:
+        return {}
+    templates = cache.get_many(db, {row.template_id for row in templated})
+    messages = {}
+    for row in templated:
+        template = templates.get(row.template_id)
+        messages[row.id] = template.render(row.variables) if template is not None else row.message
+    return messages
@@ -0,0 +1,49 @@
+"""
+Cached timezone registry.
+
+pytz.timezone() parses zoneinfo data on every call; the registry resolves each
+name once per process and rejects unknown names up front, so a bad value is
+caught when a user is created rather than in the middle of a dispatch batch.
+"""
+from datetime import datetime, tzinfo
+from functools import lru_cache
+import pytz
+
+@lru_cache(maxsize=None)
+def get_timezone(name: str) -> tzinfo:
+    """Return the tzinfo for an IANA name. Raises ValueError for unknown names."""
+    try:
+        return pytz.timezone(name)
+    except pytz.UnknownTimeZoneError:
+        raise ValueError(f"Unknown timezone: {name!r}")
+
+def is_valid_timezone(name: str) -> bool:
+    try:
+        get_timezone(name)
+        return True
+    except ValueError:
+        return False
+
+def validate_timezone(name: str) -> str:
+    """Return `name` unchanged if it is a known timezone, else raise ValueError."""
+    get_timezone(name)
+    return name
+
+def local_to_utc(local_naive: datetime, tz) -> datetime:
+    """
+    Naive wall-clock time in `tz` to naive UTC. A time skipped by a
+    spring-forward gap moves forward by the gap; an ambiguous fall-back time
+    uses its first occurrence.
+    """
+    try:
+        aware = tz.localize(local_naive, is_dst=None)
+    except pytz.NonExistentTimeError:
+        # Spring-forward gap: standard-time reading lands just after the gap
+        aware = tz.normalize(tz.localize(local_naive, is_dst=False))
+    except pytz.AmbiguousTimeError:
+        aware = tz.localize(local_naive, is_dst=True)
+    return aware.astimezone(pytz.utc).replace(tzinfo=None)
+
+def utc_to_local(utc_naive: datetime, tz) -> datetime:
+    """Naive UTC to naive wall-clock time in `tz`."""
+    return pytz.utc.localize(utc_naive).astimezone(tz).replace(tzinfo=None)
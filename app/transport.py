@@ -0,0 +1,107 @@
+"""
+HTTP transports for the Twilio client.
+
+Both clients keep a pool of keep-alive connections sized for the dispatcher's
+concurrency, apply separate connect/read timeouts so a stuck request cannot
+hang a worker, and can redirect https://api.twilio.com to another base URL
+(for example the local app.fake_provider server).
+"""
+import asyncio
+import base64
+from typing import Dict, Optional, Tuple
+from requests.adapters import HTTPAdapter
+from twilio.http.async_http_client import AsyncTwilioHttpClient
+from twilio.http.http_client import TwilioHttpClient
+from twilio.http.response import Response
+from app.config import (
+    TWILIO_HTTP_POOL_SIZE, TWILIO_CONNECT_TIMEOUT, TWILIO_READ_TIMEOUT, TWILIO_MAX_RETRIES,
+    TWILIO_API_BASE_URL
+)
+
+TWILIO_API_ORIGIN = "https://api.twilio.com"
+
+def _rewrite(url: str, base_url: str) -> str:
+    if base_url and url.startswith(TWILIO_API_ORIGIN):
+        return base_url.rstrip("/") + url[len(TWILIO_API_ORIGIN):]
+    return url
+
+class PooledHttpClient(TwilioHttpClient):
+    """requests-based client with a sized keep-alive pool and (connect, read) timeouts."""
+
+    def __init__(self, pool_size: int = TWILIO_HTTP_POOL_SIZE,
+                 connect_timeout: float = TWILIO_CONNECT_TIMEOUT,
+                 read_timeout: float = TWILIO_READ_TIMEOUT,
+                 max_retries: int = TWILIO_MAX_RETRIES,
+                 base_url: str = TWILIO_API_BASE_URL):
+        super().__init__(pool_connections=True)
+        # POSTs are only retried on connection errors, never after the
+        # request was sent, so retries cannot double-send a message.
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=max_retries)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.timeout = (connect_timeout, read_timeout)
+        self.base_url = base_url
+
+    def request(self, method: str, url: str, params: Optional[Dict[str, object]] = None,
+                data: Optional[Dict[str, object]] = None, headers: Optional[Dict[str, str]] = None,
+                auth: Optional[Tuple[str, str]] = None, timeout: Optional[float] = None,
+                allow_redirects: bool = False) -> Response:
+        return super().request(method, _rewrite(url, self.base_url), params, data, headers, auth,
+                               timeout, allow_redirects)
+
+class PooledAsyncHttpClient(AsyncTwilioHttpClient):
+    """
+    aiohttp-based client for the asyncio send path. The session is created on
+    first use, inside the running event loop, and reused afterwards.
+    """
+
+    def __init__(self, pool_size: int = TWILIO_HTTP_POOL_SIZE,
+                 connect_timeout: float = TWILIO_CONNECT_TIMEOUT,
+                 read_timeout: float = TWILIO_READ_TIMEOUT,
+                 base_url: str = TWILIO_API_BASE_URL):
+        super().__init__(pool_connections=False)
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.base_url = base_url
+        self._session_loop = None
+
+    def _get_session(self):
+        # aiohttp sessions are bound to the loop they were created in; each
+        # asyncio.run() of a one-shot sweep gets a fresh one.
+        loop = asyncio.get_running_loop()
+        if self.session is None or self.session.closed or self._session_loop is not loop:
+            from aiohttp import ClientSession, ClientTimeout, TCPConnector
+            self.session = ClientSession(
+                connector=TCPConnector(limit=self.pool_size),
+                timeout=ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout),
+            )
+            self._session_loop = loop
+        return self.session
+
+    async def request(self, method: str, url: str, params: Optional[Dict[str, object]] = None,
+                      data: Optional[Dict[str, object]] = None, headers: Optional[Dict[str, str]] = None,
+                      auth: Optional[Tuple[str, str]] = None, timeout: Optional[float] = None,
+                      allow_redirects: bool = False) -> Response:
+        headers = dict(headers or {})
+        if auth:
+            token = base64.b64encode(f"{auth[0]}:{auth[1]}".encode()).decode()
+            headers["Authorization"] = f"Basic {token}"
+        kwargs = {
+            "method": method.upper(),
+            "url": _rewrite(url, self.base_url),
+            "params": params,
+            "data": data,
+            "headers": headers,
+            "allow_redirects": allow_redirects,
+        }
+        self.log_request(kwargs)
+        async with self._get_session().request(**kwargs) as response:
+            text = await response.text()
+            self.log_response(response.status, response)
+            return Response(response.status, text, response.headers)
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
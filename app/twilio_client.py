@@ -1,35 +1,71 @@
-import os
-from dotenv import load_dotenv
-from twilio.rest import Client
-
-load_dotenv()
-
-ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID", "")
-AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN", "")
-TWILIO_PHONE_NUMBER = os.getenv("TWILIO_PHONE_NUMBER", "")
-APP_ENV = os.getenv("APP_ENV", "dev")
-
-if APP_ENV != "test":
-    client = Client(ACCOUNT_SID, AUTH_TOKEN)
-else:
-    class MockMessages:
-        def create(self, to, from_, body):
-            print(f"Mock Twilio: Sending message to {to} from {from_} with body: {body}")
-            return type("Message", (object,), {"sid": "SMxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx"})()
-    class MockClient:
-        def __init__(self, account_sid, auth_token):
-            self.messages = MockMessages()
-    client = MockClient(ACCOUNT_SID, AUTH_TOKEN)
+import logging
+from app import providers
+from app.config import TWILIO_PHONE_NUMBER
 
-def send_message(to_phone_number: str, message_body: str):
+logger = logging.getLogger(__name__)
+
+# Twilio error codes that will fail the same way on every retry
+# (https://www.twilio.com/docs/api/errors)
+PERMANENT_ERROR_CODES = {
+    21211,  # Invalid 'To' phone number
+    21214,  # 'To' number cannot be reached
+    21217,  # Phone number does not appear to be valid
+    21401,  # Invalid phone number
+    21407,  # Number type not supported by SMS
+    21408,  # Permission to send to this region is not enabled
+    21610,  # Recipient replied STOP (unsubscribed)
+    21612,  # 'To' number cannot be routed from this 'From' number
+    21614,  # 'To' number is not a valid mobile number
+}
+
+class DeliveryError(Exception):
+    """A failed send. `permanent` means retrying the same message is pointless."""
+
+    def __init__(self, message: str, code: int = None, permanent: bool = False):
+        super().__init__(message)
+        self.code = code
+        self.permanent = permanent
+
+def classify_error(error: Exception) -> DeliveryError:
+    code = getattr(error, "code", None)
+    status = getattr(error, "status", None)
+    permanent = code in PERMANENT_ERROR_CODES
+    detail = f"{code}: {getattr(error, 'msg', error)}" if code else str(error)
+    if status is not None and not code:
+        detail = f"HTTP {status}: {detail}"
+    return DeliveryError(detail, code=code, permanent=permanent)
+
+def deliver(to_phone_number: str, message_body: str) -> str:
+    """Send one SMS and return its SID. Raises DeliveryError on failure."""
+    client, _ = providers.get_clients()
     try:
         message = client.messages.create(
             to=to_phone_number,
             from_=TWILIO_PHONE_NUMBER,
             body=message_body
         )
-        print(f"Message sent to {to_phone_number}: {message.sid}")
-        return message.sid
     except Exception as e:
-        print(f"Error sending message to {to_phone_number}: {e}")
+        raise classify_error(e) from e
+    return message.sid
+
+async def deliver_async(to_phone_number: str, message_body: str) -> str:
+    """Like deliver(), on the asyncio transport."""
+    _, async_client = providers.get_clients()
+    try:
+        message = await async_client.messages.create_async(
+            to=to_phone_number,
+            from_=TWILIO_PHONE_NUMBER,
+            body=message_body
+        )
+    except Exception as e:
+        raise classify_error(e) from e
+    return message.sid
+
+def send_message(to_phone_number: str, message_body: str):
+    try:
+        sid = deliver(to_phone_number, message_body)
+        logger.info("Message sent to %s: %s", to_phone_number, sid)
+        return sid
+    except DeliveryError as e:
+        logger.warning("Error sending message to %s: %s", to_phone_number, e)
         return None
@@ -0,0 +1,86 @@
+"""
+In-memory index of reminders due soon, for sub-second dispatch in the daemon.
+
+The index preloads unsent reminders scheduled within a look-ahead horizon into
+a min-heap of (scheduled_time, reminder_id) tuples, so the dispatcher can sleep
+until exactly the next scheduled_time. Refreshes are incremental: only rows
+updated since the last watermark, plus rows newly entering the horizon, are
+read. Entries are hints: a popped id is still claimed through the database,
+which re-checks that it is due, unsent, unleased and opted in.
+"""
+import heapq
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy.orm import Session
+from app.config import UPCOMING_HORIZON_SECONDS
+from app.services import Shard, get_upcoming_changes
+
+# Re-read this much before the watermark on every refresh: updated_at comes
+# from the writer's clock and becomes visible only at commit.
+WATERMARK_OVERLAP = timedelta(seconds=5)
+
+class UpcomingIndex:
+    def __init__(self, horizon_seconds: int = UPCOMING_HORIZON_SECONDS, shard: Shard = None):
+        self.horizon = timedelta(seconds=horizon_seconds)
+        self.shard = shard  # only track this user shard's reminders
+        self._heap = []          # (scheduled_time, reminder_id); may hold stale entries
+        self._due_by_id = {}     # reminder_id -> current scheduled_time
+        self._watermark = None   # max updated_at seen
+        self._window_end = None  # horizon end covered by the last refresh
+
+    def __len__(self):
+        return len(self._due_by_id)
+
+    def add(self, reminder_id: int, scheduled_time: datetime):
+        if self._due_by_id.get(reminder_id) == scheduled_time:
+            return
+        self._due_by_id[reminder_id] = scheduled_time
+        heapq.heappush(self._heap, (scheduled_time, reminder_id))
+
+    def discard(self, reminder_id: int):
+        # The heap entry is dropped lazily when it reaches the top
+        self._due_by_id.pop(reminder_id, None)
+
+    def _drop_stale_top(self):
+        while self._heap and self._due_by_id.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def next_due(self) -> Optional[datetime]:
+        self._drop_stale_top()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: datetime, limit: int = None) -> list:
+        """
+        Remove and return the ids of entries scheduled at or before `now`,
+        earliest first; at most `limit` of them when given.
+        """
+        due = []
+        self._drop_stale_top()
+        while self._heap and self._heap[0][0] <= now and (limit is None or len(due) < limit):
+            _, reminder_id = heapq.heappop(self._heap)
+            del self._due_by_id[reminder_id]
+            due.append(reminder_id)
+            self._drop_stale_top()
+        return due
+
+    def refresh(self, db: Session, now: datetime = None) -> int:
+        """Apply database changes since the last refresh. Returns rows read."""
+        now = now or datetime.utcnow()
+        window_end = now + self.horizon
+        changed_since = self._watermark - WATERMARK_OVERLAP if self._watermark else None
+        window_start = self._window_end or now
+        rows = get_upcoming_changes(db, changed_since, window_start, window_end, self.shard)
+        for row in rows:
+            # A leased or backed-off reminder only becomes claimable again
+            # when its lease ends or its retry time comes
+            claimable_at = max(t for t in (row.scheduled_time, row.lease_expires_at, row.next_attempt_at) if t)
+            if row.sent or row.status == "dead" or claimable_at > window_end:
+                self.discard(row.id)
+            else:
+                self.add(row.id, claimable_at)
+            if row.updated_at is not None and (self._watermark is None or row.updated_at > self._watermark):
+                self._watermark = row.updated_at
+        if self._watermark is None:
+            self._watermark = now
+        self._window_end = window_end
+        return len(rows)
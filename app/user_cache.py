@@ -0,0 +1,171 @@
+"""
+Read-through cache for the user fields hot paths and the API need: id, phone
+number, timezone, opt_out, quiet hours and account.
+
+Entries are keyed by E.164 phone number and by user id. Without a shared
+backend they live in a per-process LRU with a TTL. With one (USER_CACHE_URL,
+Redis), lookups go to Redis alone, so an invalidation in one process is seen
+by every other at once; the local LRU is only read while Redis is
+unreachable, and then another process's writes can go unseen until the TTL.
+Writers call invalidate() after changing a user; the TTL bounds staleness for
+writes made outside this code.
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import time as dt_time
+from typing import NamedTuple, Optional
+from app.config import USER_CACHE_SIZE, USER_CACHE_TTL, USER_CACHE_URL
+
+logger = logging.getLogger(__name__)
+
+class CachedUser(NamedTuple):
+    id: int
+    phone_number: str
+    timezone: str
+    opt_out: bool
+    quiet_start: Optional[dt_time] = None
+    quiet_end: Optional[dt_time] = None
+    account_id: Optional[int] = None
+
+class LocalCache:
+    """Thread-safe LRU with a per-entry TTL."""
+
+    def __init__(self, max_size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class RedisCache:
+    """Shared backend; values are stored as JSON with the same TTL."""
+
+    def __init__(self, url: str, ttl: float = USER_CACHE_TTL, prefix: str = "reminders:user:"):
+        import redis  # optional dependency, only needed when USER_CACHE_URL is set
+        self.client = redis.Redis.from_url(url, socket_timeout=0.2, socket_connect_timeout=0.2)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key: str):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return None
+        user = CachedUser(*json.loads(raw))
+        return user._replace(
+            quiet_start=dt_time.fromisoformat(user.quiet_start) if user.quiet_start else None,
+            quiet_end=dt_time.fromisoformat(user.quiet_end) if user.quiet_end else None,
+        )
+
+    def set(self, key: str, value):
+        fields = [v.isoformat() if isinstance(v, dt_time) else v for v in value]
+        self.client.set(self.prefix + key, json.dumps(fields), ex=max(1, int(self.ttl)))
+
+    def delete(self, *keys: str):
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+class UserCache:
+    def __init__(self, local: LocalCache = None, shared=None):
+        self.local = local or LocalCache()
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+
+    def _shared_call(self, method: str, *args):
+        if self.shared is None:
+            return None
+        try:
+            return getattr(self.shared, method)(*args)
+        except Exception as e:
+            # Degrade to the local cache rather than fail the lookup
+            logger.warning("Shared user cache unavailable, using local cache only: %s", e)
+            return None
+
+    def _get(self, key: str) -> Optional[CachedUser]:
+        if self.shared is None:
+            user = self.local.get(key)
+        else:
+            # Other processes invalidate only the shared backend, so a local
+            # copy could be stale; it is read only while the backend is down
+            try:
+                user = self.shared.get(key)
+            except Exception as e:
+                logger.warning("Shared user cache unavailable, using local cache only: %s", e)
+                user = self.local.get(key)
+        if user is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return user
+
+    def get_by_phone(self, phone_e164: str) -> Optional[CachedUser]:
+        return self._get(f"phone:{phone_e164}")
+
+    def get_by_id(self, user_id: int) -> Optional[CachedUser]:
+        return self._get(f"id:{user_id}")
+
+    def put(self, user: CachedUser, phone_e164: str = None):
+        keys = [f"id:{user.id}", f"phone:{phone_e164 or user.phone_number}"]
+        for key in keys:
+            self.local.set(key, user)
+            self._shared_call("set", key, user)
+
+    def invalidate(self, user_id: int = None, phone_e164: str = None):
+        keys = []
+        if user_id is not None:
+            keys.append(f"id:{user_id}")
+        if phone_e164 is not None:
+            keys.append(f"phone:{phone_e164}")
+        self.local.delete(*keys)
+        self._shared_call("delete", *keys)
+
+    def clear(self):
+        self.local.clear()
+        self._shared_call("clear")
+
+def make_user_cache(url: str = USER_CACHE_URL) -> UserCache:
+    shared = None
+    if url:
+        try:
+            shared = RedisCache(url)
+        except ImportError:
+            logger.warning("USER_CACHE_URL is set but the redis package is not installed; using local cache only")
+    return UserCache(shared=shared)
+
+user_cache = make_user_cache()
@@ -0,0 +1,152 @@
+"""
+Replayable webhook traffic for load testing the callback endpoints.
+
+    python -m app.webhook_replay generate callbacks.jsonl --messages 10000
+    python -m app.webhook_replay generate callbacks.jsonl --from-db   # SIDs of sent reminders
+    python -m app.webhook_replay replay callbacks.jsonl --url http://127.0.0.1:8000 --concurrency 64
+
+A fixture is a JSONL file of {"path", "form"} callbacks in arrival order:
+queued/sent/delivered statuses per message, with jittered timestamps so some
+arrive out of order, a share of undelivered ones, and STOP/START replies.
+Generation is seeded, so the same arguments give the same file. Replay posts
+it with bounded concurrency and an optional rate, and retries callbacks the
+API refuses with 503 after their Retry-After, like a provider would.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from app.rate_limiter import TokenBucket
+
+STATUS_PATH = "/webhooks/status"
+INBOUND_PATH = "/webhooks/inbound"
+
+def generate_callbacks(messages: int = 1000, sids=None, failure_rate: float = 0.05,
+                       stop_rate: float = 0.01, seed: int = 0) -> list:
+    """
+    Callbacks for `messages` synthetic messages, or for `sids`, a list of
+    (provider_sid, phone_number) pairs of real sends.
+    """
+    rng = random.Random(seed)
+    if sids is None:
+        sids = [(f"SM{rng.getrandbits(128):032x}", f"+1555{rng.randrange(10 ** 7):07d}") for _ in range(messages)]
+    timed = []
+    for n, (sid, phone_number) in enumerate(sids):
+        sent_at = n * 0.001
+        final = "undelivered" if rng.random() < failure_rate else "delivered"
+        for offset, status in ((0, "queued"), (0.05, "sent"), (rng.uniform(0.5, 5), final)):
+            form = {"MessageSid": sid, "MessageStatus": status, "To": phone_number}
+            if status == "undelivered":
+                form["ErrorCode"] = "30003"
+            # Jitter reorders some callbacks, as delivery over the network does
+            timed.append((sent_at + offset + rng.uniform(0, 0.1), STATUS_PATH, form))
+        if rng.random() < stop_rate:
+            replied_at = sent_at + rng.uniform(5, 60)
+            timed.append((replied_at, INBOUND_PATH, {"From": phone_number, "Body": "STOP"}))
+            if rng.random() < 0.5:
+                timed.append((replied_at + rng.uniform(1, 60), INBOUND_PATH, {"From": phone_number, "Body": "START"}))
+    timed.sort(key=lambda item: item[0])
+    return [{"path": path, "form": form} for _, path, form in timed]
+
+def sent_sids_from_db(session_factory=None) -> list:
+    """(provider_sid, phone_number) of every sent reminder still in the reminders table."""
+    from app.database import SessionLocal
+    from app.models import Reminder, User
+    db = (session_factory or SessionLocal)()
+    try:
+        return [tuple(row) for row in db.query(Reminder.provider_sid, User.phone_number)
+                .join(User)
+                .filter(Reminder.provider_sid != None)
+                .order_by(Reminder.id)
+                .all()]
+    finally:
+        db.close()
+
+def write_fixture(path: str, callbacks):
+    with open(path, "w", encoding="utf-8") as f:
+        for callback in callbacks:
+            f.write(json.dumps(callback) + "\n")
+
+def load_fixture(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+async def replay(callbacks, base_url: str, concurrency: int = 32, rate: float = 0,
+                 max_retries: int = 5, post=None) -> dict:
+    """
+    POST `callbacks` to `base_url` in order of dispatch. Returns counts of
+    accepted, refused (503, including retried ones), failed (other errors or
+    retries exhausted), plus elapsed seconds and callbacks per second.
+    `post(path, form)`, returning (status, headers), replaces the HTTP client.
+    """
+    session = None
+    if post is None:
+        import aiohttp
+        session = aiohttp.ClientSession(base_url=base_url, connector=aiohttp.TCPConnector(limit=concurrency))
+
+        async def post(path, form):
+            async with session.post(path, data=form) as response:
+                await response.read()
+                return response.status, response.headers
+
+    limiter = TokenBucket(rate) if rate > 0 else None
+    semaphore = asyncio.Semaphore(concurrency)
+    stats = {"accepted": 0, "refused": 0, "failed": 0}
+
+    async def send(callback):
+        async with semaphore:
+            for _ in range(max_retries + 1):
+                if limiter is not None:
+                    await limiter.acquire()
+                try:
+                    status, headers = await post(callback["path"], callback["form"])
+                except Exception:
+                    # Connection errors from whichever client is in use
+                    break
+                if status != 503:
+                    stats["accepted" if status < 400 else "failed"] += 1
+                    return
+                stats["refused"] += 1
+                await asyncio.sleep(float(headers.get("Retry-After", "1")))
+            stats["failed"] += 1
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(send(callback) for callback in callbacks))
+    finally:
+        if session is not None:
+            await session.close()
+    stats["seconds"] = time.perf_counter() - start
+    stats["per_second"] = len(callbacks) / stats["seconds"] if stats["seconds"] else 0.0
+    return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate and replay provider webhook traffic.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generate = commands.add_parser("generate", help="write a callback fixture")
+    generate.add_argument("path")
+    generate.add_argument("--messages", type=int, default=1000)
+    generate.add_argument("--from-db", action="store_true", help="use the SIDs of sent reminders")
+    generate.add_argument("--failure-rate", type=float, default=0.05)
+    generate.add_argument("--stop-rate", type=float, default=0.01)
+    generate.add_argument("--seed", type=int, default=0)
+    play = commands.add_parser("replay", help="post a fixture to a running API")
+    play.add_argument("path")
+    play.add_argument("--url", default="http://127.0.0.1:8000")
+    play.add_argument("--concurrency", type=int, default=32)
+    play.add_argument("--rate", type=float, default=0, help="callbacks per second (0 = unlimited)")
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        sids = sent_sids_from_db() if args.from_db else None
+        callbacks = generate_callbacks(args.messages, sids, args.failure_rate, args.stop_rate, args.seed)
+        write_fixture(args.path, callbacks)
+        print(f"Wrote {len(callbacks)} callbacks to {args.path}")
+    else:
+        stats = asyncio.run(replay(load_fixture(args.path), args.url, args.concurrency, args.rate))
+        print(f"accepted={stats['accepted']} refused={stats['refused']} failed={stats['failed']} "
+              f"in {stats['seconds']:.2f}s ({stats['per_second']:.0f}/s)")
+
+if __name__ == "__main__":
+    main()
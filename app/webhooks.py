@@ -0,0 +1,176 @@
+"""
+Provider callbacks: delivery status updates and inbound STOP/START replies.
+
+    POST /webhooks/status   MessageSid, MessageStatus[, ErrorCode]
+    POST /webhooks/inbound  From, Body[, OptOutType]
+
+The API handlers only parse the form and append an event to a bounded
+in-memory CallbackBuffer. A CallbackFlusher task writes the buffer out in
+batches, every WEBHOOK_FLUSH_INTERVAL seconds or as soon as
+WEBHOOK_BATCH_SIZE events are waiting. Each batch is collapsed to one status
+per provider SID and one opt-out value per number. That is one executemany
+UPDATE on delivery_log for the statuses and one set-based UPDATE on users
+for the opt-out flips, instead of a lookup, commit and refresh per
+callback.
+
+When the buffer is full, callbacks are refused with 503 and Retry-After, so
+the sender backs off instead of the process growing without bound. Accepted
+callbacks that are not yet flushed are lost if the process dies. The flush
+interval bounds that window.
+"""
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import NamedTuple, Optional
+from sqlalchemy.orm import Session
+from app.config import WEBHOOK_BUFFER_SIZE, WEBHOOK_BATCH_SIZE, WEBHOOK_FLUSH_INTERVAL
+from app.services import FINAL_DELIVERY_STATUSES, record_delivery_statuses, set_opt_out_many
+
+logger = logging.getLogger(__name__)
+
+# Single-word replies carriers and Twilio treat as opt-out / opt-in
+STOP_KEYWORDS = {"STOP", "STOPALL", "UNSUBSCRIBE", "CANCEL", "END", "QUIT", "OPTOUT", "REVOKE"}
+START_KEYWORDS = {"START", "YES", "UNSTOP"}
+
+class StatusEvent(NamedTuple):
+    sid: str
+    status: str
+    error_code: Optional[str]
+    received_at: datetime
+
+class OptOutEvent(NamedTuple):
+    phone_number: str
+    opt_out: bool
+
+def parse_status(form) -> Optional[StatusEvent]:
+    sid = form.get("MessageSid") or form.get("SmsSid")
+    status = form.get("MessageStatus") or form.get("SmsStatus")
+    if not sid or not status:
+        return None
+    return StatusEvent(sid, status.lower(), form.get("ErrorCode") or None, datetime.utcnow())
+
+def parse_inbound(form) -> Optional[OptOutEvent]:
+    """An OptOutEvent for a STOP/START reply; None for any other message."""
+    phone_number = form.get("From")
+    if not phone_number:
+        return None
+    # Set by the provider's own opt-out handling; otherwise match the keyword
+    keyword = (form.get("OptOutType") or form.get("Body") or "").strip().upper()
+    if keyword in STOP_KEYWORDS:
+        return OptOutEvent(phone_number, True)
+    if keyword in START_KEYWORDS:
+        return OptOutEvent(phone_number, False)
+    return None
+
+def apply_callbacks(db: Session, events) -> tuple:
+    """
+    Write a batch of events: the latest status per SID (a final status beats a
+    later interim one) and the latest opt-out value per number. Returns
+    (statuses, opt-out changes) applied.
+    """
+    statuses = {}
+    opt_outs = {}
+    for event in events:
+        if isinstance(event, StatusEvent):
+            current = statuses.get(event.sid)
+            if current is None or current.status not in FINAL_DELIVERY_STATUSES \
+                    or event.status in FINAL_DELIVERY_STATUSES:
+                statuses[event.sid] = event
+        else:
+            opt_outs[event.phone_number] = event.opt_out
+    if statuses:
+        record_delivery_statuses(db, [(e.sid, e.status, e.error_code, e.received_at) for e in statuses.values()])
+    if opt_outs:
+        set_opt_out_many(db, opt_outs)
+    return len(statuses), len(opt_outs)
+
+class CallbackBuffer:
+    """Bounded FIFO of callback events; offer() refuses rather than blocks when full."""
+
+    def __init__(self, max_size: int = WEBHOOK_BUFFER_SIZE, batch_size: int = WEBHOOK_BATCH_SIZE):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.rejected = 0
+        # Called (on the event loop) once a full batch is waiting
+        self.on_batch_ready = None
+        self._events = deque()
+        self._lock = threading.Lock()
+
+    def offer(self, event) -> bool:
+        with self._lock:
+            if len(self._events) >= self.max_size:
+                self.rejected += 1
+                return False
+            self._events.append(event)
+            ready = len(self._events) >= self.batch_size
+        if ready and self.on_batch_ready is not None:
+            self.on_batch_ready()
+        return True
+
+    def drain(self, limit: int = None) -> list:
+        limit = limit or self.batch_size
+        with self._lock:
+            return [self._events.popleft() for _ in range(min(limit, len(self._events)))]
+
+    def requeue(self, events):
+        """Put a batch that failed to write back at the front, in order."""
+        with self._lock:
+            self._events.extendleft(reversed(events))
+
+    def __len__(self):
+        return len(self._events)
+
+class CallbackFlusher:
+    """
+    Background task writing a CallbackBuffer through `session_source`, an
+    async generator of AsyncSessions such as app.database.get_async_db.
+    """
+
+    def __init__(self, buffer: CallbackBuffer, session_source, flush_interval: float = WEBHOOK_FLUSH_INTERVAL):
+        self.buffer = buffer
+        self.session_source = asynccontextmanager(session_source)
+        self.flush_interval = flush_interval
+        self._wakeup = None
+        self._stopping = False
+
+    async def flush(self) -> int:
+        """Write everything buffered, batch by batch. Returns the events written."""
+        written = 0
+        while True:
+            events = self.buffer.drain()
+            if not events:
+                return written
+            try:
+                async with self.session_source() as db:
+                    await db.run_sync(apply_callbacks, events)
+            except Exception as e:
+                self.buffer.requeue(events)
+                raise e
+            written += len(events)
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        self.buffer.on_batch_ready = self._wakeup.set
+        try:
+            while not self._stopping:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                try:
+                    await self.flush()
+                except Exception as e:
+                    logger.exception("Writing webhook callbacks failed; retrying: %s", e)
+                    await asyncio.sleep(self.flush_interval)
+        finally:
+            self.buffer.on_batch_ready = None
+            await self.flush()
+
+    def stop(self):
+        self._stopping = True
+        if self._wakeup is not None:
+            self._wakeup.set()
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Benchmark the dispatch pipeline on synthetic data.
+
+    python benchmark.py --users 10000 --reminders 100000 --latency-ms 50 -o bench.json
+    python benchmark.py --compare bench-before.json bench.json
+
+Seeds users across timezones and reminders (a share of them due now) into a
+fresh database, then times bulk creation, get_pending_reminders and one full
+check_and_send_reminders tick against a fake provider that sleeps
+--latency-ms per message. `--provider mock` patches the send call in process;
+`--provider http` goes through the real Twilio client and pooled transport to
+app.fake_provider. Results (throughput, p50/p99 latency, peak memory) are
+written as JSON so runs on different commits can be compared.
+
+    python benchmark.py --imports
+
+measures the cold import time of the entry points with `python -X importtime`
+instead, against IMPORT_BUDGETS_MS (tests/test_imports.py enforces them).
+
+--database-url defaults to a temporary SQLite file. Any other database
+(e.g. a Postgres URL) has the reminder tables DROPPED and recreated.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+from datetime import datetime, timedelta
+from sqlalchemy.orm import sessionmaker
+from app import providers, scheduler
+from app.config import SMS_CONCURRENCY, BULK_BATCH_SIZE
+from app.database import make_engine
+from app.migrations import upgrade_schema
+from app.models import Base
+from app.services import bulk_create_users, bulk_create_reminders, get_pending_reminders
+
+TIMEZONES = (
+    "UTC", "America/New_York", "America/Chicago", "America/Los_Angeles", "America/Sao_Paulo",
+    "Europe/London", "Europe/Berlin", "Africa/Lagos", "Asia/Kolkata", "Asia/Shanghai",
+    "Asia/Tokyo", "Australia/Sydney", "Pacific/Auckland",
+)
+
+# Cold-start budget per entry point: cumulative -X importtime milliseconds,
+# and heavy modules it must not pull in (they are imported on first use).
+IMPORT_BUDGETS_MS = {
+    "app.twilio_client": 60,
+    "app.database": 800,
+    "app.scheduler": 900,
+}
+DEFERRED_MODULES = ("twilio", "aiohttp", "requests", "pydantic")
+
+def generate_users(count: int, rng: random.Random):
+    """Yield user dicts with unique phone numbers spread over TIMEZONES"""
+    for i in range(count):
+        yield {"phone_number": f"+1555{i:07d}", "timezone": rng.choice(TIMEZONES)}
+
+def generate_reminders(count: int, user_count: int, rng: random.Random, due_fraction: float, now: datetime):
+    """
+    Yield reminder dicts for random users. `due_fraction` of them are due
+    (scheduled within the last hour), the rest spread over the next week.
+    """
+    for i in range(count):
+        if rng.random() < due_fraction:
+            scheduled = now - timedelta(seconds=rng.randint(0, 3600))
+        else:
+            scheduled = now + timedelta(seconds=rng.randint(60, 7 * 86400))
+        yield {
+            "phone_number": f"+1555{rng.randrange(user_count):07d}",
+            "message": f"Reminder {i}",
+            "scheduled_time": scheduled,
+        }
+
+def percentile(values, pct: float) -> float:
+    """Nearest-rank percentile; 0.0 for an empty list"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered), math.ceil(pct / 100 * len(ordered))) - 1)
+    return ordered[rank]
+
+def _summary(name: str, count: int, elapsed: float, peak_bytes: int, latencies=None) -> dict:
+    result = {
+        "name": name,
+        "count": count,
+        "elapsed_s": round(elapsed, 4),
+        "throughput_per_s": round(count / elapsed, 1) if elapsed else 0.0,
+        "peak_memory_mb": round(peak_bytes / 2**20, 2),
+    }
+    if latencies is not None:
+        result["p50_ms"] = round(percentile(latencies, 50) * 1000, 2)
+        result["p99_ms"] = round(percentile(latencies, 99) * 1000, 2)
+    return result
+
+def _measure(func):
+    """Run func() under tracemalloc; return (value, elapsed seconds, peak bytes)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        value = func()
+        return value, time.perf_counter() - start, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def bench_bulk_create(session_factory, users: int, reminders: int, due_fraction: float,
+                      batch_size: int, rng: random.Random):
+    db = session_factory()
+    try:
+        user_stats, user_s, user_peak = _measure(
+            lambda: bulk_create_users(db, generate_users(users, rng), batch_size))
+        now = datetime.utcnow()
+        reminder_stats, reminder_s, reminder_peak = _measure(
+            lambda: bulk_create_reminders(db, generate_reminders(reminders, users, rng, due_fraction, now), batch_size))
+    finally:
+        db.close()
+    return [
+        _summary("bulk_create_users", user_stats.inserted, user_s, user_peak),
+        _summary("bulk_create_reminders", reminder_stats.inserted, reminder_s, reminder_peak),
+    ]
+
+def bench_get_pending(session_factory, repeat: int):
+    timings = []
+    peak = 0
+    count = 0
+    for _ in range(repeat):
+        db = session_factory()
+        try:
+            rows, elapsed, run_peak = _measure(lambda: get_pending_reminders(db))
+        finally:
+            db.close()
+        count = len(rows)
+        timings.append(elapsed)
+        peak = max(peak, run_peak)
+    # Latency here is per query, not per row
+    result = _summary("get_pending_reminders", count, sorted(timings)[len(timings) // 2], peak, timings)
+    result["repeat"] = repeat
+    return result
+
+class _LatencyProvider:
+    """
+    Client for providers.set_clients, standing in for both the sync and the
+    async client. Sleeps `latency` per message, or forwards to `inner`
+    (client, async_client) when given, and times every call.
+    """
+
+    def __init__(self, latency: float, inner: tuple = None):
+        self.latency = latency
+        self.inner = inner
+        self.messages = self
+        self.started = None
+        self.call_times = []
+        self.completed_at = []
+
+    def create(self, to, from_, body):
+        start = time.perf_counter()
+        if self.inner is None:
+            time.sleep(self.latency)
+            return self._record(start)
+        return self._record(start, self.inner[0].messages.create(to=to, from_=from_, body=body))
+
+    async def create_async(self, to, from_, body):
+        start = time.perf_counter()
+        if self.inner is None:
+            await asyncio.sleep(self.latency)
+            return self._record(start)
+        return self._record(start, await self.inner[1].messages.create_async(to=to, from_=from_, body=body))
+
+    def _record(self, start, message=None):
+        done = time.perf_counter()
+        self.call_times.append(done - start)
+        self.completed_at.append(done - self.started)
+        return message if message is not None else SimpleNamespace(sid="SM" + "0" * 32)
+
+def _http_provider(latency_ms: float, concurrency: int):
+    """Real Twilio client with the pooled transport, pointed at a local fake provider"""
+    from twilio.rest import Client
+    from app.fake_provider import FakeProviderServer
+    from app.transport import PooledHttpClient, PooledAsyncHttpClient
+    server = FakeProviderServer(latency_ms=latency_ms).start()
+    sync_client = Client("ACbenchmark", "token",
+                         http_client=PooledHttpClient(pool_size=concurrency, base_url=server.base_url))
+    async_client = Client("ACbenchmark", "token",
+                          http_client=PooledAsyncHttpClient(pool_size=concurrency, base_url=server.base_url))
+    return server, sync_client, async_client
+
+def bench_tick(session_factory, provider: str, latency_ms: float, concurrency: int, transport: str):
+    # The sweep runs unpatched; only the provider clients are swapped
+    server = None
+    inner = None
+    if provider != "mock":
+        server, sync_client, async_client = _http_provider(latency_ms, concurrency)
+        inner = (sync_client, async_client)
+    fake = _LatencyProvider(latency_ms / 1000, inner)
+    saved_clients = providers.set_clients(fake, fake)
+
+    async def sweep():
+        try:
+            return await scheduler.check_and_send_reminders(session_factory, concurrency, transport=transport)
+        finally:
+            if inner is not None:
+                await inner[1].http_client.close()
+
+    def tick():
+        fake.started = time.perf_counter()
+        return asyncio.run(sweep())
+
+    try:
+        results, elapsed, peak = _measure(tick)
+    finally:
+        if server is not None:
+            server.stop()
+        if saved_clients is None:
+            providers.reset()
+        else:
+            providers.set_clients(*saved_clients)
+
+    result = _summary("check_and_send_reminders", len(results), elapsed, peak, fake.completed_at)
+    result.update({
+        "provider": provider,
+        "transport": transport,
+        "injected_latency_ms": latency_ms,
+        "concurrency": concurrency,
+        "failed": sum(1 for r in results if not r.sid),
+        "provider_p50_ms": round(percentile(fake.call_times, 50) * 1000, 2),
+        "provider_p99_ms": round(percentile(fake.call_times, 99) * 1000, 2),
+    })
+    return result
+
+def import_time(module: str, runs: int = 3, app_env: str = None) -> dict:
+    """
+    Import `module` in fresh interpreters under -X importtime (with APP_ENV set
+    to `app_env`, if given). Returns the best cumulative time in milliseconds,
+    the slowest direct imports of that run, and which DEFERRED_MODULES were
+    loaded.
+    """
+    env = dict(os.environ) if app_env is None else {**os.environ, "APP_ENV": app_env}
+    best = None
+    for _ in range(runs):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                              capture_output=True, text=True, env=env, check=True)
+        # Each line is "import time: self | cumulative | <indent>name", children
+        # before their parent; interpreter startup imports come first.
+        entries = []
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            _, cumulative, name = line.split("|")
+            entries.append((name.strip(), (len(name) - len(name.lstrip())) // 2, int(cumulative) / 1000))
+        timings = {name: ms for name, _, ms in entries}
+        end = next(i for i, (name, depth, _) in enumerate(entries) if name == module and depth == 0)
+        children = []
+        for name, depth, ms in reversed(entries[:end]):
+            if depth == 0:
+                break
+            if depth == 1:
+                children.append((name, ms))
+        if best is None or timings[module] < best["import_ms"]:
+            slowest = sorted(children, key=lambda item: item[1], reverse=True)[:5]
+            best = {
+                "name": f"import {module}",
+                "import_ms": round(timings[module], 1),
+                "slowest": [[name, round(ms, 1)] for name, ms in slowest],
+                "deferred_loaded": sorted(m for m in DEFERRED_MODULES if m in timings),
+            }
+    best["budget_ms"] = IMPORT_BUDGETS_MS.get(module)
+    return best
+
+def bench_imports(modules=tuple(IMPORT_BUDGETS_MS), runs: int = 3) -> list:
+    return [import_time(module, runs) for module in modules]
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def run(database_url: str, users: int, reminders: int, due_fraction: float = 0.1,
+        latency_ms: float = 20, concurrency: int = SMS_CONCURRENCY, transport: str = "threads",
+        provider: str = "mock", batch_size: int = BULK_BATCH_SIZE, repeat: int = 5, seed: int = 42) -> dict:
+    """Seed a fresh database at `database_url` and run every benchmark; returns the report dict"""
+    engine = make_engine(database_url)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    rng = random.Random(seed)
+    try:
+        benchmarks = bench_bulk_create(session_factory, users, reminders, due_fraction, batch_size, rng)
+        benchmarks.append(bench_get_pending(session_factory, repeat))
+        benchmarks.append(bench_tick(session_factory, provider, latency_ms, concurrency, transport))
+    finally:
+        engine.dispose()
+    return {
+        "revision": _git_revision(),
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "python": platform.python_version(),
+        "database": engine.dialect.name,
+        "params": {
+            "users": users, "reminders": reminders, "due_fraction": due_fraction, "seed": seed,
+            "batch_size": batch_size,
+        },
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "benchmarks": benchmarks,
+    }
+
+def compare(before: dict, after: dict):
+    """Print per-benchmark throughput and latency changes between two reports"""
+    print(f"{before['revision']} -> {after['revision']}")
+    old = {b["name"]: b for b in before["benchmarks"]}
+    for bench in after["benchmarks"]:
+        base = old.get(bench["name"])
+        if base is None:
+            continue
+        parts = []
+        for key in ("throughput_per_s", "p50_ms", "p99_ms", "peak_memory_mb", "import_ms"):
+            if key in bench and base.get(key):
+                parts.append(f"{key} {base[key]} -> {bench[key]} ({(bench[key] / base[key] - 1) * 100:+.1f}%)")
+        print(f"  {bench['name']}: " + ", ".join(parts))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark reminder dispatch on synthetic data.")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--reminders", type=int, default=10000)
+    parser.add_argument("--due-fraction", type=float, default=0.1, help="share of reminders already due")
+    parser.add_argument("--latency-ms", type=float, default=20, help="injected provider latency per message")
+    parser.add_argument("--concurrency", type=int, default=SMS_CONCURRENCY)
+    parser.add_argument("--transport", choices=["threads", "async"], default="threads")
+    parser.add_argument("--provider", choices=["mock", "http"], default="mock")
+    parser.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE)
+    parser.add_argument("--repeat", type=int, default=5, help="get_pending_reminders runs")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--database-url", help="default: a temporary SQLite file")
+    parser.add_argument("-o", "--output", help="write the JSON report here")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two saved reports")
+    parser.add_argument("--imports", action="store_true", help="only measure entry point import times")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f, open(args.compare[1]) as g:
+            compare(json.load(f), json.load(g))
+        return 0
+
+    if args.imports:
+        report = {"revision": _git_revision(), "python": platform.python_version(),
+                  "benchmarks": bench_imports(runs=args.repeat)}
+        text = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(text + "\n")
+        print(text)
+        over = [b["name"] for b in report["benchmarks"] if b["import_ms"] > b["budget_ms"]]
+        return 1 if over else 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        report = run(args.database_url or f"sqlite:///{tmp}/benchmark.db", args.users, args.reminders,
+                     args.due_fraction, args.latency_ms, args.concurrency, args.transport, args.provider,
+                     args.batch_size, args.repeat, args.seed)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Bulk-load users or reminders from CSV or JSONL files.
+
+    python import_data.py users users.csv
+    python import_data.py reminders campaign.jsonl --batch-size 10000
+
+Reminder rows need `scheduled_time` (ISO 8601, UTC if no offset), either
+`user_id` or the user's `phone_number`, and either `message` or a
+`template_id` with `variables` for its placeholders (a JSON object; in CSV,
+a JSON-encoded cell).
+"""
+
+import argparse
+import csv
+import json
+import sys
+from app.config import BULK_BATCH_SIZE
+from app.database import SessionLocal, init_db
+from app.services import bulk_create_users, bulk_create_reminders
+
+def _csv_record(row: dict, line_number: int):
+    # Empty cells mean "not given"; variables arrive JSON-encoded
+    record = {key: value for key, value in row.items() if value not in ("", None)}
+    if "variables" in record:
+        try:
+            record["variables"] = json.loads(record["variables"])
+        except json.JSONDecodeError as e:
+            return ValueError(f"line {line_number}: variables: invalid JSON: {e.msg}")
+    return record
+
+def _jsonl_record(line: str, line_number: int):
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError as e:
+        return ValueError(f"line {line_number}: invalid JSON: {e.msg} at column {e.colno}")
+    if not isinstance(record, dict):
+        return ValueError(f"line {line_number}: expected a JSON object")
+    return record
+
+def read_records(path: str, fmt: str = None):
+    """
+    Stream dicts from a .csv or .jsonl/.ndjson file without loading it whole.
+    A line or cell that does not parse is yielded as a ValueError in its
+    place, so the bulk loaders report it as a row error and carry on.
+    """
+    fmt = fmt or ("csv" if path.endswith(".csv") else "jsonl")
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield _csv_record(row, reader.line_num)
+        else:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if line:
+                    yield _jsonl_record(line, line_number)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import users or reminders.")
+    parser.add_argument("kind", choices=["users", "reminders"])
+    parser.add_argument("path", help="input file (.csv, .jsonl or .ndjson)")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="override format detection")
+    parser.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    init_db()
+    db = SessionLocal()
+    try:
+        records = read_records(args.path, args.format)
+        if args.kind == "users":
+            stats = bulk_create_users(db, records, args.batch_size)
+        else:
+            stats = bulk_create_reminders(db, records, args.batch_size)
+    finally:
+        db.close()
+
+    print(f"Imported {stats.inserted} {args.kind} in {stats.elapsed:.2f}s "
+          f"({stats.rows_per_second:,.0f} rows/s), skipped {stats.skipped}, rejected {len(stats.errors)}")
+    for row_number, message in stats.errors[:20]:
+        print(f"  row {row_number}: {message}")
+    if len(stats.errors) > 20:
+        print(f"  ... and {len(stats.errors) - 20} more")
+    return 1 if stats.errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
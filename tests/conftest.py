@@ -0,0 +1,47 @@
+import os
+
+os.environ.setdefault("APP_ENV", "test")
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.models import Base
+from app.templates import template_cache
+from app.user_cache import user_cache
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    # Every test gets a fresh database, so cached ids from an earlier one are wrong
+    user_cache.clear()
+    template_cache.clear()
+    yield
+    user_cache.clear()
+    template_cache.clear()
+
+@pytest.fixture(scope="function")
+def db_session():
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    try:
+        yield session
+    finally:
+        session.close()
+    Base.metadata.drop_all(engine)
+
+@pytest.fixture(scope="function")
+def session_factory():
+    """In-memory database shared across sessions and threads, for scheduler tests"""
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    Base.metadata.create_all(engine)
+    try:
+        yield sessionmaker(bind=engine)
+    finally:
+        Base.metadata.drop_all(engine)
+        engine.dispose()
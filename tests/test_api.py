@@ -0,0 +1,118 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+from app.api import app
+from app.database import get_async_db, make_async_engine
+from app.models import Base
+
+@pytest.fixture
+def client(tmp_path):
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    url = f"sqlite:///{tmp_path / 'api.db'}"
+    sync_engine = create_engine(url)
+    Base.metadata.create_all(sync_engine)
+    sync_engine.dispose()
+    factory = async_sessionmaker(make_async_engine(url, poolclass=NullPool), expire_on_commit=False)
+
+    async def override_db():
+        async with factory() as db:
+            yield db
+
+    app.dependency_overrides[get_async_db] = override_db
+    try:
+        yield TestClient(app)
+    finally:
+        app.dependency_overrides.clear()
+
+def test_user_lifecycle(client):
+    response = client.post("/users", json={"phone_number": "+916395429850", "timezone": "Asia/Kolkata"})
+    assert response.status_code == 201
+    assert response.json()["opt_out"] is False
+    assert client.post("/users", json={"phone_number": "+916395429850"}).status_code == 409
+    assert client.post("/users", json={"phone_number": "+1555", "timezone": "Bad/Zone"}).status_code == 422
+
+    response = client.post("/opt-out", json={"phone_number": "+916395429850", "opt_out": True})
+    assert response.json()["opt_out"] is True
+    assert client.get("/users/+916395429850").json()["opt_out"] is True
+    assert client.post("/opt-out", json={"phone_number": "+10000000000", "opt_out": True}).status_code == 404
+
+def test_user_reads_go_through_the_cache(client):
+    from app.user_cache import user_cache
+    user_id = client.post("/users", json={"phone_number": "+916395429850"}).json()["id"]
+    assert client.get("/users/+916395429850").json()["id"] == user_id
+    hits = user_cache.hits
+    assert client.get("/users/+91 63954 29850").json()["id"] == user_id
+    assert client.post("/reminders", json={
+        "user_id": user_id, "message": "Hello", "scheduled_time": "2030-01-01T10:00:00",
+    }).status_code == 201
+    assert user_cache.hits == hits + 2
+
+def test_reminder_scheduling_and_status(client):
+    user_id = client.post("/users", json={"phone_number": "+916395429850"}).json()["id"]
+    response = client.post("/reminders", json={
+        "user_id": user_id, "message": "Hello", "scheduled_time": "2030-01-01T10:00:00+05:30",
+    })
+    assert response.status_code == 201
+    reminder = response.json()
+    assert reminder["scheduled_time"] == "2030-01-01T04:30:00"
+    assert client.get(f"/reminders/{reminder['id']}").json()["sent"] is False
+    assert client.get("/reminders/999").status_code == 404
+    assert client.post("/reminders", json={
+        "user_id": 999, "message": "Nobody", "scheduled_time": "2030-01-01T10:00:00",
+    }).status_code == 404
+
+    response = client.post("/reminders/batch", json=[
+        {"user_id": user_id, "message": f"Batch {i}", "scheduled_time": "2030-01-02T10:00:00"}
+        for i in range(3)
+    ])
+    assert response.json() == {"inserted": 3, "skipped": 0, "errors": []}
+
+def test_series_lifecycle(client):
+    user_id = client.post("/users", json={"phone_number": "+916395429850"}).json()["id"]
+    series = {"user_id": user_id, "message": "Pill", "rule": "FREQ=DAILY;COUNT=3",
+              "start_time": "2030-01-01T09:00:00"}
+    response = client.post("/series", json=series)
+    assert response.status_code == 201
+    created = response.json()
+    assert created["next_occurrence"] == "2030-01-01T09:00:00" and created["active"] is True
+    assert client.post("/series", json={**series, "rule": "FREQ=SOMETIMES"}).status_code == 422
+    assert client.post("/series", json={**series, "user_id": 999}).status_code == 404
+
+    cancelled = client.delete(f"/series/{created['id']}").json()
+    assert cancelled["active"] is False and cancelled["next_occurrence"] is None
+    assert client.delete("/series/999").status_code == 404
+
+def test_templated_reminders(client):
+    user_id = client.post("/users", json={"phone_number": "+916395429850"}).json()["id"]
+    response = client.post("/templates", json={"name": "visit", "body": "Hi {name}, your visit is at {time}"})
+    assert response.status_code == 201
+    template = response.json()
+    assert (template["encoding"], template["segments"]) == ("GSM-7", 1)
+    assert client.post("/templates", json={"name": "visit", "body": "Again"}).status_code == 409
+    assert client.post("/templates", json={"name": "bad", "body": "Hi {name"}).status_code == 422
+    assert client.get(f"/templates/{template['id']}").json()["body"] == template["body"]
+
+    reminder = {"user_id": user_id, "scheduled_time": "2030-01-01T10:00:00", "template_id": template["id"]}
+    response = client.post("/reminders", json={**reminder, "variables": {"name": "Ann", "time": "10:00"}})
+    assert response.status_code == 201
+    assert response.json()["variables"] == {"name": "Ann", "time": "10:00"}
+    assert client.post("/reminders", json={**reminder, "variables": {"name": "Ann"}}).status_code == 422
+
+def test_accounts_and_priority(client):
+    response = client.post("/accounts", json={"name": "clinic", "weight": 2})
+    assert response.status_code == 201
+    account = response.json()
+    assert client.post("/accounts", json={"name": "clinic"}).status_code == 409
+    assert client.post("/accounts", json={"name": "free", "weight": 0}).status_code == 422
+    assert client.post("/users", json={"phone_number": "+15550001111", "account_id": 999}).status_code == 404
+    user = client.post("/users", json={"phone_number": "+916395429850", "account_id": account["id"]}).json()
+    assert user["account_id"] == account["id"]
+
+    reminder = {"user_id": user["id"], "message": "Your code is 1234", "scheduled_time": "2030-01-01T10:00:00"}
+    assert client.post("/reminders", json=reminder).json()["priority"] == 1
+    assert client.post("/reminders", json={**reminder, "priority": "high"}).json()["priority"] == 2
+    assert client.post("/reminders", json={**reminder, "priority": "urgent"}).status_code == 422
+    assert client.post("/reminders", json={**reminder, "priority": 3}).status_code == 422
+    for bad in (None, [1], {"lane": 1}):
+        assert client.post("/reminders", json={**reminder, "priority": bad}).status_code == 422
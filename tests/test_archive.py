@@ -0,0 +1,49 @@
+import gzip
+import json
+from datetime import datetime, timedelta
+from app.archive import archive_sent_reminders, JsonlExporter
+from app.models import Reminder, ArchivedReminder, DeliveryLog
+from app.services import create_user, create_reminder, mark_reminders_sent
+
+def _sent_reminders(db, count, sent_at):
+    user = create_user(db, "+15550004444")
+    reminders = [create_reminder(db, user.id, f"Old {i}", sent_at - timedelta(hours=1)) for i in range(count)]
+    mark_reminders_sent(db, [(r.id, f"SM{r.id:032d}") for r in reminders])
+    db.query(Reminder).update({Reminder.updated_at: sent_at}, synchronize_session=False)
+    db.commit()
+    return user, [(r.id, r.scheduled_time) for r in reminders]
+
+def test_archive_moves_old_sent_reminders_in_batches(db_session):
+    now = datetime.utcnow()
+    user, old = _sent_reminders(db_session, 5, now - timedelta(days=40))
+    pending_id = create_reminder(db_session, user.id, "Pending", now + timedelta(days=1)).id
+
+    archived = archive_sent_reminders(db_session, now - timedelta(days=30), batch_size=2)
+
+    assert archived == 5
+    assert [r.id for r in db_session.query(Reminder).all()] == [pending_id]
+    rows = db_session.query(ArchivedReminder).order_by(ArchivedReminder.id).all()
+    assert [r.id for r in rows] == [reminder_id for reminder_id, _ in old]
+    assert rows[0].provider_sid == f"SM{old[0][0]:032d}" and rows[0].archived_at is not None
+    # The delivery log is kept
+    assert db_session.query(DeliveryLog).count() == 5
+
+def test_archive_keeps_recent_history(db_session):
+    now = datetime.utcnow()
+    _sent_reminders(db_session, 2, now - timedelta(days=1))
+    assert archive_sent_reminders(db_session, now - timedelta(days=30)) == 0
+    assert db_session.query(Reminder).count() == 2
+
+def test_archive_exports_monthly_jsonl(db_session, tmp_path):
+    now = datetime.utcnow()
+    _, old = _sent_reminders(db_session, 3, now - timedelta(days=40))
+    exporter = JsonlExporter(str(tmp_path))
+
+    assert archive_sent_reminders(db_session, now - timedelta(days=30), batch_size=2, export=exporter) == 3
+
+    path = exporter.path_for(old[0][1])
+    with gzip.open(path, "rt") as f:
+        rows = [json.loads(line) for line in f]
+    assert [row["id"] for row in rows] == [reminder_id for reminder_id, _ in old]
+    assert db_session.query(Reminder).count() == 0
+    assert db_session.query(ArchivedReminder).count() == 0
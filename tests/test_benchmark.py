@@ -0,0 +1,35 @@
+import json
+import random
+from datetime import datetime
+import benchmark
+from app import scheduler
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 101))
+    assert benchmark.percentile(values, 50) == 50
+    assert benchmark.percentile(values, 99) == 99
+    assert benchmark.percentile([], 50) == 0.0
+
+def test_generators_are_reproducible():
+    now = datetime(2024, 1, 1)
+    first = list(benchmark.generate_reminders(50, 10, random.Random(1), 0.5, now))
+    second = list(benchmark.generate_reminders(50, 10, random.Random(1), 0.5, now))
+    assert first == second
+    assert any(r["scheduled_time"] <= now for r in first) and any(r["scheduled_time"] > now for r in first)
+    users = list(benchmark.generate_users(20, random.Random(1)))
+    assert len({u["phone_number"] for u in users}) == 20
+
+def test_benchmark_report(tmp_path):
+    deliver = scheduler.deliver
+    output = tmp_path / "bench.json"
+    benchmark.main(["--users", "20", "--reminders", "200", "--due-fraction", "0.5", "--latency-ms", "1",
+                    "--repeat", "2", "--database-url", f"sqlite:///{tmp_path}/bench.db", "-o", str(output)])
+    report = json.loads(output.read_text())
+    results = {b["name"]: b for b in report["benchmarks"]}
+    assert set(results) == {"bulk_create_users", "bulk_create_reminders", "get_pending_reminders",
+                            "check_and_send_reminders"}
+    assert results["bulk_create_reminders"]["count"] == 200
+    tick = results["check_and_send_reminders"]
+    assert tick["count"] == results["get_pending_reminders"]["count"] > 0
+    assert tick["failed"] == 0 and tick["p99_ms"] >= tick["p50_ms"] > 0
+    assert scheduler.deliver is deliver
@@ -0,0 +1,17 @@
+from sqlalchemy import text
+from app.database import make_engine
+
+def test_make_engine_tunes_sqlite_file(tmp_path):
+    engine = make_engine(f"sqlite:///{tmp_path / 'tuned.db'}")
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+    engine.dispose()
+
+def test_make_engine_in_memory_sqlite():
+    engine = make_engine("sqlite:///:memory:")
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "memory"
+        assert conn.execute(text("SELECT 1")).scalar() == 1
+    engine.dispose()
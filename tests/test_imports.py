@@ -0,0 +1,16 @@
+import pytest
+import benchmark
+
+@pytest.mark.parametrize("module", sorted(benchmark.IMPORT_BUDGETS_MS))
+def test_import_defers_heavy_modules(module):
+    assert benchmark.import_time(module, runs=1)["deferred_loaded"] == []
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("module", sorted(benchmark.IMPORT_BUDGETS_MS))
+def test_import_time_budget(module):
+    result = benchmark.import_time(module)
+    assert result["import_ms"] <= benchmark.IMPORT_BUDGETS_MS[module], result["slowest"]
+
+def test_scheduler_defers_provider_outside_tests():
+    # With the real provider selected, the Twilio SDK still waits for the first send
+    assert benchmark.import_time("app.scheduler", runs=1, app_env="production")["deferred_loaded"] == []
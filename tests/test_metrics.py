@@ -0,0 +1,89 @@
+import urllib.request
+from datetime import datetime, timedelta
+import pytest
+from app import metrics, scheduler
+from app.profiling import profile_tick
+from app.services import create_user, create_reminder, opt_out_user
+from app.twilio_client import DeliveryError
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram("test_latency_seconds", "Test", ["op"], buckets=(0.1, 1.0))
+    try:
+        histogram.observe(0.05, op="a")
+        histogram.observe(0.1, op="a")
+        histogram.observe(5, op="a")
+        lines = histogram.render()
+    finally:
+        metrics._registry.remove(histogram)
+    assert 'test_latency_seconds_bucket{op="a",le="0.1"} 2' in lines
+    assert 'test_latency_seconds_bucket{op="a",le="1.0"} 2' in lines
+    assert 'test_latency_seconds_bucket{op="a",le="+Inf"} 3' in lines
+    assert 'test_latency_seconds_count{op="a"} 3' in lines
+
+def test_labels_must_match():
+    with pytest.raises(ValueError):
+        metrics.REMINDERS_FAILED.inc()
+
+@pytest.mark.asyncio
+async def test_tick_records_metrics(session_factory, monkeypatch, tmp_path):
+    def fake_deliver(to, body):
+        if body == "bad":
+            raise DeliveryError("21211: invalid", code=21211, permanent=True)
+        return "SM" + "1" * 32
+    monkeypatch.setattr(scheduler, "deliver", fake_deliver)
+    db = session_factory()
+    past = datetime.utcnow() - timedelta(minutes=2)
+    user = create_user(db, "+15550001111")
+    quiet = create_user(db, "+15550002222")
+    create_reminder(db, user.id, "ok", past)
+    create_reminder(db, user.id, "bad", past)
+    create_reminder(db, quiet.id, "held", past)
+    opt_out_user(db, quiet.phone_number)
+    db.close()
+
+    await scheduler.check_and_send_reminders(session_factory)
+    scheduler.update_backlog_gauges(session_factory)
+
+    assert metrics.REMINDERS_DUE.value() == 2
+    assert metrics.REMINDERS_SENT.value() == 1
+    assert metrics.REMINDERS_FAILED.value(permanent=True) == 1
+    assert metrics.REMINDERS_DEAD.value() == 1
+    assert metrics.REMINDERS_OPTED_OUT.value() == 1
+    assert metrics.DISPATCH_QUEUE_DEPTH.value() == 0
+    assert metrics.PROVIDER_CALL_SECONDS.count() == 2
+    assert metrics.DELIVERY_LATENESS_SECONDS.count(lane="normal") == 1
+    assert metrics.DB_QUERY_SECONDS.count(operation="claim") == 2
+
+    path = tmp_path / "reminders.prom"
+    metrics.write_textfile(str(path))
+    text = path.read_text()
+    assert "reminders_sent_total 1" in text
+    assert "# TYPE delivery_lateness_seconds histogram" in text
+
+def test_metrics_http_server():
+    metrics.REMINDERS_SENT.inc(3)
+    server = metrics.start_http_server(0, host="127.0.0.1")
+    try:
+        port = server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            body = response.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert "reminders_sent_total 3" in body
+
+def test_profile_tick_writes_report(tmp_path):
+    with profile_tick("cprofile", str(tmp_path)):
+        sum(range(1000))
+    assert len(list(tmp_path.glob("tick-*.prof"))) == 1
+    with profile_tick("", str(tmp_path)) as prof:
+        assert prof is None
+    with pytest.raises(ValueError):
+        with profile_tick("perf", str(tmp_path)):
+            pass
@@ -0,0 +1,92 @@
+from datetime import datetime
+from sqlalchemy import create_engine, inspect, text
+from app.migrations import upgrade_schema
+
+def test_upgrade_schema_adds_missing_columns(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        # Schema as created by the first release
+        conn.execute(text(
+            "CREATE TABLE users (id INTEGER NOT NULL PRIMARY KEY, phone_number VARCHAR NOT NULL UNIQUE, "
+            "timezone VARCHAR, opt_out BOOLEAN)"
+        ))
+        conn.execute(text(
+            "CREATE TABLE reminders (id INTEGER NOT NULL PRIMARY KEY, user_id INTEGER REFERENCES users (id), "
+            "message VARCHAR NOT NULL, scheduled_time DATETIME NOT NULL, sent BOOLEAN)"
+        ))
+        conn.execute(text("INSERT INTO users VALUES (1, '+916395429850', 'UTC', 0)"))
+        conn.execute(text("INSERT INTO reminders VALUES (1, 1, 'Old', '2024-01-01 00:00:00', 0)"))
+
+    upgrade_schema(engine)
+    upgrade_schema(engine)  # idempotent
+
+    columns = {c["name"] for c in inspect(engine).get_columns("reminders")}
+    assert "provider_sid" in columns
+    indexes = {i["name"] for i in inspect(engine).get_indexes("reminders")}
+    assert "ix_reminders_due" in indexes
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT message FROM reminders")).scalar() == "Old"
+    engine.dispose()
+
+def test_upgrade_schema_backfills_phone_e164(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE users (id INTEGER NOT NULL PRIMARY KEY, phone_number VARCHAR NOT NULL UNIQUE, "
+            "timezone VARCHAR, opt_out BOOLEAN)"
+        ))
+        conn.execute(text("INSERT INTO users VALUES (1, '+91 63954 29850', 'UTC', 0)"))
+        conn.execute(text("INSERT INTO users VALUES (2, '+916395429850', 'UTC', 0)"))  # same number
+        conn.execute(text("INSERT INTO users VALUES (3, 'not a number', 'UTC', 0)"))
+
+    upgrade_schema(engine)
+
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT id, phone_e164 FROM users ORDER BY id")).all()
+    assert rows == [(1, "+916395429850"), (2, None), (3, None)]
+    indexes = {i["name"]: i for i in inspect(engine).get_indexes("users")}
+    assert indexes["ix_users_phone_e164"]["unique"]
+    engine.dispose()
+
+def test_upgrade_schema_copies_accounts_to_pending_reminders(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    upgrade_schema(engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO accounts (id, name, weight) VALUES (1, 'clinic', 2)"))
+        conn.execute(text("INSERT INTO users (id, phone_number, timezone, opt_out, account_id) "
+                          "VALUES (1, '+916395429850', 'UTC', 0, 1)"))
+        # Reminders written before reminders.account_id was filled in
+        conn.execute(text("INSERT INTO reminders (id, user_id, message, scheduled_time, priority, sent) "
+                          "VALUES (1, 1, 'Pending', '2030-01-01 00:00:00', 1, 0), "
+                          "(2, 1, 'Sent', '2024-01-01 00:00:00', 1, 1)"))
+
+    upgrade_schema(engine)
+
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT id, account_id FROM reminders ORDER BY id")).all()
+    assert rows == [(1, 1), (2, None)]
+    assert "ix_reminders_lane" in {i["name"] for i in inspect(engine).get_indexes("reminders")}
+    engine.dispose()
+
+def test_upgrade_schema_backfills_updated_at_for_archiving(tmp_path):
+    from sqlalchemy.orm import sessionmaker
+    from app.archive import archive_sent_reminders
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE users (id INTEGER NOT NULL PRIMARY KEY, phone_number VARCHAR NOT NULL UNIQUE, "
+            "timezone VARCHAR, opt_out BOOLEAN)"
+        ))
+        conn.execute(text(
+            "CREATE TABLE reminders (id INTEGER NOT NULL PRIMARY KEY, user_id INTEGER REFERENCES users (id), "
+            "message VARCHAR NOT NULL, scheduled_time DATETIME NOT NULL, sent BOOLEAN)"
+        ))
+        conn.execute(text("INSERT INTO users VALUES (1, '+916395429850', 'UTC', 0)"))
+        conn.execute(text("INSERT INTO reminders VALUES (1, 1, 'Delivered', '2024-01-01 00:00:00', 1)"))
+
+    upgrade_schema(engine)
+
+    db = sessionmaker(bind=engine)()
+    assert archive_sent_reminders(db, before=datetime(2024, 1, 2)) == 1
+    db.close()
+    engine.dispose()
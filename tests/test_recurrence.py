@@ -0,0 +1,72 @@
+import pytest
+from datetime import datetime, timedelta
+from app.models import Reminder, ReminderSeries
+from app.recurrence import parse_rule, next_occurrence
+from app.services import create_user, create_series, cancel_series, defer_reminders, mark_reminders_sent
+
+def test_parse_rule():
+    rule = parse_rule("FREQ=WEEKLY;INTERVAL=2;BYDAY=WE,MO;COUNT=10")
+    assert rule.freq == "WEEKLY" and rule.interval == 2
+    assert rule.byday == (0, 2)
+    assert rule.count == 10
+    with pytest.raises(ValueError):
+        parse_rule("FREQ=YEARLY")
+    with pytest.raises(ValueError):
+        parse_rule("FREQ=DAILY;BYDAY=MO")
+
+def test_daily_rule_keeps_local_time_across_dst():
+    rule = parse_rule("FREQ=DAILY")
+    start = datetime(2024, 3, 9, 14, 0)  # 09:00 EST
+    after_dst = next_occurrence(rule, start, start, "America/New_York")
+    assert after_dst == datetime(2024, 3, 10, 13, 0)  # 09:00 EDT
+
+def test_weekly_byday_and_monthly_rules():
+    weekly = parse_rule("FREQ=WEEKLY;BYDAY=MO,FR")
+    start = datetime(2024, 1, 1, 9, 0)  # Monday
+    friday = next_occurrence(weekly, start, start, "UTC")
+    assert friday == datetime(2024, 1, 5, 9, 0)
+    assert next_occurrence(weekly, start, friday, "UTC") == datetime(2024, 1, 8, 9, 0)
+
+    monthly = parse_rule("FREQ=MONTHLY")
+    start = datetime(2024, 1, 31, 12, 0)
+    assert next_occurrence(monthly, start, start, "UTC") == datetime(2024, 3, 31, 12, 0)
+
+def test_series_materializes_one_occurrence_and_rolls_forward(db_session):
+    user = create_user(db_session, "+916395429850", "Asia/Kolkata")
+    start = datetime.utcnow() - timedelta(minutes=1)
+    series = create_series(db_session, user.id, "Daily pill", "FREQ=DAILY;COUNT=2", start)
+    pending = db_session.query(Reminder).filter(Reminder.sent == False).all()
+    assert [(r.series_id, r.scheduled_time) for r in pending] == [(series.id, start)]
+
+    mark_reminders_sent(db_session, [(pending[0].id, "SM1")])
+    mark_reminders_sent(db_session, [pending[0].id])  # repeated mark is a no-op
+    pending = db_session.query(Reminder).filter(Reminder.sent == False).all()
+    assert [r.scheduled_time for r in pending] == [start + timedelta(days=1)]
+
+    # COUNT=2 reached: sending the second occurrence ends the series
+    mark_reminders_sent(db_session, [pending[0].id])
+    assert db_session.query(Reminder).filter(Reminder.sent == False).count() == 0
+    db_session.refresh(series)
+    assert series.active is False
+
+def test_deferred_occurrence_still_advances_series(db_session):
+    user = create_user(db_session, "+916395429850")
+    start = datetime.utcnow() - timedelta(minutes=1)
+    series = create_series(db_session, user.id, "Daily pill", "FREQ=DAILY", start)
+    pending = db_session.query(Reminder).filter(Reminder.sent == False).one()
+    # Quiet hours push the occurrence back; sending it must still roll forward
+    defer_reminders(db_session, [(pending.id, start + timedelta(hours=8))])
+    mark_reminders_sent(db_session, [(pending.id, "SM1")])
+    mark_reminders_sent(db_session, [pending.id])
+
+    pending = db_session.query(Reminder).filter(Reminder.sent == False).all()
+    assert [r.scheduled_time for r in pending] == [start + timedelta(days=1)]
+    db_session.refresh(series)
+    assert series.next_occurrence == start + timedelta(days=1) and series.active is True
+
+def test_cancel_series_drops_pending_occurrence(db_session):
+    user = create_user(db_session, "+916395429850")
+    series = create_series(db_session, user.id, "Standup", "FREQ=DAILY", datetime.utcnow() + timedelta(hours=1))
+    cancel_series(db_session, series.id)
+    assert db_session.query(Reminder).count() == 0
+    assert db_session.get(ReminderSeries, series.id).active is False
@@ -1,25 +1,13 @@
 import pytest
 from datetime import datetime, timedelta
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from app.models import Base, User, Reminder
+from app.models import User, Reminder, DeliveryLog
 from app.services import (
     create_user, get_user_by_phone, opt_out_user, opt_in_user,
-    create_reminder, get_pending_reminders, mark_reminder_sent
+    create_reminder, get_pending_reminders, mark_reminder_sent, mark_reminders_sent,
+    iter_pending_reminders, iter_due_dispatch, claim_due_reminders, release_reminders,
+    bulk_create_users, bulk_create_reminders, record_delivery_failures
 )
 
-@pytest.fixture(scope="function")
-def db_session():
-    engine = create_engine("sqlite:///:memory:")
-    Base.metadata.create_all(engine)
-    Session = sessionmaker(bind=engine)
-    session = Session()
-    try:
-        yield session
-    finally:
-        session.close()
-    Base.metadata.drop_all(engine)
-
 def test_create_user(db_session):
     user = create_user(db_session, "+916395429850", "Asia/Kolkata")
     assert user.phone_number == "+916395429850"
@@ -53,3 +41,201 @@ def test_mark_reminder_sent(db_session):
     reminder = create_reminder(db_session, user.id, "Send and Mark", time_ago)
     rem2 = mark_reminder_sent(db_session, reminder.id)
     assert rem2.sent is True
+
+def test_mark_reminders_sent_bulk(db_session):
+    user = create_user(db_session, "+916395429850")
+    time_ago = datetime.utcnow() - timedelta(minutes=2)
+    ids = [create_reminder(db_session, user.id, f"Bulk {i}", time_ago).id for i in range(4)]
+    updated = mark_reminders_sent(db_session, [ids[0], ids[1], (ids[2], "SM123")])
+    assert updated == 3
+    rows = {r.id: r for r in db_session.query(Reminder).all()}
+    assert rows[ids[0]].sent is True and rows[ids[0]].provider_sid is None
+    assert rows[ids[2]].sent is True and rows[ids[2]].provider_sid == "SM123"
+    assert rows[ids[3]].sent is False
+    assert [r.id for r in get_pending_reminders(db_session)] == [ids[3]]
+
+def test_iter_pending_reminders_keyset_chunks(db_session):
+    user = create_user(db_session, "+916395429850")
+    base = datetime.utcnow() - timedelta(minutes=10)
+    # Two reminders share a scheduled_time to exercise the (time, id) tiebreak
+    times = [base, base, base + timedelta(minutes=1), base + timedelta(minutes=2), base + timedelta(minutes=3)]
+    ids = [create_reminder(db_session, user.id, f"Msg {i}", t).id for i, t in enumerate(times)]
+    create_reminder(db_session, user.id, "Future", datetime.utcnow() + timedelta(hours=1))
+
+    chunks = list(iter_pending_reminders(db_session, chunk_size=2))
+    assert [len(c) for c in chunks] == [2, 2, 1]
+    assert [r.id for c in chunks for r in c] == ids
+
+def test_due_index_used_for_pending_scan(db_session):
+    from sqlalchemy import text
+    plan = db_session.execute(text(
+        "EXPLAIN QUERY PLAN SELECT id FROM reminders WHERE sent = 0 AND scheduled_time <= '2030-01-01' "
+        "ORDER BY scheduled_time, id"
+    )).fetchall()
+    assert any("ix_reminders_due" in row[-1] for row in plan)
+
+def test_iter_due_dispatch_projects_user_fields(db_session):
+    user = create_user(db_session, "+916395429850", "Asia/Kolkata")
+    create_reminder(db_session, user.id, "Projected", datetime.utcnow() - timedelta(minutes=1))
+    opted_out = create_user(db_session, "+919302626292")
+    create_reminder(db_session, opted_out.id, "Hidden", datetime.utcnow() - timedelta(minutes=1))
+    opt_out_user(db_session, "+919302626292")
+
+    rows = [row for chunk in iter_due_dispatch(db_session) for row in chunk]
+    assert len(rows) == 1
+    row = rows[0]
+    assert (row.user_id, row.phone_number, row.timezone, row.message) == \
+        (user.id, "+916395429850", "Asia/Kolkata", "Projected")
+    assert row.opt_out is False
+
+def test_create_user_rejects_unknown_timezone(db_session):
+    with pytest.raises(ValueError):
+        create_user(db_session, "+916395429850", "Mars/Olympus_Mons")
+    assert get_user_by_phone(db_session, "+916395429850") is None
+
+def test_user_create_schema_validates_timezone():
+    from pydantic import ValidationError
+    from app.schemas import UserCreate
+    assert UserCreate(phone_number="+916395429850", timezone="Asia/Kolkata").timezone == "Asia/Kolkata"
+    with pytest.raises(ValidationError):
+        UserCreate(phone_number="+916395429850", timezone="Not/AZone")
+
+def test_timezone_registry_caches_lookups():
+    from app.timezones import get_timezone, is_valid_timezone
+    assert get_timezone("America/New_York") is get_timezone("America/New_York")
+    assert is_valid_timezone("UTC")
+    assert not is_valid_timezone("Nowhere/Special")
+
+def test_claim_due_reminders_is_disjoint_and_reclaims_expired(db_session):
+    user = create_user(db_session, "+916395429850")
+    time_ago = datetime.utcnow() - timedelta(minutes=2)
+    ids = [create_reminder(db_session, user.id, f"Claim {i}", time_ago).id for i in range(5)]
+
+    first = claim_due_reminders(db_session, "worker-a", limit=3)
+    second = claim_due_reminders(db_session, "worker-b", limit=3)
+    assert [r.id for r in first] == ids[:3]
+    assert [r.id for r in second] == ids[3:]
+    assert first[0].phone_number == "+916395429850"
+    assert claim_due_reminders(db_session, "worker-c") == []
+
+    # worker-a died; once its lease expires the rows are claimable again
+    later = datetime.utcnow() + timedelta(seconds=301)
+    reclaimed = claim_due_reminders(db_session, "worker-c", lease_seconds=300, now=later)
+    assert [r.id for r in reclaimed] == ids
+
+def test_release_and_mark_sent_clear_lease(db_session):
+    user = create_user(db_session, "+916395429850")
+    time_ago = datetime.utcnow() - timedelta(minutes=2)
+    ids = [create_reminder(db_session, user.id, f"Lease {i}", time_ago).id for i in range(2)]
+    claim_due_reminders(db_session, "worker-a")
+    assert release_reminders(db_session, [ids[0]], "worker-b") == 0
+    assert release_reminders(db_session, [ids[0]], "worker-a") == 1
+    mark_reminders_sent(db_session, [(ids[1], "SM1")])
+    assert [r.id for r in claim_due_reminders(db_session, "worker-b")] == [ids[0]]
+    sent = db_session.get(Reminder, ids[1])
+    assert sent.lease_owner is None and sent.lease_expires_at is None
+
+def test_bulk_create_users_validates_and_skips_duplicates(db_session):
+    create_user(db_session, "+916395429850")
+    rows = [
+        {"phone_number": "+916395429850", "timezone": "UTC"},
+        {"phone_number": "+919302626292", "timezone": "Asia/Kolkata"},
+        {"phone_number": "+919302626292", "timezone": "Asia/Kolkata"},
+        {"phone_number": "+14155550100", "timezone": "Bad/Zone"},
+        {"phone_number": "+14155550101"},
+    ]
+    stats = bulk_create_users(db_session, rows, batch_size=2)
+    assert stats.inserted == 2
+    assert stats.skipped == 2
+    assert [number for number, _ in stats.errors] == [4]
+    assert get_user_by_phone(db_session, "+14155550101").timezone == "UTC"
+
+def test_bulk_create_reminders_resolves_phone_numbers(db_session):
+    user = create_user(db_session, "+916395429850")
+    rows = [
+        {"user_id": user.id, "message": "By id", "scheduled_time": "2024-01-01T09:00:00"},
+        {"phone_number": "+916395429850", "message": "By phone", "scheduled_time": "2024-01-01T15:00:00+05:30"},
+        {"phone_number": "+10000000000", "message": "Nobody", "scheduled_time": "2024-01-01T09:00:00"},
+        {"phone_number": "+916395429850", "message": "No time"},
+    ]
+    stats = bulk_create_reminders(db_session, rows, batch_size=3)
+    assert stats.inserted == 2
+    assert [number for number, _ in stats.errors] == [3, 4]
+    stored = {r.message: r.scheduled_time for r in db_session.query(Reminder).all()}
+    assert stored["By phone"] == datetime(2024, 1, 1, 9, 30)
+
+def test_bulk_create_reminders_rejects_unknown_user_ids(db_session):
+    user = create_user(db_session, "+916395429850")
+    rows = [
+        {"user_id": user.id, "message": "Known", "scheduled_time": "2024-01-01T09:00:00"},
+        {"user_id": user.id + 100, "message": "Orphan", "scheduled_time": "2024-01-01T09:00:00"},
+    ]
+    stats = bulk_create_reminders(db_session, rows)
+    assert stats.inserted == 1
+    assert stats.errors == [(2, f"user_id: unknown user {user.id + 100}")]
+    assert [r.message for r in db_session.query(Reminder).all()] == ["Known"]
+
+def test_bulk_create_reminders_reports_bad_priorities(db_session):
+    user = create_user(db_session, "+916395429850")
+    rows = [{"user_id": user.id, "message": f"Row {i}", "scheduled_time": "2024-01-01T09:00:00", "priority": priority}
+            for i, priority in enumerate([None, [2], {"lane": 2}, "high"])]
+    stats = bulk_create_reminders(db_session, rows)
+    assert stats.inserted == 1
+    assert [number for number, error in stats.errors if error.startswith("priority")] == [1, 2, 3]
+
+def test_import_reports_malformed_jsonl_lines_and_continues(db_session, tmp_path):
+    from import_data import read_records
+    user = create_user(db_session, "+916395429850")
+    path = tmp_path / "reminders.jsonl"
+    path.write_text(
+        f'{{"user_id": {user.id}, "message": "First", "scheduled_time": "2024-01-01T09:00:00"}}\n'
+        '{"user_id": 1, "message": "Broken\n'
+        '[1, 2]\n'
+        f'{{"user_id": {user.id}, "message": "Last", "scheduled_time": "2024-01-01T09:00:00"}}\n'
+    )
+    stats = bulk_create_reminders(db_session, read_records(str(path)), batch_size=1)
+    assert stats.inserted == 2
+    assert [number for number, _ in stats.errors] == [2, 3]
+    assert stats.errors[0][1].startswith("line 2: invalid JSON")
+    assert stats.errors[1][1] == "line 3: expected a JSON object"
+
+def test_record_delivery_failures_backs_off_until_dead(db_session):
+    user = create_user(db_session, "+916395429850")
+    reminder = create_reminder(db_session, user.id, "Retry me", datetime.utcnow() - timedelta(minutes=1))
+    now = datetime.utcnow()
+    for attempt in range(1, 3):
+        assert record_delivery_failures(db_session, [(reminder.id, "timeout", False)], now, max_attempts=3) == 0
+        db_session.refresh(reminder)
+        assert reminder.attempts == attempt
+        assert reminder.next_attempt_at > now
+        assert get_pending_reminders(db_session) == []
+        now = reminder.next_attempt_at
+    assert [r.id for r in claim_due_reminders(db_session, "worker-a", now=now)] == [reminder.id]
+    assert record_delivery_failures(db_session, [(reminder.id, "timeout", False)], now, max_attempts=3) == 1
+    db_session.refresh(reminder)
+    assert reminder.status == "dead"
+    assert claim_due_reminders(db_session, "worker-a", now=now + timedelta(days=1)) == []
+
+def test_retry_delay_grows_with_jitter():
+    from app.services import retry_delay
+    first, fifth = retry_delay(1).total_seconds(), retry_delay(5).total_seconds()
+    assert 15 <= first <= 30
+    assert 240 <= fifth <= 480
+
+def test_delivery_log_records_every_attempt(db_session):
+    user = create_user(db_session, "+15550003333")
+    now = datetime.utcnow()
+    first = create_reminder(db_session, user.id, "One", now)
+    second = create_reminder(db_session, user.id, "Two", now)
+    record_delivery_failures(db_session, [(first.id, "timeout", False)], now)
+    mark_reminders_sent(db_session, [(first.id, "SM" + "a" * 32)])
+    mark_reminder_sent(db_session, second.id, "SM" + "b" * 32)
+
+    log = db_session.query(DeliveryLog).order_by(DeliveryLog.id).all()
+    assert [(entry.reminder_id, entry.status, entry.provider_sid) for entry in log] == [
+        (first.id, "failed", None),
+        (first.id, "sent", "SM" + "a" * 32),
+        (second.id, "sent", "SM" + "b" * 32),
+    ]
+    assert log[0].error == "timeout"
+    assert db_session.get(Reminder, second.id).provider_sid == "SM" + "b" * 32
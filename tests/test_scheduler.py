@@ -0,0 +1,516 @@
+import asyncio
+import pytest
+from datetime import datetime, timedelta
+from app import metrics, providers, scheduler
+from app.scheduler import Dispatcher, check_and_send_reminders
+from app.models import Reminder
+from app.transport import PooledAsyncHttpClient
+from app.twilio_client import DeliveryError
+from app.services import (
+    create_user, create_reminder, create_template, create_account, claim_due_reminders,
+    add_reminder_listener, remove_reminder_listener
+)
+
+@pytest.fixture
+def sent_messages(monkeypatch):
+    sent = []
+    def fake_send(to, body):
+        sent.append((to, body))
+        return "SM" + "0" * 32
+    monkeypatch.setattr(scheduler, "deliver", fake_send)
+    return sent
+
+def test_create_reminder_notifies_listeners(session_factory):
+    seen = []
+    add_reminder_listener(seen.append)
+    try:
+        db = session_factory()
+        user = create_user(db, "+916395429850")
+        reminder = create_reminder(db, user.id, "Ping", datetime.utcnow())
+        db.close()
+    finally:
+        remove_reminder_listener(seen.append)
+    assert seen == [reminder.scheduled_time]
+
+@pytest.mark.asyncio
+async def test_check_and_send_reminders_sends_due(session_factory, sent_messages):
+    db = session_factory()
+    user = create_user(db, "+916395429850", "Asia/Kolkata")
+    create_reminder(db, user.id, "Due", datetime.utcnow() - timedelta(minutes=1))
+    create_reminder(db, user.id, "Future", datetime.utcnow() + timedelta(hours=1))
+    db.close()
+    await check_and_send_reminders(session_factory)
+    assert sent_messages == [("+916395429850", "Due")]
+
+@pytest.mark.asyncio
+async def test_dispatcher_wakes_on_new_reminder_and_stops(session_factory, sent_messages):
+    dispatcher = Dispatcher(session_factory=session_factory, max_sleep=30)
+    task = asyncio.create_task(dispatcher.run(handle_signals=False))
+    await asyncio.sleep(0.05)
+
+    db = session_factory()
+    user = create_user(db, "+916395429850")
+    create_reminder(db, user.id, "Wake up", datetime.utcnow())
+    db.close()
+
+    for _ in range(100):
+        if sent_messages:
+            break
+        await asyncio.sleep(0.01)
+    assert sent_messages == [("+916395429850", "Wake up")]
+
+    dispatcher.stop()
+    await asyncio.wait_for(task, timeout=1)
+
+@pytest.mark.asyncio
+async def test_dispatcher_survives_failing_passes(session_factory, sent_messages, monkeypatch):
+    real_sweep = scheduler.check_and_send_reminders
+    failures = []
+    async def flaky_sweep(*args, **kwargs):
+        if len(failures) < 2:
+            failures.append(1)
+            raise RuntimeError("database is down")
+        return await real_sweep(*args, **kwargs)
+    monkeypatch.setattr(scheduler, "check_and_send_reminders", flaky_sweep)
+
+    db = session_factory()
+    user = create_user(db, "+916395429850")
+    create_reminder(db, user.id, "Still sent", datetime.utcnow() - timedelta(minutes=1))
+    db.close()
+
+    dispatcher = Dispatcher(session_factory=session_factory, max_sleep=30, error_backoff=0.01)
+    task = asyncio.create_task(dispatcher.run(handle_signals=False))
+    for _ in range(100):
+        if sent_messages:
+            break
+        await asyncio.sleep(0.01)
+    assert len(failures) == 2
+    assert sent_messages == [("+916395429850", "Still sent")]
+    assert not task.done()
+
+    dispatcher.stop()
+    await asyncio.wait_for(task, timeout=1)
+
+@pytest.mark.asyncio
+async def test_send_reminders_concurrently_bounds_in_flight(monkeypatch):
+    import threading, time
+    lock = threading.Lock()
+    state = {"in_flight": 0, "peak": 0}
+    def slow_send(to, body):
+        with lock:
+            state["in_flight"] += 1
+            state["peak"] = max(state["peak"], state["in_flight"])
+        time.sleep(0.02)
+        with lock:
+            state["in_flight"] -= 1
+        if body == "fail":
+            raise DeliveryError("boom")
+        return f"SM-{body}"
+    monkeypatch.setattr(scheduler, "deliver", slow_send)
+
+    jobs = [(i, f"+1555000{i:04d}", "fail" if i == 3 else str(i)) for i in range(12)]
+    results = await scheduler.send_reminders_concurrently(jobs, concurrency=4, rate_limit=0)
+
+    assert [r.reminder_id for r in results] == list(range(12))
+    assert results[3].sid is None and results[3].error == "boom"
+    assert results[5].sid == "SM-5"
+    assert 1 < state["peak"] <= 4
+
+@pytest.mark.asyncio
+async def test_send_reminders_concurrently_async_transport(monkeypatch):
+    state = {"in_flight": 0, "peak": 0}
+    async def slow_send(to, body):
+        state["in_flight"] += 1
+        state["peak"] = max(state["peak"], state["in_flight"])
+        await asyncio.sleep(0.02)
+        state["in_flight"] -= 1
+        if body == "fail":
+            raise DeliveryError("boom", permanent=True)
+        return f"SM-{body}"
+    monkeypatch.setattr(scheduler, "deliver_async", slow_send)
+
+    jobs = [(i, f"+1555000{i:04d}", "fail" if i == 2 else str(i)) for i in range(10)]
+    results = await scheduler.send_reminders_concurrently(jobs, concurrency=3, rate_limit=0, transport="async")
+
+    assert [r.sid for r in results][:2] == ["SM-0", "SM-1"]
+    assert results[2].sid is None and results[2].permanent is True
+    assert state["peak"] == 3
+
+@pytest.mark.asyncio
+async def test_token_bucket_limits_rate():
+    import time
+    from app.rate_limiter import TokenBucket
+    bucket = TokenBucket(rate=50, capacity=1)
+    start = time.monotonic()
+    for _ in range(6):
+        await bucket.acquire()
+    # First token is available immediately, the next five take 1/50s each
+    assert time.monotonic() - start >= 5 / 50 * 0.9
+
+@pytest.mark.asyncio
+async def test_rate_limit_holds_across_pages(session_factory, sent_messages):
+    import time
+    db = session_factory()
+    for i in range(23):
+        user = create_user(db, f"+1555000{i:04d}")
+        create_reminder(db, user.id, f"Due {i}", datetime.utcnow() - timedelta(minutes=1))
+    db.close()
+    start = time.monotonic()
+    await check_and_send_reminders(session_factory, rate_limit=20, chunk_size=5)
+    # A burst of 20, then three more at 1/20s each; a bucket per page would
+    # let every page burst
+    assert len(sent_messages) == 23
+    assert time.monotonic() - start >= 3 / 20 * 0.9
+
+@pytest.mark.asyncio
+async def test_check_and_send_reminders_flushes_in_chunks(session_factory, sent_messages):
+    from app.models import Reminder
+    db = session_factory()
+    user = create_user(db, "+916395429850")
+    for i in range(5):
+        create_reminder(db, user.id, f"Due {i}", datetime.utcnow() - timedelta(minutes=1))
+    db.close()
+    results = await check_and_send_reminders(session_factory, concurrency=2, batch_size=2)
+    assert len(results) == 5
+    db = session_factory()
+    rows = db.query(Reminder).all()
+    assert all(r.sent for r in rows)
+    assert all(r.provider_sid for r in rows)
+    db.close()
+
+@pytest.mark.asyncio
+async def test_check_and_send_reminders_issues_one_select_per_page(session_factory, sent_messages):
+    from sqlalchemy import event
+    db = session_factory()
+    for i in range(6):
+        user = create_user(db, f"+1555000{i:04d}")
+        create_reminder(db, user.id, f"Due {i}", datetime.utcnow() - timedelta(minutes=1))
+    db.close()
+
+    engine = session_factory.kw["bind"]
+    selects = []
+    def count_selects(conn, cursor, statement, *args):
+        if statement.lstrip().upper().startswith("SELECT"):
+            selects.append(statement)
+    event.listen(engine, "before_cursor_execute", count_selects)
+    try:
+        await check_and_send_reminders(session_factory, chunk_size=100)
+    finally:
+        event.remove(engine, "before_cursor_execute", count_selects)
+
+    assert len(sent_messages) == 6
+    # One page read plus one recurring-series check for the single flush,
+    # independent of the number of reminders; no per-row user loads.
+    assert len(selects) == 2
+    assert not any("WHERE users.id = ?" in statement for statement in selects)
+
+@pytest.mark.asyncio
+async def test_check_and_send_reminders_claims_long_id_lists_in_chunks(session_factory, sent_messages):
+    db = session_factory()
+    user = create_user(db, "+916395429850")
+    due = create_reminder(db, user.id, "Due", datetime.utcnow() - timedelta(minutes=1))
+    db.close()
+    # More ids than SQLite will bind in one statement (250000 in common builds)
+    results = await check_and_send_reminders(session_factory, reminder_ids=range(due.id, due.id + 300000),
+                                             chunk_size=10000)
+    assert [r.reminder_id for r in results] == [due.id]
+    assert sent_messages == [("+916395429850", "Due")]
+
+@pytest.mark.asyncio
+async def test_parallel_sweeps_do_not_double_send(session_factory, sent_messages):
+    db = session_factory()
+    for i in range(20):
+        user = create_user(db, f"+1555000{i:04d}")
+        create_reminder(db, user.id, f"Due {i}", datetime.utcnow() - timedelta(minutes=1))
+    db.close()
+    await asyncio.gather(
+        check_and_send_reminders(session_factory, chunk_size=3, worker_id="worker-a"),
+        check_and_send_reminders(session_factory, chunk_size=3, worker_id="worker-b"),
+    )
+    assert sorted(body for _, body in sent_messages) == sorted(f"Due {i}" for i in range(20))
+
+@pytest.mark.asyncio
+async def test_slow_page_keeps_its_lease(session_factory, monkeypatch):
+    import time
+    sent = []
+    def slow_send(to, body):
+        time.sleep(0.15)
+        sent.append(to)
+        return "SM" + "0" * 32
+    monkeypatch.setattr(scheduler, "deliver", slow_send)
+    db = session_factory()
+    for i in range(4):
+        user = create_user(db, f"+1555000{i:04d}")
+        create_reminder(db, user.id, f"Due {i}", datetime.utcnow() - timedelta(minutes=1))
+    db.close()
+
+    async def steal():
+        # Well past the original 0.3s lease, while the page is still sending
+        await asyncio.sleep(0.45)
+        other = session_factory()
+        try:
+            return claim_due_reminders(other, "worker-b", lease_seconds=60)
+        finally:
+            other.close()
+    _, stolen = await asyncio.gather(
+        check_and_send_reminders(session_factory, concurrency=1, worker_id="worker-a", lease_seconds=0.3),
+        steal(),
+    )
+    assert stolen == []
+    assert len(sent) == 4
+
+def test_outcomes_only_land_on_rows_the_worker_still_leases(session_factory):
+    from app.models import DeliveryLog
+    from app.services import create_series, mark_reminders_sent, record_delivery_failures
+    db = session_factory()
+    user = create_user(db, "+916395429850")
+    series = create_series(db, user.id, "Daily", "FREQ=DAILY", datetime.utcnow() - timedelta(minutes=1))
+    reminder = db.query(Reminder).filter(Reminder.series_id == series.id).one()
+    claim_due_reminders(db, "worker-b")
+    assert mark_reminders_sent(db, [(reminder.id, "SM1")], worker_id="worker-a") == 0
+    record_delivery_failures(db, [(reminder.id, "boom", True)], worker_id="worker-a")
+    db.refresh(reminder)
+    assert not reminder.sent and reminder.status != "dead" and reminder.lease_owner == "worker-b"
+    # Neither a delivery logged nor the series advanced for the lost lease
+    assert db.query(DeliveryLog).count() == 0
+    assert db.query(Reminder).count() == 1
+    assert mark_reminders_sent(db, [(reminder.id, "SM1")], worker_id="worker-b") == 1
+    db.refresh(reminder)
+    assert reminder.provider_sid == "SM1"
+    assert [log.status for log in db.query(DeliveryLog).all()] == ["sent"]
+    assert db.query(Reminder).count() == 2
+    db.close()
+
+@pytest.mark.asyncio
+async def test_failed_sweep_releases_its_claims(session_factory, sent_messages, monkeypatch):
+    db = session_factory()
+    user = create_user(db, "+916395429850")
+    reminder = create_reminder(db, user.id, "Due", datetime.utcnow() - timedelta(minutes=1))
+    db.close()
+    def broken_render(db, rows):
+        raise RuntimeError("template store down")
+    monkeypatch.setattr(scheduler, "render_batch", broken_render)
+    with pytest.raises(RuntimeError):
+        await check_and_send_reminders(session_factory, worker_id="worker-a")
+    db = session_factory()
+    # Claimable by the next sweep at once, not after REMINDER_LEASE_SECONDS
+    assert [row.id for row in claim_due_reminders(db, "worker-b")] == [reminder.id]
+    db.close()
+
+@pytest.mark.asyncio
+async def test_dispatcher_fires_at_scheduled_time_from_index(session_factory, sent_messages):
+    import time
+    db = session_factory()
+    user = create_user(db, "+916395429850")
+    db.close()
+    dispatcher = Dispatcher(session_factory=session_factory, max_sleep=30, refresh_interval=30)
+    task = asyncio.create_task(dispatcher.run(handle_signals=False))
+    await asyncio.sleep(0.05)
+
+    db = session_factory()
+    due_at = datetime.utcnow() + timedelta(seconds=0.3)
+    create_reminder(db, user.id, "On time", due_at)
+    db.close()
+
+    for _ in range(200):
+        if sent_messages:
+            break
+        await asyncio.sleep(0.005)
+    lateness = (datetime.utcnow() - due_at).total_seconds()
+    assert sent_messages == [("+916395429850", "On time")]
+    assert 0 <= lateness < 0.25
+
+    dispatcher.stop()
+    await asyncio.wait_for(task, timeout=1)
+
+@pytest.mark.asyncio
+async def test_failed_sends_back_off_then_dead_letter(session_factory, monkeypatch):
+    from app.models import Reminder
+    calls = []
+    def failing_send(to, body):
+        calls.append(to)
+        if to == "+10000000000":
+            raise DeliveryError("21211: Invalid 'To' Phone Number", code=21211, permanent=True)
+        raise DeliveryError("HTTP 503: unavailable")
+    monkeypatch.setattr(scheduler, "deliver", failing_send)
+
+    db = session_factory()
+    flaky = create_user(db, "+916395429850")
+    invalid = create_user(db, "+10000000000")
+    create_reminder(db, flaky.id, "Flaky", datetime.utcnow() - timedelta(minutes=1))
+    create_reminder(db, invalid.id, "Invalid", datetime.utcnow() - timedelta(minutes=1))
+    db.close()
+
+    await check_and_send_reminders(session_factory)
+    await check_and_send_reminders(session_factory)  # nothing is due again yet
+    assert sorted(calls) == ["+10000000000", "+916395429850"]
+
+    db = session_factory()
+    rows = {r.message: r for r in db.query(Reminder).all()}
+    assert rows["Invalid"].status == "dead"
+    assert rows["Flaky"].status == "pending"
+    assert rows["Flaky"].attempts == 1
+    assert rows["Flaky"].next_attempt_at > datetime.utcnow()
+    assert rows["Flaky"].lease_owner is None
+    assert "503" in rows["Flaky"].last_error
+    db.close()
+
+@pytest.mark.asyncio
+async def test_coalesces_co_due_reminders_per_user(session_factory, sent_messages):
+    db = session_factory()
+    past = datetime.utcnow() - timedelta(minutes=1)
+    busy = create_user(db, "+15550005555")
+    other = create_user(db, "+15550006666")
+    busy_ids = [create_reminder(db, busy.id, f"Task {i}", past + timedelta(seconds=i)).id for i in range(3)]
+    create_reminder(db, other.id, "Solo", past)
+    db.close()
+
+    results = await check_and_send_reminders(session_factory, coalesce_messages=True)
+
+    assert sorted(sent_messages) == [("+15550005555", "Task 0\nTask 1\nTask 2"), ("+15550006666", "Solo")]
+    assert len(results) == 4
+    db = session_factory()
+    assert all(db.get(Reminder, reminder_id).sent for reminder_id in busy_ids)
+    db.close()
+
+@pytest.mark.asyncio
+async def test_quiet_hours_defer_instead_of_sending(session_factory, sent_messages):
+    db = session_factory()
+    now = datetime.utcnow()
+    # A window covering the current UTC hour, ending on the next full hour
+    start = (now - timedelta(hours=1)).time().replace(second=0, microsecond=0)
+    end = (now + timedelta(hours=1)).time().replace(minute=0, second=0, microsecond=0)
+    sleeper = create_user(db, "+15550007777", "UTC", start, end)
+    awake = create_user(db, "+15550008888")
+    deferred_id = create_reminder(db, sleeper.id, "Later", now - timedelta(minutes=1)).id
+    create_reminder(db, awake.id, "Now", now - timedelta(minutes=1))
+    db.close()
+
+    results = await check_and_send_reminders(session_factory)
+
+    assert sent_messages == [("+15550008888", "Now")]
+    assert len(results) == 1
+    db = session_factory()
+    deferred = db.get(Reminder, deferred_id)
+    assert deferred.sent is False and deferred.lease_owner is None
+    assert deferred.scheduled_time == datetime.combine((now + timedelta(hours=1)).date(), end)
+    db.close()
+
+@pytest.mark.asyncio
+async def test_templated_reminders_are_rendered_per_page(session_factory, sent_messages):
+    db = session_factory()
+    past = datetime.utcnow() - timedelta(minutes=1)
+    template = create_template(db, "appointment", "Hi {name}, see you at {time}")
+    for i, name in enumerate(["Ann", "Bo"]):
+        user = create_user(db, f"+1555000900{i}")
+        create_reminder(db, user.id, None, past, template.id, {"name": name, "time": "9:00"})
+    plain = create_user(db, "+15550009009")
+    create_reminder(db, plain.id, "Plain text", past)
+    db.close()
+
+    await check_and_send_reminders(session_factory)
+
+    assert sorted(sent_messages) == [
+        ("+15550009000", "Hi Ann, see you at 9:00"),
+        ("+15550009001", "Hi Bo, see you at 9:00"),
+        ("+15550009009", "Plain text"),
+    ]
+
+def test_claim_drains_higher_lanes_first(session_factory):
+    db = session_factory()
+    user = create_user(db, "+15550009100")
+    now = datetime.utcnow()
+    # The bulk blast is older, but newer urgent reminders still go first
+    for i in range(5):
+        create_reminder(db, user.id, f"Bulk {i}", now - timedelta(minutes=10), priority=0)
+    create_reminder(db, user.id, "Normal", now - timedelta(minutes=1))
+    create_reminder(db, user.id, "High", now, priority=2)
+
+    pages = [[row.message for row in claim_due_reminders(db, "w1", 3, now=now)] for _ in range(3)]
+    assert pages == [["High", "Normal", "Bulk 0"], ["Bulk 1", "Bulk 2", "Bulk 3"], ["Bulk 4"]]
+    db.close()
+
+def test_claim_shares_lane_between_accounts_by_weight(session_factory):
+    db = session_factory()
+    big = create_account(db, "big", weight=3)
+    small = create_account(db, "small")
+    now = datetime.utcnow()
+    for account, prefix in ((big, "+1555001"), (small, "+1555002")):
+        for i in range(20):
+            user = create_user(db, f"{prefix}{i:04d}", account_id=account.id)
+            create_reminder(db, user.id, account.name, now - timedelta(seconds=i))
+    loner = create_user(db, "+15550030000")
+    create_reminder(db, loner.id, "none", now)
+
+    page = [row.message for row in claim_due_reminders(db, "w1", 9, now=now)]
+    # big's backlog doesn't crowd out the others, and it gets 3x small's share
+    assert page.count("big") == 6 and page.count("small") == 2 and page.count("none") == 1
+    # Finish positions 1/3, 2/3, then ties at 1 go to the earliest scheduled
+    assert page[:5] == ["big", "big", "small", "big", "none"]
+    db.close()
+
+def test_reminders_copy_their_users_account(session_factory):
+    from app.services import bulk_create_reminders, create_series, mark_reminders_sent
+    db = session_factory()
+    account = create_account(db, "clinic")
+    user = create_user(db, "+15550009300", account_id=account.id)
+    start = datetime.utcnow() - timedelta(minutes=1)
+    single = create_reminder(db, user.id, "One", start)
+    bulk_create_reminders(db, [{"phone_number": user.phone_number, "message": "Bulk", "scheduled_time": start}])
+    series = create_series(db, user.id, "Daily", "FREQ=DAILY", start)
+    first = db.query(Reminder).filter(Reminder.series_id == series.id).one()
+    mark_reminders_sent(db, [first.id])
+
+    db.expire_all()
+    assert single.account_id == account.id
+    assert {r.message: r.account_id for r in db.query(Reminder).filter(Reminder.sent == False)} == \
+        {"One": account.id, "Bulk": account.id, "Daily": account.id}
+    db.close()
+
+@pytest.mark.asyncio
+async def test_lateness_is_recorded_per_lane(session_factory, sent_messages):
+    db = session_factory()
+    user = create_user(db, "+15550009200")
+    past = datetime.utcnow() - timedelta(minutes=1)
+    create_reminder(db, user.id, "OTP", past, priority=2)
+    create_reminder(db, user.id, "Newsletter", past, priority=0)
+    db.close()
+    high, bulk = (metrics.DELIVERY_LATENESS_SECONDS.count(lane=lane) for lane in ("high", "bulk"))
+
+    await check_and_send_reminders(session_factory, coalesce_messages=False)
+
+    assert [body for _, body in sent_messages] == ["OTP", "Newsletter"]
+    assert metrics.DELIVERY_LATENESS_SECONDS.count(lane="high") == high + 1
+    assert metrics.DELIVERY_LATENESS_SECONDS.count(lane="bulk") == bulk + 1
+
+def test_main_upgrades_schema_before_sweeping(monkeypatch):
+    calls = []
+    async def sweep(*args, **kwargs):
+        calls.append("sweep")
+        return []
+    monkeypatch.setattr(scheduler, "init_db", lambda: calls.append("init_db"))
+    monkeypatch.setattr(scheduler, "check_and_send_reminders", sweep)
+    scheduler.main([])
+    assert calls == ["init_db", "sweep"]
+
+def test_main_closes_the_http_session_after_a_one_shot_sweep(monkeypatch):
+    http = PooledAsyncHttpClient()
+    opened = []
+    class AsyncClient:
+        http_client = http
+    async def sweep(*args, **kwargs):
+        opened.append(http._get_session())
+        return []
+    monkeypatch.setattr(scheduler, "init_db", lambda: None)
+    monkeypatch.setattr(scheduler, "check_and_send_reminders", sweep)
+    previous = providers.set_clients(None, AsyncClient())
+    try:
+        scheduler.main([])
+    finally:
+        if previous:
+            providers.set_clients(*previous)
+        else:
+            providers.reset()
+    # Closed inside the sweep's event loop, so aiohttp has no unclosed session to warn about
+    assert opened[0].closed
+    assert http.session is None
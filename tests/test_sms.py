@@ -0,0 +1,35 @@
+from datetime import datetime, time
+from app.quiet_hours import quiet_until
+from app.sms import coalesce, encoded_length, segment_count
+
+def test_segment_count_by_encoding():
+    assert encoded_length("Take your pills") == ("GSM-7", 15)
+    assert segment_count("a" * 160) == 1
+    assert segment_count("a" * 161) == 2
+    assert segment_count("a" * 306) == 2
+    # Extension characters take two septets
+    assert encoded_length("{}")[1] == 4
+    assert segment_count("€" * 81) == 2
+    # One non-GSM character switches the whole message to UCS-2
+    assert encoded_length("Namaste 🙏")[0] == "UCS-2"
+    assert segment_count("ş" * 70) == 1
+    assert segment_count("ş" * 71) == 2
+
+def test_coalesce_packs_within_segment_limit():
+    groups = coalesce(["a" * 100, "b" * 50, "c" * 20, "d" * 300])
+    assert [indexes for indexes, _ in groups] == [[0, 1], [2], [3]]
+    assert groups[0][1] == "a" * 100 + "\n" + "b" * 50
+    assert [indexes for indexes, _ in coalesce(["x"] * 5, max_segments=1)] == [[0, 1, 2, 3, 4]]
+    assert coalesce([]) == []
+
+def test_quiet_until_uses_user_timezone():
+    start, end = time(22, 0), time(7, 0)
+    # 17:30 UTC is 23:00 in Kolkata: quiet until 07:00 IST = 01:30 UTC next day
+    assert quiet_until(datetime(2024, 5, 1, 17, 30), "Asia/Kolkata", start, end) == datetime(2024, 5, 2, 1, 30)
+    # 00:30 UTC is 06:00 IST, still before the end of the window
+    assert quiet_until(datetime(2024, 5, 2, 0, 30), "Asia/Kolkata", start, end) == datetime(2024, 5, 2, 1, 30)
+    # 12:00 UTC is 17:30 IST: not quiet
+    assert quiet_until(datetime(2024, 5, 1, 12, 0), "Asia/Kolkata", start, end) is None
+    assert quiet_until(datetime(2024, 5, 1, 12, 0), "UTC", None, None) is None
+    # A daytime window that does not wrap midnight
+    assert quiet_until(datetime(2024, 5, 1, 13, 0), "UTC", time(12, 0), time(14, 0)) == datetime(2024, 5, 1, 14, 0)
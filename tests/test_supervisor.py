@@ -0,0 +1,96 @@
+import signal
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+from app.database import make_engine
+from app.migrations import upgrade_schema
+from app.supervisor import Supervisor, _shard_limits, _shard_metrics_file
+from app.services import Shard, claim_due_reminders, create_user, create_reminder
+
+def test_claim_only_takes_own_shard(db_session):
+    past = datetime.utcnow() - timedelta(minutes=1)
+    users = [create_user(db_session, f"+1555000{i:04d}") for i in range(6)]
+    for user in users:
+        create_reminder(db_session, user.id, "Hi", past)
+
+    rows = claim_due_reminders(db_session, "w1", shard=Shard(1, 3))
+
+    assert sorted(row.user_id for row in rows) == sorted(u.id for u in users if u.id % 3 == 1)
+
+def test_shard_metrics_file_names():
+    assert _shard_metrics_file("/var/lib/node/reminders.prom", 2) == "/var/lib/node/reminders-shard2.prom"
+    assert _shard_metrics_file("", 2) == ""
+
+def test_shard_limits_split_the_totals():
+    assert _shard_limits(30.0, 10, 4) == (7.5, 2)
+    assert _shard_limits(0, 3, 4) == (0, 1)  # unlimited stays unlimited
+
+def test_supervisor_upgrades_schema_before_starting_workers(tmp_path):
+    url = f"sqlite:///{tmp_path / 'old.db'}"
+    engine = make_engine(url)
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE reminders (id INTEGER NOT NULL PRIMARY KEY, user_id INTEGER, "
+            "message VARCHAR NOT NULL, scheduled_time DATETIME NOT NULL, sent BOOLEAN)"
+        ))
+    supervisor = Supervisor(2, database_url=url, metrics_file="", metrics_port=0, poll_interval=0.01)
+    columns = []
+    def start():
+        with engine.connect() as conn:
+            columns.extend(row[1] for row in conn.execute(text("PRAGMA table_info(reminders)")))
+        supervisor.stop()
+    supervisor.start = start
+    handlers = {sig: signal.getsignal(sig) for sig in (signal.SIGINT, signal.SIGTERM)}
+    try:
+        supervisor.run()
+    finally:
+        for sig, handler in handlers.items():
+            signal.signal(sig, handler)
+    assert "lease_owner" in columns
+    engine.dispose()
+
+def _wait_until(predicate, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.2)
+    return False
+
+def test_supervisor_runs_restarts_and_rebalances_workers(tmp_path):
+    url = f"sqlite:///{tmp_path / 'sharded.db'}"
+    engine = make_engine(url)
+    upgrade_schema(engine)
+    db = sessionmaker(bind=engine)()
+    past = datetime.utcnow() - timedelta(minutes=1)
+    for i in range(8):
+        user = create_user(db, f"+1555100{i:04d}")
+        for n in range(3):
+            create_reminder(db, user.id, f"Reminder {n}", past + timedelta(seconds=n))
+    db.close()
+
+    def unsent():
+        with engine.connect() as conn:
+            return conn.execute(text("SELECT count(*) FROM reminders WHERE sent = 0")).scalar()
+
+    supervisor = Supervisor(2, database_url=url, max_sleep=0.5, metrics_file="", metrics_port=0)
+    supervisor.start()
+    try:
+        assert _wait_until(lambda: unsent() == 0)
+        # A crashed worker is restarted
+        crashed = supervisor.workers[0]
+        crashed.kill()
+        crashed.join()
+        supervisor.check_workers()
+        assert supervisor.workers[0].pid != crashed.pid and supervisor.workers[0].is_alive()
+        # Rebalancing replaces every worker with the new shard count
+        supervisor.resize(3)
+        assert sorted(supervisor.workers) == [0, 1, 2]
+        assert all(p.is_alive() for p in supervisor.workers.values())
+    finally:
+        supervisor.stop_workers()
+    assert supervisor.workers == {}
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM delivery_log")).scalar() == 24
+    engine.dispose()
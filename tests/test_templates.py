@@ -0,0 +1,72 @@
+import pytest
+from datetime import datetime
+from app.models import Reminder
+from app.services import bulk_create_reminders, create_reminder, create_template, create_user
+from app.sms import segment_count
+from app.templates import CompiledTemplate, TemplateCache, render_batch
+
+def test_compile_and_render():
+    template = CompiledTemplate("Hi {name}, {{not a field}} at {time}. Bye {name}")
+    assert template.fields == ("name", "time", "name")
+    assert template.render({"name": "Ann", "time": 9}) == "Hi Ann, {not a field} at 9. Bye Ann"
+    assert template.render({}) == "Hi , {not a field} at . Bye "
+    assert template.missing({"name": "Ann"}) == ["time"]
+    for body in ("Hi {name", "Hi }", "Hi {0}", "Hi {a.b}"):
+        with pytest.raises(ValueError):
+            CompiledTemplate(body)
+
+def test_encoding_and_segments_are_precomputed():
+    template = CompiledTemplate("Dear {name}, " + "x" * 140)
+    assert (template.encoding, template.segments) == ("GSM-7", 1)
+    for name in ("Ann", "Annabelle", "Zoë", "Łucja", "名前", "{curly}"):
+        rendered = template.render({"name": name})
+        assert template.measure({"name": name})[1] == segment_count(rendered)
+    assert template.measure({"name": "Łucja"})[0] == "UCS-2"
+    assert CompiledTemplate("Привет, {name}").encoding == "UCS-2"
+
+def test_create_template_stores_metadata(db_session):
+    template = create_template(db_session, "euro", "Pay €{amount}")
+    assert (template.encoding, template.segments) == ("GSM-7", 1)
+    user = create_user(db_session, "+15550001234")
+    with pytest.raises(ValueError, match="amount"):
+        create_reminder(db_session, user.id, None, datetime(2030, 1, 1), template.id, {})
+    with pytest.raises(ValueError, match="Unknown template"):
+        create_reminder(db_session, user.id, None, datetime(2030, 1, 1), 999, {})
+
+def test_csv_import_reports_bad_variables_cell(db_session, tmp_path):
+    from import_data import read_records
+    template = create_template(db_session, "greeting", "Hi {name}")
+    user = create_user(db_session, "+15550001234")
+    path = tmp_path / "reminders.csv"
+    path.write_text(
+        "user_id,template_id,variables,scheduled_time\n"
+        f'{user.id},{template.id},"{{""name"": ""Ann""}}",2030-01-01T09:00:00\n'
+        f"{user.id},{template.id},{{name: Bob}},2030-01-01T09:00:00\n"
+        f'{user.id},{template.id},"{{""name"": ""Cy""}}",2030-01-01T09:00:00\n'
+    )
+    stats = bulk_create_reminders(db_session, read_records(str(path)))
+    assert stats.inserted == 2
+    assert [(row, error.split(":")[0]) for row, error in stats.errors] == [(2, "line 3")]
+
+def test_bulk_import_and_batch_render(db_session):
+    template = create_template(db_session, "greeting", "Hi {name}")
+    user = create_user(db_session, "+15550001234")
+    stats = bulk_create_reminders(db_session, [
+        {"user_id": user.id, "template_id": template.id, "variables": {"name": "Ann"},
+         "scheduled_time": "2030-01-01T09:00:00"},
+        {"user_id": user.id, "message": "Plain", "scheduled_time": "2030-01-01T09:00:00"},
+        {"user_id": user.id, "template_id": template.id, "variables": {}, "scheduled_time": "2030-01-01T09:00:00"},
+        {"user_id": user.id, "template_id": template.id, "message": "Both", "scheduled_time": "2030-01-01T09:00:00"},
+        {"user_id": user.id, "scheduled_time": "2030-01-01T09:00:00"},
+    ])
+    assert stats.inserted == 2
+    assert [row for row, _ in stats.errors] == [3, 4, 5]
+
+    rows = db_session.query(Reminder.id, Reminder.message, Reminder.template_id, Reminder.variables)\
+        .order_by(Reminder.id).all()
+    assert rows[0].message == "" and rows[0].variables == {"name": "Ann"}
+    assert rows[1].variables is None
+    cache = TemplateCache()
+    assert render_batch(db_session, rows, cache) == {rows[0].id: "Hi Ann"}
+    # Compiled once; later pages reuse the cached template
+    assert cache.get_many(db_session, [template.id])[template.id] is cache.get(db_session, template.id)
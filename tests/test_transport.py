@@ -0,0 +1,46 @@
+import pytest
+from twilio.base.exceptions import TwilioRestException
+from twilio.rest import Client
+from app.fake_provider import FakeProviderServer
+from app.transport import PooledHttpClient, PooledAsyncHttpClient
+
+@pytest.fixture
+def fake_provider():
+    server = FakeProviderServer().start()
+    yield server
+    server.stop()
+
+def test_pooled_client_settings():
+    http = PooledHttpClient(pool_size=7, connect_timeout=2, read_timeout=9)
+    assert http.timeout == (2, 9)
+    adapter = http.session.get_adapter("https://api.twilio.com")
+    assert adapter._pool_maxsize == 7
+
+def test_sync_client_reuses_connection(fake_provider):
+    http = PooledHttpClient(base_url=fake_provider.base_url)
+    client = Client("ACtest", "token", http_client=http)
+    sids = {client.messages.create(to="+15550000001", from_="+15550000000", body=f"hi {i}").sid
+            for i in range(5)}
+    assert len(sids) == 5 and all(sid.startswith("SM") for sid in sids)
+    assert fake_provider.requests == 5
+    # One keep-alive connection served every request
+    assert len(fake_provider.peers) == 1
+
+def test_sync_client_surfaces_provider_errors(fake_provider):
+    fake_provider.failure_rate = 1
+    client = Client("ACtest", "token", http_client=PooledHttpClient(base_url=fake_provider.base_url))
+    with pytest.raises(TwilioRestException) as excinfo:
+        client.messages.create(to="+15550000001", from_="+15550000000", body="hi")
+    assert excinfo.value.code == 21211
+
+@pytest.mark.asyncio
+async def test_async_client_sends(fake_provider):
+    http = PooledAsyncHttpClient(base_url=fake_provider.base_url)
+    client = Client("ACtest", "token", http_client=http)
+    try:
+        message = await client.messages.create_async(to="+15550000001", from_="+15550000000", body="hi")
+    finally:
+        await http.close()
+    assert message.sid.startswith("SM")
+    assert fake_provider.requests == 1
+    assert http.session is None
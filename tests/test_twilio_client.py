@@ -0,0 +1,35 @@
+from twilio.base.exceptions import TwilioRestException
+from app.twilio_client import classify_error
+
+def test_classify_error_marks_permanent_codes():
+    invalid = classify_error(TwilioRestException(400, "/Messages.json", "Invalid 'To' Phone Number", code=21211))
+    assert invalid.permanent is True
+    assert invalid.code == 21211
+    assert "21211" in str(invalid)
+
+    throttled = classify_error(TwilioRestException(429, "/Messages.json", "Too Many Requests", code=20429))
+    assert throttled.permanent is False
+
+    network = classify_error(ConnectionError("connection reset"))
+    assert network.permanent is False and network.code is None
+
+def test_provider_clients_are_built_on_first_send():
+    from app import providers, twilio_client
+    providers.reset()
+    try:
+        assert providers._clients is None
+        assert twilio_client.deliver("+15550001111", "Hi").startswith("SM")
+        assert isinstance(providers.get_clients()[0], providers.MockClient)
+
+        sent = []
+        class Messages:
+            def create(self, to, from_, body):
+                sent.append((to, body))
+                return type("Message", (), {"sid": "SM1"})()
+        class Client:
+            messages = Messages()
+        providers.set_clients(Client(), Client())
+        assert twilio_client.deliver("+15550001111", "Hi") == "SM1"
+        assert sent == [("+15550001111", "Hi")]
+    finally:
+        providers.reset()
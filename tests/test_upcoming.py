@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+from app.services import create_user, create_reminder, mark_reminders_sent, claim_due_reminders
+from app.upcoming import UpcomingIndex
+
+def test_heap_orders_and_drops_stale_entries():
+    index = UpcomingIndex()
+    base = datetime(2030, 1, 1, 9, 0)
+    index.add(1, base + timedelta(seconds=30))
+    index.add(2, base + timedelta(seconds=10))
+    index.add(3, base + timedelta(seconds=20))
+    index.add(2, base + timedelta(seconds=40))  # rescheduled
+    index.discard(3)
+    assert index.next_due() == base + timedelta(seconds=30)
+    assert index.pop_due(base + timedelta(seconds=35)) == [1]
+    assert len(index) == 1
+    assert index.pop_due(base + timedelta(minutes=5)) == [2]
+    assert index.next_due() is None
+
+def test_refresh_is_incremental_and_tracks_window(db_session):
+    user = create_user(db_session, "+916395429850")
+    now = datetime.utcnow()
+    soon = create_reminder(db_session, user.id, "Soon", now + timedelta(minutes=1))
+    later = create_reminder(db_session, user.id, "Later", now + timedelta(minutes=15))
+
+    index = UpcomingIndex(horizon_seconds=600)
+    index.refresh(db_session, now)
+    assert index.next_due() == soon.scheduled_time
+    assert len(index) == 1
+
+    # Sent elsewhere: the next refresh sees the change and drops it
+    mark_reminders_sent(db_session, [soon.id])
+    added = create_reminder(db_session, user.id, "Added", now + timedelta(minutes=2))
+    index.refresh(db_session, now)
+    assert index.next_due() == added.scheduled_time
+    assert len(index) == 1
+
+    # Time moves on: "Later" enters the horizon
+    index.refresh(db_session, now + timedelta(minutes=6))
+    assert len(index) == 2
+
+def test_refresh_defers_leased_reminders(db_session):
+    user = create_user(db_session, "+916395429850")
+    now = datetime.utcnow()
+    create_reminder(db_session, user.id, "Due", now - timedelta(seconds=1))
+    claim_due_reminders(db_session, "other-worker", lease_seconds=60, now=now)
+    index = UpcomingIndex()
+    index.refresh(db_session, now)
+    assert index.next_due() == now + timedelta(seconds=60)
+
+def test_pop_due_stops_at_limit():
+    index = UpcomingIndex()
+    base = datetime(2030, 1, 1, 9, 0)
+    for i in range(5):
+        index.add(i, base + timedelta(seconds=i))
+    assert index.pop_due(base + timedelta(minutes=1), limit=2) == [0, 1]
+    assert index.pop_due(base + timedelta(minutes=1)) == [2, 3, 4]
+
+def test_refresh_skips_opted_out_and_dead_backlog(db_session):
+    from app.services import opt_out_user
+    user = create_user(db_session, "+916395429850")
+    quiet = create_user(db_session, "+14155552671")
+    now = datetime.utcnow()
+    kept = create_reminder(db_session, user.id, "Kept", now + timedelta(minutes=1))
+    dead = create_reminder(db_session, user.id, "Dead", now + timedelta(minutes=1))
+    dead.status = "dead"
+    db_session.commit()
+    create_reminder(db_session, quiet.id, "Muted", now + timedelta(minutes=1))
+    opt_out_user(db_session, quiet.phone_number)
+
+    index = UpcomingIndex(horizon_seconds=600)
+    index.refresh(db_session, now)
+    assert len(index) == 1
+    assert index.pop_due(now + timedelta(minutes=5)) == [kept.id]
@@ -0,0 +1,85 @@
+import time
+import pytest
+from sqlalchemy import event
+from app.phone import normalize_phone
+from app.services import create_user, get_user_by_phone, lookup_user, lookup_user_by_id, opt_out_user
+from app.user_cache import CachedUser, LocalCache, UserCache
+
+def test_normalize_phone_variants():
+    assert normalize_phone("+91 63954-29850") == "+916395429850"
+    assert normalize_phone("0091 (6395) 429850") == "+916395429850"
+    assert normalize_phone("06395429850", default_country_code="91") == "+916395429850"
+    with pytest.raises(ValueError):
+        normalize_phone("6395429850", default_country_code="")
+    with pytest.raises(ValueError):
+        normalize_phone("+12")
+
+def test_local_cache_lru_and_ttl():
+    cache = LocalCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1 and cache.get("c") == 3
+    short = LocalCache(ttl=0.01)
+    short.set("a", 1)
+    time.sleep(0.02)
+    assert short.get("a") is None
+
+def test_lookup_matches_formatting_variants(db_session):
+    user = create_user(db_session, "+916395429850", "Asia/Kolkata")
+    assert get_user_by_phone(db_session, "+91 6395 429 850").id == user.id
+    with pytest.raises(Exception):
+        create_user(db_session, "0091-6395-429850")
+
+def test_lookup_reads_through_and_invalidates(db_session):
+    user = create_user(db_session, "+916395429850", "Asia/Kolkata")
+    statements = []
+    event.listen(db_session.get_bind(), "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+
+    first = lookup_user(db_session, "+91 63954 29850")
+    assert first == CachedUser(user.id, "+916395429850", "Asia/Kolkata", False)
+    assert lookup_user(db_session, "+916395429850") == first
+    assert lookup_user_by_id(db_session, user.id) == first
+    assert len(statements) == 1
+
+    opt_out_user(db_session, "+916395429850")
+    assert lookup_user(db_session, "+916395429850").opt_out is True
+    assert lookup_user_by_id(db_session, user.id).opt_out is True
+
+class BrokenBackend:
+    def get(self, *args):
+        raise ConnectionError("down")
+    set = delete = clear = get
+
+def test_shared_backend_failure_falls_back_to_local():
+    cache = UserCache(LocalCache(), shared=BrokenBackend())
+    user = CachedUser(1, "+15550001111", "UTC", False)
+    cache.put(user)
+    assert cache.get_by_phone("+15550001111") == user
+    cache.invalidate(1, "+15550001111")
+    assert cache.get_by_id(1) is None
+
+class DictBackend:
+    """Stands in for Redis: one store shared by several processes' caches"""
+    def __init__(self):
+        self.store = {}
+    def get(self, key):
+        return self.store.get(key)
+    def set(self, key, value):
+        self.store[key] = value
+    def delete(self, *keys):
+        for key in keys:
+            self.store.pop(key, None)
+    def clear(self):
+        self.store.clear()
+
+def test_invalidation_reaches_other_processes_through_shared_backend():
+    shared = DictBackend()
+    writer, reader = UserCache(LocalCache(), shared), UserCache(LocalCache(), shared)
+    user = CachedUser(1, "+15550001111", "UTC", False)
+    writer.put(user)
+    assert reader.get_by_id(1) == user
+    writer.invalidate(1, "+15550001111")
+    assert reader.get_by_id(1) is None
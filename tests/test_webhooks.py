@@ -0,0 +1,136 @@
+import pytest
+from datetime import datetime
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from app import api
+from app.api import app
+from app.database import get_async_db, make_async_engine
+from app.models import Base, DeliveryLog, User
+from app.services import create_user, lookup_user, mark_reminders_sent, create_reminder
+from app.webhook_replay import generate_callbacks, load_fixture, replay, write_fixture
+from app.webhooks import (
+    CallbackBuffer, CallbackFlusher, OptOutEvent, StatusEvent, apply_callbacks, parse_inbound, parse_status
+)
+
+def test_parse_callbacks():
+    assert parse_status({"MessageSid": "SM1", "MessageStatus": "Delivered"}).status == "delivered"
+    assert parse_status({"MessageSid": "SM1"}) is None
+    assert parse_inbound({"From": "+15550001111", "Body": " stop "}) == OptOutEvent("+15550001111", True)
+    assert parse_inbound({"From": "+15550001111", "Body": "Start"}) == OptOutEvent("+15550001111", False)
+    assert parse_inbound({"From": "+15550001111", "Body": "stop sending me these"}) is None
+    assert parse_inbound({"From": "+15550001111", "Body": "Arrêter", "OptOutType": "STOP"}).opt_out is True
+
+def test_buffer_refuses_when_full():
+    buffer = CallbackBuffer(max_size=2, batch_size=10)
+    assert buffer.offer("a") and buffer.offer("b")
+    assert not buffer.offer("c")
+    assert buffer.rejected == 1
+    batch = buffer.drain()
+    assert batch == ["a", "b"]
+    buffer.requeue(batch)
+    assert buffer.drain(1) == ["a"]
+
+def test_apply_callbacks_collapses_batch(db_session):
+    users = [create_user(db_session, f"+1555000{i:04d}") for i in range(3)]
+    reminders = [create_reminder(db_session, user.id, "Hi", datetime(2030, 1, 1)) for user in users]
+    mark_reminders_sent(db_session, [(r.id, f"SM{r.id}") for r in reminders])
+    lookup_user(db_session, users[0].phone_number)  # cached as opted in
+    now = datetime.utcnow()
+    events = [
+        StatusEvent(f"SM{reminders[0].id}", "delivered", None, now),
+        StatusEvent(f"SM{reminders[0].id}", "sent", None, now),  # late interim status
+        StatusEvent(f"SM{reminders[1].id}", "queued", None, now),
+        StatusEvent(f"SM{reminders[1].id}", "undelivered", "30003", now),
+        OptOutEvent(users[0].phone_number, True),
+        OptOutEvent(users[1].phone_number, True),
+        OptOutEvent(users[1].phone_number, False),
+        OptOutEvent("+15559999999", True),  # unknown number
+    ]
+
+    assert apply_callbacks(db_session, events) == (2, 3)
+    # A later flush can't regress a final status either
+    apply_callbacks(db_session, [StatusEvent(f"SM{reminders[1].id}", "sent", None, now),
+                                 StatusEvent(f"SM{reminders[2].id}", "sent", None, now)])
+
+    db_session.expire_all()
+    logs = {log.provider_sid: log for log in db_session.query(DeliveryLog).all()}
+    assert logs[f"SM{reminders[0].id}"].delivery_status == "delivered"
+    assert logs[f"SM{reminders[1].id}"].delivery_status == "undelivered"
+    assert logs[f"SM{reminders[1].id}"].delivery_error_code == "30003"
+    assert logs[f"SM{reminders[2].id}"].delivery_status == "sent"
+    assert [u.opt_out for u in db_session.query(User).order_by(User.id)] == [True, False, False]
+    assert lookup_user(db_session, users[0].phone_number).opt_out is True
+
+@pytest.fixture
+def webhook_db(tmp_path, monkeypatch):
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    url = f"sqlite:///{tmp_path / 'webhooks.db'}"
+    sync_engine = create_engine(url)
+    Base.metadata.create_all(sync_engine)
+    factory = async_sessionmaker(make_async_engine(url, poolclass=NullPool), expire_on_commit=False)
+
+    async def override_db():
+        async with factory() as db:
+            yield db
+
+    monkeypatch.setattr(api, "callback_buffer", CallbackBuffer(max_size=10000, batch_size=100))
+    app.dependency_overrides[get_async_db] = override_db
+    try:
+        yield sessionmaker(bind=sync_engine), override_db
+    finally:
+        app.dependency_overrides.clear()
+        sync_engine.dispose()
+
+def test_webhook_endpoints_backpressure(webhook_db):
+    from fastapi.testclient import TestClient
+    client = TestClient(app)
+    api.callback_buffer.max_size = 1
+    assert client.post("/webhooks/status", data={"MessageSid": "SM1", "MessageStatus": "sent"}).status_code == 204
+    response = client.post("/webhooks/status", data={"MessageSid": "SM1", "MessageStatus": "delivered"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert client.post("/webhooks/status", data={"MessageSid": "SM1"}).status_code == 422
+    response = client.post("/webhooks/inbound", data={"From": "+15550001111", "Body": "hello"})
+    assert response.status_code == 200 and response.text == "<Response/>"
+    assert len(api.callback_buffer) == 1
+
+@pytest.mark.asyncio
+async def test_replayed_fixture_is_flushed(webhook_db, tmp_path):
+    import httpx
+    session_factory, session_source = webhook_db
+    db = session_factory()
+    users = [create_user(db, f"+1555100{i:04d}") for i in range(20)]
+    reminders = [create_reminder(db, user.id, "Hi", datetime(2030, 1, 1)) for user in users]
+    mark_reminders_sent(db, [(r.id, f"SM{r.id:032x}") for r in reminders])
+    sids = [(f"SM{r.id:032x}", u.phone_number) for r, u in zip(reminders, users)]
+    path = tmp_path / "callbacks.jsonl"
+    write_fixture(path, generate_callbacks(sids=sids, failure_rate=0.2, stop_rate=0.3, seed=7))
+    callbacks = load_fixture(path)
+    assert callbacks == generate_callbacks(sids=sids, failure_rate=0.2, stop_rate=0.3, seed=7)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        async def post(path, form):
+            response = await client.post(path, data=form)
+            return response.status_code, response.headers
+        # One at a time, so each number's STOP and START arrive in fixture order
+        stats = await replay(callbacks, "http://test", concurrency=1, post=post)
+    assert stats["accepted"] == len(callbacks) and stats["failed"] == 0
+    assert await CallbackFlusher(api.callback_buffer, session_source).flush() == len(callbacks)
+
+    expected_status = {}
+    expected_opt_out = {}
+    for callback in callbacks:
+        form = callback["form"]
+        if callback["path"] == "/webhooks/inbound":
+            expected_opt_out[form["From"]] = form["Body"] == "STOP"
+        elif form["MessageStatus"] in ("delivered", "undelivered"):
+            expected_status[form["MessageSid"]] = form["MessageStatus"]
+    db.expire_all()
+    statuses = {log.provider_sid: log.delivery_status for log in db.query(DeliveryLog)}
+    assert statuses == expected_status
+    assert expected_opt_out
+    opted_out = {user.phone_number: user.opt_out for user in db.query(User)}
+    for phone_number, opt_out in expected_opt_out.items():
+        assert opted_out[phone_number] is opt_out
+    db.close()